@@ -0,0 +1,107 @@
+import os, sys, json, time, shutil, argparse, subprocess
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Analyzes a batch of synthetic genomes typed on one panel twice, each time in a fresh process from an empty
+# stage cache and NCBI dataset: once file by file through analyze, as main.py does without --batch, and once
+# through analyze_many. Prints wall time, CPU time and peak RSS of each and checks the reports match.
+
+root = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+modes = ['analyze', 'analyze_many']
+
+def peak_rss_mb():
+    with open('/proc/self/status') as f:
+        return next(int(x.split()[1]) for x in f if x.startswith('VmHWM:')) / 1024
+
+def batch_options(data_folder, args):
+    from benchmarks.pipeline import benchmark_options
+    return benchmark_options(data_folder, pipeline_engine=args.engine, report_formats=['parquet'], public_ncbi_data_policy='generate',
+                             allow_download=False, ncbi_requests_per_second=1000.0, analyze_workers=args.workers)
+
+def child(args):
+    from container import Container
+    container = Container()
+    container.Options.override(batch_options(args.data_folder, args))
+    Container.wire(container)
+    analyzer = container.DNAAnalyzer()
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    if args.mode == 'analyze':
+        for genome in args.genomes:
+            analyzer.analyze(genome)
+    else:
+        analyzer.analyze_many(args.genomes)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'cpu_seconds': time.process_time() - cpu_start, 'peak_rss_mb': peak_rss_mb()}))
+
+def prepare(data_folder, paths, args):
+    from container import Container
+    from benchmarks import synthetic
+    shutil.rmtree(data_folder, ignore_errors=True)
+    os.makedirs(data_folder)
+    container = Container()
+    container.Options.override(batch_options(data_folder, args))
+    Container.wire(container)
+    container.RefSnpStore().put_many(synthetic.read_refsnp_documents(paths['refsnp']))
+    container.CitationsDataframeGenerator().ingest(paths['citations'])
+
+def run(mode, data_folder, genomes, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode, '--data-folder', data_folder, '--engine', args.engine, '--genomes'] + genomes
+    if args.workers is not None:
+        command += ['--workers', str(args.workers)]
+    # children are started from a small parent, the analysis's peak is what shows up in VmHWM
+    output = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def same_reports(first, second, genomes):
+    import pandas as pd
+    for genome in genomes:
+        name = os.path.basename(genome).split('.')[0]
+        paths = [os.path.join(x, 'output', name, f'{name}_variations.parquet') for x in [first, second]]
+        if not pd.read_parquet(paths[0]).equals(pd.read_parquet(paths[1])):
+            return False
+    return True
+
+def main():
+    from src import Options
+    default_folder = os.path.join(Options().data_folder, 'benchmarks')
+    parser = argparse.ArgumentParser(description='Compare analyzing genomes one at a time against analyze_many, offline.')
+    parser.add_argument('--folder', default=default_folder, help='where synthetic inputs are cached and the runs write their data')
+    parser.add_argument('--genome-count', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', choices=['pandas', 'arrow'], default='pandas', help='engine the one at a time runs use')
+    parser.add_argument('--workers', type=int, default=None, help='analyze_many workers (default: one per core)')
+    parser.add_argument('--child', choices=modes, help=argparse.SUPPRESS)
+    parser.add_argument('--data-folder', help=argparse.SUPPRESS)
+    parser.add_argument('--genomes', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        args.mode = args.child
+        return child(args)
+
+    from benchmarks import synthetic
+    from benchmarks.pipeline import prepare_inputs
+    paths = prepare_inputs(args.folder, args.rows, args.seed)
+    genome_folder = os.path.join(args.folder, f'panel-v{synthetic.version}-{args.rows}-{args.seed}-{args.genome_count}')
+    if not os.path.exists(os.path.join(genome_folder, 'complete')):
+        shutil.rmtree(genome_folder, ignore_errors=True)
+        os.makedirs(genome_folder)
+        print(f'Writing {args.genome_count} panel genomes to {genome_folder}')
+        synthetic.write_panel_genomes(genome_folder, args.genome_count, args.rows, args.seed)
+        open(os.path.join(genome_folder, 'complete'), 'w').close()
+    genomes = sorted(os.path.join(genome_folder, x) for x in os.listdir(genome_folder) if x.endswith('.txt'))
+
+    data_folders = {}
+    print(f'\n{"mode":<14} {"seconds":>9} {"cpu":>9} {"peak MB":>9}')
+    for mode in modes:
+        data_folders[mode] = os.path.join(args.folder, f'batch-{mode}')
+        prepare(data_folders[mode], paths, args)
+        result = run(mode, data_folders[mode], genomes, args)
+        print(f'{mode:<14} {result["seconds"]:9.3f} {result["cpu_seconds"]:9.3f} {result["peak_rss_mb"]:9.1f}')
+
+    if not same_reports(data_folders['analyze'], data_folders['analyze_many'], genomes):
+        print('analyze and analyze_many wrote different reports.')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import os, sys, time, argparse
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import *
+from benchmarks import synthetic
+
+# Times GenomeComparer on synthetic families and checks what it finds against how they were built:
+# parents and children share no opposite homozygotes and a segment on every chromosome, siblings
+# share long segments, and genomes from different families share none.
+
+def main():
+    parser = argparse.ArgumentParser(description='Time pairwise IBS and shared segments across synthetic families.')
+    parser.add_argument('--families', type=int, default=16)
+    parser.add_argument('--children', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--block-samples', type=int, default=Options.comparison_block_samples)
+    args = parser.parse_args()
+
+    class ComparisonOptions(Options):
+        comparison_block_samples = args.block_samples
+        instrumentation = 'summary'
+    options = ComparisonOptions()
+    instrumentation = Instrumentation(options=options)
+    comparer = GenomeComparer(options=options, instrumentation=instrumentation, genetic_data_reader=None, refsnp_store=None)
+
+    # the matrix is built a block of genomes at a time, holding a few hundred genome frames at once doesn't fit in memory
+    start = time.perf_counter()
+    batches, genomes, relationships = [], {}, {}
+    for family, family_relationships in synthetic.family_genomes(args.families, args.children, args.rows, args.seed):
+        genomes.update(family)
+        relationships.update(family_relationships)
+        if len(genomes) >= args.block_samples:
+            batches.append(GenotypeMatrix.from_dataframes(genomes))
+            genomes = {}
+    if len(genomes) > 0:
+        batches.append(GenotypeMatrix.from_dataframes(genomes))
+    matrix = GenotypeMatrix.concat(batches)
+    del batches, genomes
+    print(f'{matrix.shape[0]} genomes x {matrix.shape[1]} variants built in {time.perf_counter() - start:.1f}s')
+
+    pairs, segments = comparer.compare(matrix)
+    timings = {x: instrumentation.summary()[f'comparison.{x}']['wall_seconds'] for x in ['references', 'ibs', 'segments']}
+    for name, seconds in timings.items():
+        print(f'{name:<12} {seconds:8.2f}s')
+    print(f'{len(pairs)} pairs, {len(pairs) / sum(timings.values()):.0f} pairs/s, {len(segments)} segments')
+
+    pairs['relationship'] = [relationships.get((a, b), relationships.get((b, a), 'unrelated')) for a, b in zip(pairs['sample_a'], pairs['sample_b'])]
+    pairs['ibs0_fraction'] = pairs['ibs0'] / pairs['overlap']
+    pairs['shared_mb'] = pairs['shared_bp'] / 1e6
+    summary = pairs.groupby('relationship')[['ibs0_fraction', 'ibs_similarity', 'segments', 'shared_mb']].agg(['min', 'max'])
+    print(summary.to_string(float_format=lambda x: f'{x:.3f}'))
+
+    parents = pairs[pairs['relationship'] == 'parent']
+    unrelated = pairs[pairs['relationship'] == 'unrelated']
+    problems = []
+    if (parents['ibs0'] > 0).any():
+        problems.append('a parent and child with opposite homozygotes')
+    if (parents['segments'] < 22).any():
+        problems.append('a parent and child without a segment on every chromosome')
+    if (unrelated['shared_bp'] > 0).any():
+        problems.append('unrelated genomes sharing a segment')
+    for problem in problems:
+        print(f'Found {problem}.')
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
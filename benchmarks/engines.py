@@ -0,0 +1,116 @@
+import os, sys, json, time, shutil, argparse, subprocess, statistics
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Runs a whole analysis (read, citation filter, NCBI join, classification, report) once per engine on the
+# same synthetic genomes, each run in a fresh process with an empty stage cache, and compares wall time,
+# CPU time and peak RSS. The NCBI dataset is built once up front, so no run parses refsnp documents.
+
+root = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+engines = ['pandas', 'arrow']
+
+def analysis_options(data_folder, engine, formats):
+    from benchmarks.pipeline import benchmark_options
+    # rsids the synthetic store doesn't have are still asked for (and refused) on every run, without the rate limit to wait on
+    return benchmark_options(data_folder, pipeline_engine=engine, report_formats=formats, public_ncbi_data_policy='generate',
+                             allow_download=False, ncbi_requests_per_second=1000.0)
+
+def peak_rss_mb():
+    # VmHWM starts over with each process image, ru_maxrss would carry over the parent's peak through exec
+    with open('/proc/self/status') as f:
+        return next(int(x.split()[1]) for x in f if x.startswith('VmHWM:')) / 1024
+
+def child(args):
+    from container import Container
+    container = Container()
+    container.Options.override(analysis_options(args.folder, args.engine, args.formats))
+    Container.wire(container)
+    analyzer = container.DNAAnalyzer()
+    import_rss = peak_rss_mb()
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    analyzer.analyze(args.genome)
+    result = {
+        'seconds': time.perf_counter() - start,
+        'cpu_seconds': time.process_time() - cpu_start,
+        'peak_rss_mb': peak_rss_mb(),
+        'import_rss_mb': import_rss,
+    }
+    print(json.dumps(result))
+
+def prepare(args, paths):
+    from container import Container
+    from benchmarks import synthetic
+    container = Container()
+    container.Options.override(analysis_options(args.data_folder, 'pandas', args.formats))
+    Container.wire(container)
+    print('Seeding the refsnp store and the NCBI dataset')
+    container.RefSnpStore().put_many(synthetic.read_refsnp_documents(paths['refsnp']))
+    container.CitationsDataframeGenerator().ingest(paths['citations'])
+    for name in args.genomes:
+        container.DNAAnalyzer().analyze(paths[name])
+
+def run(args, engine, genome):
+    shutil.rmtree(os.path.join(args.data_folder, 'stage_cache'), ignore_errors=True)
+    shutil.rmtree(os.path.join(args.data_folder, 'output'), ignore_errors=True)
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--engine', engine, '--folder', args.data_folder, '--genome', genome, '--formats'] + args.formats
+    output = subprocess.run(command, cwd=root, check=True, capture_output=True, text=True).stdout
+    report = os.path.join(args.data_folder, 'output', os.path.basename(genome).split('.')[0])
+    return json.loads(output.strip().splitlines()[-1]), report
+
+def same_reports(first, second):
+    import pandas as pd
+    for file in sorted(os.listdir(first)):
+        if file.endswith('.parquet'):
+            if not pd.read_parquet(os.path.join(first, file)).equals(pd.read_parquet(os.path.join(second, file))):
+                return False
+    return True
+
+def main():
+    from src import Options
+    default_folder = os.path.join(Options().data_folder, 'benchmarks')
+    parser = argparse.ArgumentParser(description='Compare the pandas and arrow engines on a whole analysis, offline.')
+    parser.add_argument('--folder', default=default_folder, help='where synthetic inputs are cached and the runs write their data')
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--genomes', nargs='+', choices=['23andme', 'ancestry'], default=['23andme', 'ancestry'])
+    parser.add_argument('--formats', nargs='+', default=['parquet'], help='report formats each run writes')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--engine', choices=engines, help=argparse.SUPPRESS)
+    parser.add_argument('--genome', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    from benchmarks.pipeline import prepare_inputs
+    paths = prepare_inputs(args.folder, args.rows, args.seed)
+    args.data_folder = os.path.join(args.folder, 'engines')
+    shutil.rmtree(args.data_folder, ignore_errors=True)
+    os.makedirs(args.data_folder)
+    prepare(args, paths)
+
+    mismatches = []
+    print(f'\n{"genome":<10} {"engine":<8} {"seconds":>9} {"cpu":>9} {"peak MB":>9} {"import MB":>10}')
+    for name in args.genomes:
+        reports = {}
+        for engine in engines:
+            results = []
+            for _ in range(args.repeat):
+                result, reports[engine] = run(args, engine, paths[name])
+                results.append(result)
+            # reports only survive until the next run clears the output folder, so the last one is kept aside
+            kept = os.path.join(args.data_folder, f'report-{engine}')
+            shutil.rmtree(kept, ignore_errors=True)
+            shutil.copytree(reports[engine], kept)
+            reports[engine] = kept
+            print(f'{name:<10} {engine:<8} {statistics.median(x["seconds"] for x in results):9.3f} {statistics.median(x["cpu_seconds"] for x in results):9.3f} '
+                  f'{statistics.median(x["peak_rss_mb"] for x in results):9.1f} {statistics.median(x["import_rss_mb"] for x in results):10.1f}')
+        if not same_reports(reports['pandas'], reports['arrow']):
+            mismatches.append(name)
+
+    for name in mismatches:
+        print(f'The engines wrote different reports for {name}.')
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import os, sys, time, argparse, subprocess, statistics
+
+root = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+
+def run(args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=root, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def slowest_imports(statement, count):
+    # -X importtime writes 'import time: self [us] | cumulative | imported package' lines to stderr
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=root, check=True, capture_output=True, text=True)
+    packages = {}
+    for line in result.stderr.splitlines()[1:]:
+        _, timings = line.split(':', 1)
+        _, cumulative, name = timings.split('|')
+        package = name.strip().split('.')[0]
+        # the outermost import of a package carries the cumulative time of everything below it
+        packages[package] = max(packages.get(package, 0), int(cumulative))
+    return sorted(((v, k) for k, v in packages.items()), reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description='Time interpreter start-up for the package and the command line.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--genome', default=None, help='also time a cached analysis of this file; the first run warms the cache')
+    parser.add_argument('--ncbi-data', default='public', choices=['public','generate'])
+    args = parser.parse_args()
+
+    commands = {
+        'python -c pass': ['-c', 'pass'],
+        'import src': ['-c', 'import src'],
+        'import container': ['-c', 'import container'],
+        'main.py --help': ['main.py', '--help'],
+    }
+    if args.genome is not None:
+        analyze = ['main.py', '--accept-disclaimer', '--no-download', '--ncbi-data', args.ncbi_data, os.path.abspath(args.genome)]
+        subprocess.run([sys.executable] + analyze, cwd=root, check=True)
+        commands['cached analysis'] = analyze
+
+    for name, command in commands.items():
+        print(f'{name:<20} {run(command, args.repeat):8.3f}s')
+
+    print('\nslowest packages for `import container`:')
+    for cumulative, name in slowest_imports('import container', 10):
+        print(f'{name:<40} {cumulative / 1e6:8.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import pandas as pd
+
+# The per-rsid pandas implementation NCBIDataFrameGenerator used before RefSnpParser, kept as an oracle
+# for ncbi_parser_golden.py --legacy. It reads only what the store has, nothing is downloaded.
+
+class LegacyRefSnpParser:
+    def __init__(self, refsnp_store):
+        self._refsnp_store = refsnp_store
+
+    def _get_variant_description(self, deleted, inserted):
+        if deleted == inserted:
+            return 'std','std',deleted, inserted
+        if deleted.startswith(inserted):
+            del_value = deleted[len(inserted):]
+            return 'del', 'del' + del_value, del_value, ''
+        
+        elif inserted.startswith(deleted):
+            new_alleles = inserted[len(deleted):]
+            if deleted.endswith(new_alleles):
+                return 'dup', 'dup' + new_alleles, '', new_alleles
+            else:
+                return 'ins', 'ins' + new_alleles, '', new_alleles
+        elif (len(deleted) == 1) and (len(inserted) == 1):
+            return 'snv', f'{deleted}>{inserted}', deleted, inserted
+        return 'unknown', 'unknown', deleted, inserted
+
+    
+    def _process_single_frequency(self, frequency):
+        observation = frequency['observation']
+        allele_count = frequency['allele_count']
+        total_count = frequency['total_count']
+        variant_descriptions = self._get_variant_description(observation['deleted_sequence'], observation['inserted_sequence'])
+        return variant_descriptions + (allele_count, total_count)
+
+    def _duplication_reduction(self, frequency_table):
+        if len(frequency_table) < 2:
+            return frequency_table
+        
+        variant_types = frequency_table['variant_type'].drop_duplicates().tolist()
+
+        if ('ins' in variant_types) and ('dup' in variant_types):
+            if len(frequency_table[['inserted','deleted']].drop_duplicates()) == 1:
+                counts = frequency_table.groupby(['inserted','deleted'])[['allele_count','total_count']].sum().reset_index(drop=False)
+                frequency_table = frequency_table[frequency_table['variant_type'] == 'dup'].copy().drop(columns=['allele_count','total_count'])
+                frequency_table = frequency_table.merge(counts, on=['inserted','deleted'], how='inner').reset_index(drop=True)
+                return frequency_table
+            
+        return frequency_table
+    
+    def _merge_standard(self, frequency_table):
+        value_counts = frequency_table['variant_type'].value_counts()
+        if 'std' not in value_counts:
+            return frequency_table
+        
+        num_std = value_counts['std']
+        if num_std == 1:
+            return frequency_table
+        
+        lengths = frequency_table.apply(lambda x: len(x['deleted']), axis=1)
+        frequency_table['lengths'] = lengths
+        short_text = frequency_table.sort_values(by='lengths').iloc[0]['deleted']
+        frequency_table.loc[frequency_table.apply(lambda x: short_text in x.deleted, axis=1), ['deleted','inserted']] = short_text
+        frequency_table = frequency_table.groupby(['variant_type','description','deleted','inserted'])[['allele_count','total_count']].sum().reset_index(drop=False)
+
+        return frequency_table
+
+    def _process_assembly_annotation(self, assembly_annotation, placement_with_alleles):
+        unique_deleted_and_inserted = {(x['allele']['spdi']['deleted_sequence'],x['allele']['spdi']['inserted_sequence'],x['hgvs'].endswith('=')) for p in placement_with_alleles if p['is_ptlp'] for x in p['alleles']}
+        variant_descriptions = [self._get_variant_description(d,i) + (std,) for d,i,std in unique_deleted_and_inserted]
+        return variant_descriptions
+    
+    def _process_assembly_annotations(self, assembly_annotations, placements_with_alleles):
+        result = [x for annotation in assembly_annotations for x in self._process_assembly_annotation(annotation, placements_with_alleles)]
+        return pd.DataFrame(result, columns=['variant_type','description','deleted','inserted','is_ref'])
+
+    def _process_frequencies(self, frequencies):
+        frequency_details = [self._process_single_frequency(frequency) for frequency in frequencies]
+        frequency_df = pd.DataFrame(frequency_details, columns=['variant_type','description','deleted','inserted','allele_count','total_count'])
+        frequency_table = frequency_df.groupby(by=['variant_type','description','deleted','inserted'])[['allele_count','total_count']].sum().reset_index(drop=False)
+        frequency_table = self._duplication_reduction(frequency_table)
+        frequency_table = self._merge_standard(frequency_table)
+        return frequency_table
+    
+    def _process_allele_annotation(self, allele_annotation, placement_with_alleles):
+        assembly_annotations = self._process_assembly_annotations(allele_annotation['assembly_annotation'], placement_with_alleles)
+        if len(allele_annotation['frequency']) > 0:
+            frequency_table = self._process_frequencies(allele_annotation['frequency'])
+            annotations_w_frequency = assembly_annotations.merge(frequency_table, on=['variant_type','description','deleted','inserted'], how='right')
+        else:
+            annotations_w_frequency = assembly_annotations.copy()
+            annotations_w_frequency[['allele_count','total_count']] = [0,0]
+
+        return annotations_w_frequency
+    
+    def _process_allele_annotations(self, allele_annotations, placements_with_allele):
+        dataframes = [self._process_allele_annotation(annotation, placements_with_allele) for annotation in allele_annotations]
+        dataframes = [x for x in dataframes if x is not None]
+        if len(dataframes) > 0:
+            result = pd.concat(dataframes).drop_duplicates()
+            result = result.groupby(['variant_type','description','deleted','inserted','is_ref'])[['allele_count','total_count']].sum().reset_index(drop=False)
+            result['observed_frequency'] = (result['allele_count'] / result['total_count']).fillna(0.0)
+
+            diseases = ', '.join({disease_name for allele_annotation in allele_annotations for clinical in allele_annotation['clinical'] for disease_name in clinical['disease_names'] if disease_name not in ['not_provided','not_specified']})
+            significances = ', '.join({sig for allele_annotation in allele_annotations for clinical in allele_annotation['clinical'] for sig in clinical['clinical_significances']})
+            loci = ', '.join({gene['locus'] for allele_annotation in allele_annotations for assembly_annotation in allele_annotation['assembly_annotation'] for gene in assembly_annotation['genes']})
+            names = ', '.join({gene['name'] for allele_annotation in allele_annotations for assembly_annotation in allele_annotation['assembly_annotation'] for gene in assembly_annotation['genes']})
+            submission_count = len([sub for allele_annotation in allele_annotations for sub in allele_annotation['submissions']])
+
+            result[['diseases','significances','submissions','gene_locus','gene_name']] = [diseases,significances,submission_count,loci,names]
+            result['is_ref'] = result['is_ref'].fillna(result['description'] == 'std')
+            result.loc[result['is_ref'],['diseases','significances']] = ''
+            result = result.drop(columns='is_ref')
+            return result
+
+        return None
+    
+
+    def _get_clinical_implications(self, json_data):
+        result = pd.DataFrame({}, columns=['variant_type','description','deleted','inserted','allele_count','total_count','observed_frequency','diseases','significance','submissions'])
+
+        if 'primary_snapshot_data' not in json_data:
+            return result
+        
+        primary_snapshot_data = json_data['primary_snapshot_data']
+        if 'allele_annotations' not in primary_snapshot_data:
+            return result
+        
+        allele_annotations = primary_snapshot_data['allele_annotations']
+        if len(allele_annotations) == 0:
+            return result
+        
+        placements_with_allele = primary_snapshot_data['placements_with_allele']
+        if len(placements_with_allele) == 0:
+            return result
+        
+        return self._process_allele_annotations(allele_annotations, placements_with_allele)
+
+    def _get_data_for_single_rsid(self, rsid):
+        rsid = self._refsnp_store.canonical_rsids([rsid])[0]
+        json_data = self._refsnp_store.get(rsid)
+        if json_data is None:
+            return None
+
+        if 'merged_snapshot_data' in json_data:
+            merged_snapshot_data = json_data['merged_snapshot_data']
+            if 'merged_into' in merged_snapshot_data:
+                merged_into = merged_snapshot_data['merged_into']
+                if len(merged_into) > 0:
+                    rsid_merged = f'rs{merged_into[0]}'
+                    return self._get_data_for_single_rsid(rsid_merged)
+
+        clinvar = self._get_clinical_implications(json_data)
+
+        return clinvar
+    
+    def get_rsid_data(self, rsid):
+        rsid_data = self._get_data_for_single_rsid(rsid)
+
+        if (rsid_data is None) or (len(rsid_data) == 0):
+            return None
+        
+        rsid_data['rsid'] = rsid
+        return rsid_data
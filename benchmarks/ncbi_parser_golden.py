@@ -0,0 +1,76 @@
+import os, sys, argparse
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+from src import *
+from benchmarks.legacy_refsnp_parser import LegacyRefSnpParser
+
+# Columns built by joining a python set, so their order is not stable between processes.
+set_columns = ['diseases','significances','gene_locus','gene_name']
+
+def normalize(dataframe:pd.DataFrame):
+    dataframe = dataframe.copy()
+    for column in set_columns:
+        dataframe[column] = dataframe[column].map(lambda x: ', '.join(sorted(x.split(', '))) if x else x)
+    sort_columns = ['rsid','variant_type','description','deleted','inserted']
+    return dataframe.sort_values(by=sort_columns).reset_index(drop=True)[RefSnpParser.columns]
+
+def resolve_merged_json(store:RefSnpStore, json_data, max_depth=10):
+    # the document an rsid was merged into, as far as the store has it
+    for _ in range(max_depth):
+        if json_data is None:
+            return None
+        merged_into = json_data.get('merged_snapshot_data', {}).get('merged_into', [])
+        if len(merged_into) == 0:
+            return json_data
+        json_data = store.get(f'rs{merged_into[0]}')
+    return None
+
+def legacy_dataframe(store:RefSnpStore, rsids):
+    legacy = LegacyRefSnpParser(store)
+    frames = [legacy.get_rsid_data(rsid) for rsid in rsids]
+    frames = [x for x in frames if x is not None]
+    return pd.concat(frames) if len(frames) > 0 else pd.DataFrame(columns=RefSnpParser.columns)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare RefSnpParser output against the shipped NCBI table.')
+    parser.add_argument('--reference', default=Options().public_ncbi_dataframe_parquet)
+    parser.add_argument('--legacy', action='store_true', help='also compare against the per-rsid pandas implementation')
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    options = Options()
+    store = RefSnpStore(options)
+    instrumentation = Instrumentation(options)
+    downloader = NCBIDataDownloader(options, RefSnpAsyncDownloader(options, store, instrumentation), store, instrumentation)
+    generator = NCBIDataFrameGenerator(options, downloader, store, RefSnpParser(), NCBIDataset(options), instrumentation,
+                                       RefSnpParseExecutor(options, store, instrumentation))
+
+    reference = pd.read_parquet(args.reference)
+    rsids = sorted(store.existing(reference['rsid'].drop_duplicates()), key=lambda x: int(x.replace('rs', '')))[:args.limit]
+    if len(rsids) == 0:
+        print(f'None of the rsids in {args.reference} are in {options.ncbi_data_store}, nothing to compare.')
+        return 1
+
+    items = ((rsid, resolve_merged_json(store, json_data)) for rsid, json_data in store.get_many(rsids))
+    parsed = normalize(generator._refsnp_parser.parse_many(items))
+    expected = normalize(reference[reference['rsid'].isin(rsids)])
+
+    failed = False
+    comparisons = [('reference', expected)]
+    if args.legacy:
+        comparisons.append(('legacy', normalize(legacy_dataframe(store, rsids))))
+    for name, frame in comparisons:
+        try:
+            pd.testing.assert_frame_equal(parsed, frame, check_dtype=False)
+            print(f'{name}: {len(rsids)} rsids, {len(parsed)} rows match')
+        except AssertionError as e:
+            failed = True
+            print(f'{name}: mismatch over {len(rsids)} rsids')
+            print(e)
+    if failed:
+        print('The reference table was generated around November 2023; records fetched since then can legitimately differ.')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+import os, sys, gc, json, time, shutil, platform, argparse, functools, itertools, statistics, threading, tracemalloc
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+import pyarrow as pa
+from src import *
+from container import Container
+from benchmarks import synthetic
+
+# Times each stage of DNAAnalyzer.analyze on its own against synthetic inputs, entirely offline.
+# Inputs for every stage are prepared up front, so a stage's numbers only cover its own work.
+
+stage_names = ['read_23andme', 'read_ancestry', 'read_23andme_gz', 'read_23andme_zip', 'read_23andme_bz2', 'read_23andme_xz',
+               'read_ancestry_gz', 'read_ancestry_zip', 'citations_ingest', 'citation_join', 'ncbi_regeneration',
+               'ncbi_regeneration_serial', 'ncbi_regeneration_thread', 'ncbi_regeneration_process', 'ncbi_regeneration_dask', 'ncbi_dataset_read', 'variant_index_build', 'variant_index_query', 'classification', 'output_write', 'download']
+
+def benchmark_options(data_folder, **overrides):
+    class BenchmarkOptions(Options):
+        pass
+    BenchmarkOptions.data_folder = data_folder
+    BenchmarkOptions.public_ncbi_dataframe_parquet = os.path.join(data_folder, 'no_public_ncbi_data.parquet')
+    # nothing listens on the discard port, so anything that tries to reach NCBI fails at once
+    BenchmarkOptions.ncbi_refsnp_url = 'http://127.0.0.1:9/'
+    BenchmarkOptions.ncbi_request_retries = 0
+    for name, value in overrides.items():
+        setattr(BenchmarkOptions, name, value)
+    return BenchmarkOptions()
+
+def measure(function, repeat, input_path=None):
+    timings, cpu_timings = [], []
+    for _ in range(repeat):
+        gc.collect()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        result = function()
+        timings.append(time.perf_counter() - start)
+        cpu_timings.append(time.process_time() - cpu_start)
+
+    # a separate run for memory, tracemalloc slows down python-heavy code too much to time it.
+    # It sees python and numpy allocations, arrow's own pool is reported next to it.
+    gc.collect()
+    arrow_start = pa.total_allocated_bytes()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'cpu_seconds': statistics.median(cpu_timings),
+        'peak_mb': peak / 2**20,
+        'arrow_retained_mb': max(0, pa.total_allocated_bytes() - arrow_start) / 2**20,
+        'rows': len(result) if hasattr(result, '__len__') else None,
+        # bytes the stage reads off disk, where that's one file
+        'input_mb': os.path.getsize(input_path) / 2**20 if input_path is not None else None,
+    }
+
+def prepare_inputs(folder, rows, seed):
+    inputs = os.path.join(folder, f'inputs-v{synthetic.version}-{rows}-{seed}')
+    marker = os.path.join(inputs, 'complete')
+    if not os.path.exists(marker):
+        shutil.rmtree(inputs, ignore_errors=True)
+        print(f'Writing synthetic inputs to {inputs}')
+        synthetic.write_inputs(inputs, rows, seed)
+        open(marker, 'w').close()
+    paths = {
+        '23andme': os.path.join(inputs, 'user1_bench.23andme.txt'),
+        'ancestry': os.path.join(inputs, 'user2_bench.ancestry.txt'),
+        'citations': os.path.join(inputs, 'var_citations.txt'),
+        'refsnp': os.path.join(inputs, 'refsnp.jsonl'),
+    }
+    for compression in ['gz', 'zip', 'bz2', 'xz']:
+        paths[f'23andme_{compression}'] = os.path.join(inputs, f'user1_bench.{compression}')
+    for compression in ['gz', 'zip']:
+        paths[f'ancestry_{compression}'] = os.path.join(inputs, f'user2_bench.{compression}')
+    return paths
+
+def start_stub_server(documents:dict, latency):
+    # serves refsnp documents the way api.ncbi.nlm.nih.gov does, on a loop in its own thread
+    import asyncio
+    from aiohttp import web
+
+    async def refsnp(request):
+        if latency > 0:
+            await asyncio.sleep(latency)
+        document = documents.get(int(request.match_info['number']))
+        if document is None:
+            return web.Response(status=404)
+        return web.Response(body=document, content_type='application/json')
+
+    started = threading.Event()
+    state = {}
+    def run():
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get('/variation/v0/refsnp/{number}', refsnp)
+        runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        state['port'] = site._server.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return f'http://127.0.0.1:{state["port"]}/variation/v0/refsnp/'
+
+def run_benchmarks(args):
+    paths = prepare_inputs(args.folder, args.rows, args.seed)
+    data_folder = os.path.join(args.folder, 'data')
+    shutil.rmtree(data_folder, ignore_errors=True)
+    os.makedirs(data_folder)
+
+    parse_options = {'ncbi_parse_workers': args.ncbi_workers, 'ncbi_parse_batch_size': args.ncbi_batch_size}
+    container = Container()
+    container.Options.override(benchmark_options(data_folder, **parse_options))
+    Container.wire(container)
+    reader = container.GeneticDataToDataFrameConverter()
+    citations = container.CitationsDataframeGenerator()
+    generator = container.NCBIDataFrameGenerator()
+    dataset = container.NCBIDataset()
+    analyzer = container.DNAAnalyzer()
+    report_writer = container.ReportWriter()
+    variant_index = container.VariantIndex()
+
+    print('Seeding the refsnp store')
+    container.RefSnpStore().put_many(synthetic.read_refsnp_documents(paths['refsnp']))
+    studied_keys = citations.ingest(paths['citations'])
+    genome = analyzer._read_genome(paths['23andme'])
+    studied = genome[isin_sorted(genome['rsid_key'], studied_keys)].reset_index(drop=True)
+    ncbi_data = generator._regenerate_dataframe(studied)
+    dataset.append(ncbi_data)
+    ncbi_data = with_rsid_key(ncbi_data)
+    detected = analyzer._classify(genome, ncbi_data)
+    output_keys = itertools.count()
+
+    stages = {
+        'read_23andme': lambda: reader.read_data(paths['23andme'], throw_on_error=True),
+        'read_ancestry': lambda: reader.read_data(paths['ancestry'], throw_on_error=True),
+        'citations_ingest': lambda: citations.ingest(paths['citations']),
+        'citation_join': lambda: genome[isin_sorted(genome['rsid_key'], studied_keys)].reset_index(drop=True),
+        'ncbi_regeneration': lambda: generator._regenerate_dataframe(studied),
+        'ncbi_dataset_read': lambda: dataset.read(studied['rsid']),
+        'variant_index_build': lambda: variant_index.update(force=True),
+        # a gene, a region and a disease keyword, each answered with the NCBI rows
+        'variant_index_query': lambda: [variant_index.query_reference(genes=['BRCA1', 'BRCA2']), variant_index.query_reference(region='chr17:40,000,000-50,000,000'),
+                                        variant_index.query_reference(disease='Lynch')],
+        'classification': lambda: analyzer._classify(genome, ncbi_data),
+        # a fresh key every call, otherwise the writer sees nothing changed and skips the files
+        'output_write': lambda: report_writer.write(paths['23andme'], f'benchmark-{next(output_keys)}', detected, args.formats) and detected,
+    }
+
+    # the same genomes compressed and named without a reader suffix, read through header sniffing
+    for name in [x for x in paths if x.startswith(('23andme_', 'ancestry_'))]:
+        stages[f'read_{name}'] = functools.partial(reader.read_data, paths[name], throw_on_error=True)
+
+    # the same regeneration on each parse backend, dask only when there's a cluster to run it on
+    backends = {x: x for x in ['serial', 'thread', 'process']}
+    closables = []
+    if args.dask_address == 'local':
+        from distributed import LocalCluster
+        cluster = LocalCluster(n_workers=args.ncbi_workers or os.cpu_count(), threads_per_worker=1, processes=True)
+        closables.append(cluster)
+        backends['dask'] = cluster.scheduler_address
+    elif args.dask_address is not None:
+        backends['dask'] = args.dask_address
+    for name, backend in backends.items():
+        executor = RefSnpParseExecutor(options=benchmark_options(data_folder, ncbi_parse_backend=backend, **parse_options))
+        # dask clients go before the cluster they're connected to
+        closables.insert(0, executor)
+        backend_generator = NCBIDataFrameGenerator(refsnp_parse_executor=executor)
+        stages[f'ncbi_regeneration_{name}'] = functools.partial(backend_generator._regenerate_dataframe, studied)
+
+    if args.download_rsids > 0:
+        documents = {int(rsid[2:]): document for rsid, document in itertools.islice(synthetic.read_refsnp_documents(paths['refsnp']), args.download_rsids)}
+        url = start_stub_server(documents, args.download_latency)
+        download_runs = itertools.count()
+        def download():
+            # a fresh store every run, so every rsid is really fetched
+            folder = os.path.join(data_folder, f'download-{next(download_runs)}')
+            os.makedirs(folder)
+            options = benchmark_options(folder, ncbi_refsnp_url=url, ncbi_request_retries=Options.ncbi_request_retries,
+                                        ncbi_requests_per_second=args.download_rate, ncbi_max_concurrent_requests=args.download_concurrency)
+            downloader = RefSnpAsyncDownloader(options=options, refsnp_store=RefSnpStore(options=options))
+            summary = downloader.download([f'rs{x}' for x in documents], show_progress=False)
+            return [None] * summary['downloaded']
+        stages['download'] = download
+
+    selected = [x for x in stage_names if x in stages and (args.stages is None or x in args.stages)]
+    results = {}
+    for name in selected:
+        input_name = name[len('read_'):] if name.startswith('read_') else None
+        results[name] = measure(stages[name], args.repeat, paths.get(input_name))
+        print(f'{name:<26} {results[name]["seconds"]:8.3f}s')
+    for closable in closables:
+        closable.close()
+
+    return {
+        'version': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count()},
+        'inputs': {'rows': args.rows, 'seed': args.seed, 'synthetic_version': synthetic.version, 'studied_rsids': len(studied)},
+        'repeat': args.repeat,
+        'ncbi_parse': {'workers': args.ncbi_workers or os.cpu_count(), 'batch_size': args.ncbi_batch_size},
+        'stages': results,
+    }
+
+def compare(results, baseline, tolerance, min_seconds):
+    regressions = []
+    rows = []
+    for name, current in results['stages'].items():
+        previous = baseline['stages'].get(name)
+        if previous is None:
+            rows.append((name, current, None, ''))
+            continue
+        flags = []
+        # tiny stages are mostly noise, so a regression has to be both relatively and absolutely large
+        if (current['seconds'] > previous['seconds'] * (1 + tolerance)) and (current['seconds'] - previous['seconds'] > min_seconds):
+            flags.append('slower')
+        if current['peak_mb'] > previous['peak_mb'] * (1 + tolerance) and (current['peak_mb'] - previous['peak_mb'] > 1):
+            flags.append('more memory')
+        if len(flags) > 0:
+            regressions.append(name)
+        rows.append((name, current, previous, ', '.join(flags)))
+    return rows, regressions
+
+def print_table(rows):
+    print(f'\n{"stage":<26} {"seconds":>9} {"baseline":>9} {"change":>8} {"cpu":>8} {"peak MB":>9} {"rows":>9} {"input MB":>9}')
+    for name, current, previous, flags in rows:
+        baseline_seconds = f'{previous["seconds"]:9.3f}' if previous else f'{"-":>9}'
+        change = f'{(current["seconds"] / previous["seconds"] - 1) * 100:+7.1f}%' if previous and previous['seconds'] > 0 else f'{"-":>8}'
+        row_count = current['rows'] if current['rows'] is not None else '-'
+        input_mb = f'{current["input_mb"]:9.1f}' if current.get('input_mb') is not None else f'{"-":>9}'
+        print(f'{name:<26} {current["seconds"]:9.3f} {baseline_seconds} {change} {current["cpu_seconds"]:8.3f} {current["peak_mb"]:9.1f} {row_count:>9} {input_mb} {flags}')
+
+def main():
+    default_folder = os.path.join(Options().data_folder, 'benchmarks')
+    parser = argparse.ArgumentParser(description='Time and memory-profile each analysis stage on synthetic data, offline.')
+    parser.add_argument('--folder', default=default_folder, help='where synthetic inputs are cached and stages write their data')
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='+', choices=stage_names, default=None)
+    parser.add_argument('--formats', nargs='+', choices=ReportWriter.formats, default=Options.report_formats, help='report formats the output_write stage writes')
+    parser.add_argument('--ncbi-workers', type=int, default=None, help='workers for the ncbi_regeneration stages (default: one per core)')
+    parser.add_argument('--ncbi-batch-size', type=int, default=Options.ncbi_parse_batch_size, help='refsnp documents per parse task')
+    parser.add_argument('--dask-address', default=None, help="scheduler the ncbi_regeneration_dask stage runs on, 'local' starts a cluster for it")
+    parser.add_argument('--download-rsids', type=int, default=2000, help='rsids fetched from a local stub server, 0 skips the download stage')
+    parser.add_argument('--download-latency', type=float, default=0.01, help='seconds the stub server waits before answering')
+    parser.add_argument('--download-rate', type=float, default=1000.0, help='requests per second the downloader is allowed')
+    parser.add_argument('--download-concurrency', type=int, default=Options.ncbi_max_concurrent_requests)
+    parser.add_argument('--output', default=None, help='defaults to results.json in --folder')
+    parser.add_argument('--baseline', default=None, help='defaults to baseline.json in --folder')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown or memory growth that counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.02, help='slowdowns smaller than this are never flagged')
+    args = parser.parse_args()
+    args.output = args.output or os.path.join(args.folder, 'results.json')
+    args.baseline = args.baseline or os.path.join(args.folder, 'baseline.json')
+
+    results = run_benchmarks(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    baseline = {'stages': {}}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('inputs') != results['inputs']:
+            print(f'Baseline {args.baseline} was recorded with different inputs, not comparing.')
+            baseline = {'stages': {}}
+
+    rows, regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+    print_table(rows)
+    print(f'\nResults written to {args.output}')
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f'Saved as the baseline in {args.baseline}')
+    if len(regressions) > 0:
+        print(f'Regressions against {args.baseline}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
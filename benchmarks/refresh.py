@@ -0,0 +1,106 @@
+import os, sys, json, time, random, shutil, argparse
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+# Seeds a refsnp store and an NCBI dataset from synthetic documents, then plays out a month: some documents
+# age past Options.ncbi_refresh_max_age_days, ClinVar edits the citations of some rsids, and a local stub
+# server stands in for NCBI, answering some of the refetches with a changed document. Times the refresh next to
+# the full rebuild it replaces, and checks the dataset it leaves is what a full rebuild from the refreshed store
+# gives.
+
+def refresh_options(data_folder, url=None):
+    from benchmarks.pipeline import benchmark_options
+    # the refresh's stages are timed, so its table shows what the refetches and the index rebuild cost
+    overrides = {} if url is None else {'ncbi_refsnp_url': url, 'instrumentation': 'summary'}
+    return benchmark_options(data_folder, public_ncbi_data_policy='generate', ncbi_requests_per_second=5000.0,
+                             ncbi_max_concurrent_requests=16, ncbi_request_retries=0, **overrides)
+
+def container_for(options):
+    from container import Container
+    container = Container()
+    container.Options.override(options)
+    Container.wire(container)
+    return container
+
+def edited_citations(source, path, keys, seed):
+    # the rows of the chosen rsids cite something else, and as many rsids gain a first citation
+    citations = pd.read_csv(source, sep='\t', dtype={'nsv': str}, keep_default_na=False)
+    edited = citations['rs'].isin(keys)
+    citations.loc[edited, 'citation_id'] = citations.loc[edited, 'citation_id'] + 1
+    rng = np.random.default_rng(seed)
+    added = citations.sample(len(keys), random_state=seed).assign(rs=rng.integers(2 * 10**9, 3 * 10**9, len(keys)))
+    pd.concat([citations, added]).to_csv(path, sep='\t', index=False)
+
+def changed_document(document:bytes):
+    # ClinVar reclassified the variant
+    document = json.loads(document)
+    document['last_update_date'] = '2024-06-01T00:00Z'
+    for annotation in document.get('primary_snapshot_data', {}).get('allele_annotations', []):
+        for clinical in annotation['clinical']:
+            clinical['clinical_significances'] = ['pathogenic']
+    return json.dumps(document).encode()
+
+def sorted_rows(dataframe:pd.DataFrame):
+    dataframe = dataframe.drop(columns='rsid_key', errors='ignore').astype(str)
+    return dataframe.sort_values(by=list(dataframe.columns)).reset_index(drop=True)
+
+def main():
+    from src import Options
+    from benchmarks import synthetic
+    from benchmarks.pipeline import prepare_inputs, start_stub_server
+    default_folder = os.path.join(Options().data_folder, 'benchmarks')
+    parser = argparse.ArgumentParser(description='Time a refresh of the NCBI data against a full rebuild, offline.')
+    parser.add_argument('--folder', default=default_folder, help='where synthetic inputs are cached and the runs write their data')
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stale-fraction', type=float, default=0.05, help='documents that have aged past the refresh age')
+    parser.add_argument('--cited-fraction', type=float, default=0.02, help='rsids whose ClinVar citations change')
+    parser.add_argument('--changed-fraction', type=float, default=0.5, help='refetched documents NCBI answers with a changed document')
+    args = parser.parse_args()
+
+    paths = prepare_inputs(args.folder, args.rows, args.seed)
+    data_folder = os.path.join(args.folder, 'refresh')
+    shutil.rmtree(data_folder, ignore_errors=True)
+    os.makedirs(data_folder)
+    documents = {int(rsid[2:]): document for rsid, document in synthetic.read_refsnp_documents(paths['refsnp'])}
+
+    container = container_for(refresh_options(data_folder))
+    store = container.RefSnpStore()
+    store.put_many((f'rs{number}', document) for number, document in documents.items())
+    container.CitationsDataframeGenerator().refresh(paths['citations'])
+    start = time.perf_counter()
+    container.NCBIDataFrameGenerator().upsert(store.all_rsids())
+    rebuild_seconds = time.perf_counter() - start
+    print(f'Full rebuild of {len(documents)} documents: {rebuild_seconds:.2f}s')
+
+    # a month on
+    rng = random.Random(args.seed)
+    numbers = sorted(documents)
+    stale = rng.sample(numbers, int(len(numbers) * args.stale_fraction))
+    with store._connection() as connection:
+        connection.executemany('UPDATE refsnp SET fetched_at = ? WHERE rsid = ?', ((time.time() - 40 * 86400, x) for x in stale))
+    studied = np.load(container.Options().citations_rsid_keys_file)
+    cited = rng.sample(sorted(set(numbers) & set(studied.tolist())), int(len(numbers) * args.cited_fraction))
+    new_citations = os.path.join(data_folder, 'var_citations_new.txt')
+    edited_citations(paths['citations'], new_citations, cited, args.seed)
+    served = {number: changed_document(document) if rng.random() < args.changed_fraction else document for number, document in documents.items()}
+
+    container = container_for(refresh_options(data_folder, start_stub_server(served, 0)))
+    start = time.perf_counter()
+    summary = container.NCBIDataRefresher().refresh(new_citations, show_progress=False)
+    refresh_seconds = time.perf_counter() - start
+    print(f'Refresh: {summary["citations_changed"]} rsids with changed citations, {summary["due"]} documents due, {summary["refetched"]} refetched, '
+          f'{summary["changed"]} changed, {summary["rows_upserted"]} rows upserted in {refresh_seconds:.2f}s '
+          f'({refresh_seconds / rebuild_seconds:.0%} of the full rebuild, the refetches included)')
+    container.Instrumentation().report()
+
+    refreshed = sorted_rows(container.NCBIDataset().read())
+    rebuilt = sorted_rows(container_for(refresh_options(data_folder)).NCBIDataFrameGenerator()._regenerate_dataframe())
+    same = refreshed.equals(rebuilt)
+    print('The refreshed dataset ' + ('matches' if same else 'differs from') + ' a full rebuild of the refreshed store.')
+    return 0 if same else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
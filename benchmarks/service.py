@@ -0,0 +1,175 @@
+import os, sys, json, time, shutil, argparse, threading, subprocess, statistics, http.client
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Runs serve.py's handler over AnalysisService in a child process against synthetic data and drives it with
+# a local load generator: latency percentiles and throughput at each --concurrency, next to the wall time of
+# the cold process a plain analysis is. It also checks the service returns the rows analyze reports, and
+# how long a new NCBI dataset version takes to show up in the running service.
+
+root = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+
+def service_options(data_folder, **overrides):
+    from benchmarks.pipeline import benchmark_options
+    return benchmark_options(data_folder, report_formats=['parquet'], public_ncbi_data_policy='generate',
+                             allow_download=False, ncbi_requests_per_second=1000.0, **overrides)
+
+def child_server(args):
+    from container import Container
+    from serve import make_handler
+    from http.server import ThreadingHTTPServer
+    container = Container()
+    container.Options.override(service_options(args.data_folder, service_reload_interval=args.reload_interval))
+    Container.wire(container)
+    service = container.AnalysisService()
+    start = time.perf_counter()
+    service.reload()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+    server.daemon_threads = True
+    print(json.dumps({'port': server.server_port, 'load_seconds': time.perf_counter() - start}), flush=True)
+    server.serve_forever()
+
+def child_cold(args):
+    from container import Container
+    container = Container()
+    container.Options.override(service_options(args.data_folder, pipeline_engine=args.engine))
+    Container.wire(container)
+    container.DNAAnalyzer().analyze(args.genome)
+
+def prepare(data_folder, paths, genomes):
+    from container import Container
+    from benchmarks import synthetic
+    shutil.rmtree(data_folder, ignore_errors=True)
+    os.makedirs(data_folder)
+    container = Container()
+    container.Options.override(service_options(data_folder))
+    Container.wire(container)
+    print('Seeding the refsnp store and the NCBI dataset')
+    container.RefSnpStore().put_many(synthetic.read_refsnp_documents(paths['refsnp']))
+    container.CitationsDataframeGenerator().ingest(paths['citations'])
+    for genome in genomes:
+        container.DNAAnalyzer().analyze(genome)
+
+def cold_seconds(args, genome, repeat):
+    # what a request costs without the service: a fresh process, imports included, with nothing in the stage cache
+    timings = []
+    for _ in range(repeat):
+        shutil.rmtree(os.path.join(args.data_folder, 'stage_cache'), ignore_errors=True)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--child', 'cold', '--data-folder', args.data_folder, '--engine', args.engine,
+                        '--genome', genome], cwd=root, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def request(connection:http.client.HTTPConnection, method, path, body=None):
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    content = response.read()
+    if response.status != 200:
+        raise Exception(f'{method} {path} returned {response.status}: {content[:200]}')
+    return content
+
+def load(port, body, concurrency, requests):
+    latencies, lock = [], threading.Lock()
+    remaining = iter(range(requests))
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            start = time.perf_counter()
+            request(connection, 'POST', '/analyze?format=parquet', body)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p90': cuts[89], 'p99': cuts[98], 'max': max(latencies), 'per_second': len(latencies) / seconds}
+
+def same_rows(body, report):
+    import io
+    import pandas as pd
+    return pd.read_parquet(io.BytesIO(body)).equals(pd.read_parquet(report))
+
+def watch_reload(args, port):
+    # a rewritten fragment is a new dataset version with the same rows, the service should pick it up on its next check
+    from src import NCBIDataset
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    before = json.loads(request(connection, 'GET', '/status'))
+    dataset = NCBIDataset(options=service_options(args.data_folder))
+    dataset.append(dataset.read().head(1), compact=False)
+    start = time.perf_counter()
+    while json.loads(request(connection, 'GET', '/status'))['loaded_at'] == before['loaded_at']:
+        if time.perf_counter() - start > args.reload_interval * 10:
+            return None
+        time.sleep(0.05)
+    return time.perf_counter() - start
+
+def main():
+    from src import Options
+    default_folder = os.path.join(Options().data_folder, 'benchmarks')
+    parser = argparse.ArgumentParser(description='Load test the analysis service against synthetic data, offline.')
+    parser.add_argument('--folder', default=default_folder, help='where synthetic inputs are cached and the runs write their data')
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=40, help='requests sent at each concurrency')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--reload-interval', type=float, default=1.0)
+    parser.add_argument('--engine', choices=['pandas', 'arrow'], default='arrow', help='engine the cold analyses run')
+    parser.add_argument('--cold-repeat', type=int, default=3)
+    parser.add_argument('--child', choices=['server', 'cold'], help=argparse.SUPPRESS)
+    parser.add_argument('--data-folder', help=argparse.SUPPRESS)
+    parser.add_argument('--genome', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child == 'server':
+        return child_server(args)
+    if args.child == 'cold':
+        return child_cold(args)
+
+    from benchmarks.pipeline import prepare_inputs
+    paths = prepare_inputs(args.folder, args.rows, args.seed)
+    args.data_folder = os.path.join(args.folder, 'service')
+    genomes = {name: paths[name] for name in ['23andme', 'ancestry']}
+    prepare(args.data_folder, paths, genomes.values())
+    reports = {name: os.path.join(args.data_folder, 'output', os.path.basename(x).split('.')[0], f'{os.path.basename(x).split(".")[0]}_variations.parquet')
+               for name, x in genomes.items()}
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', 'server', '--data-folder', args.data_folder,
+                               '--reload-interval', str(args.reload_interval)], cwd=root, stdout=subprocess.PIPE, text=True)
+    try:
+        started = json.loads(server.stdout.readline())
+        port = started['port']
+        print(f'Service loaded its reference data in {started["load_seconds"]:.3f}s')
+        bodies = {name: open(x, 'rb').read() for name, x in genomes.items()}
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        mismatches = [name for name in genomes if not same_rows(request(connection, 'POST', '/analyze?format=parquet', bodies[name]), reports[name])]
+        connection.close()
+
+        print(f'\n{"genome":<10} {"clients":>7} {"p50 s":>8} {"p90 s":>8} {"p99 s":>8} {"max s":>8} {"req/s":>8}')
+        for name in genomes:
+            for concurrency in args.concurrency:
+                result = load(port, bodies[name], concurrency, args.requests)
+                print(f'{name:<10} {concurrency:>7} {result["p50"]:8.3f} {result["p90"]:8.3f} {result["p99"]:8.3f} {result["max"]:8.3f} {result["per_second"]:8.2f}')
+        for name, genome in genomes.items():
+            print(f'{name:<10} {"cold":>7} {cold_seconds(args, genome, args.cold_repeat):8.3f}   (a fresh {args.engine} process per analysis)')
+
+        reload_seconds = watch_reload(args, port)
+        print(f'\nA new dataset version was ' + ('not picked up.' if reload_seconds is None else f'picked up after {reload_seconds:.2f}s.'))
+    finally:
+        server.terminate()
+        server.wait()
+
+    for name in mismatches:
+        print(f'The service and analyze detected different variants for {name}.')
+    return 1 if (len(mismatches) > 0) or (reload_seconds is None) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os, sys, time, shutil, argparse
+import multiprocessing as mp
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Races processes over the artifacts under .data: several processes missing one stage cache entry at once
+# (only one of them should compute it), several appending to and compacting the same NCBI dataset buckets (no
+# rows lost, no process failing on a fragment another removed), and torn files, which have to read as
+# missing. Also times an Options folder property, which used to make its folder on every access.
+
+def storage_options(data_folder):
+    from benchmarks.pipeline import benchmark_options
+    return benchmark_options(data_folder)
+
+def cache_worker(data_folder, seconds):
+    from src import StageCache, Instrumentation
+    import pyarrow as pa
+    options = storage_options(data_folder)
+    cache = StageCache(options=options, instrumentation=Instrumentation(options=options))
+
+    def compute():
+        with open(os.path.join(data_folder, 'computes'), 'a') as f:
+            f.write(f'{os.getpid()}\n')
+        time.sleep(seconds)
+        return pa.table({'rsid_key': pa.array(range(100000), pa.int64())})
+
+    start = time.perf_counter()
+    rows = cache.get_or_compute_table('storage', 'shared', compute).num_rows
+    return rows, time.perf_counter() - start
+
+def dataset_worker(data_folder, worker, appends, rows):
+    from src import NCBIDataset
+    import pandas as pd
+    dataset = NCBIDataset(options=storage_options(data_folder))
+    # a low threshold so every few appends compact the buckets the other workers are appending to
+    dataset.compaction_threshold = 3
+    for i in range(appends):
+        first = (worker * appends + i) * rows
+        rsids = [f'rs{x}' for x in range(first, first + rows)]
+        dataset.append(pd.DataFrame({'rsid': rsids, 'worker': worker}))
+        dataset.read(rsids[:10])
+    return appends * rows
+
+def race_cache(data_folder, processes, seconds):
+    with mp.Pool(processes) as pool:
+        start = time.perf_counter()
+        results = pool.starmap(cache_worker, [(data_folder, seconds)] * processes)
+        wall = time.perf_counter() - start
+    with open(os.path.join(data_folder, 'computes')) as f:
+        computes = len(f.read().split())
+    return computes, wall, all(x[0] == 100000 for x in results)
+
+def race_dataset(data_folder, processes, appends, rows):
+    from src import NCBIDataset
+    with mp.Pool(processes) as pool:
+        written = sum(pool.starmap(dataset_worker, [(data_folder, x, appends, rows) for x in range(processes)]))
+    dataset = NCBIDataset(options=storage_options(data_folder))
+    read = dataset.read()
+    return written, len(read), read['rsid'].nunique(), len(dataset._fragments())
+
+def torn_reads(data_folder):
+    from src import StageCache, Instrumentation
+    from src.common import atomic_write, is_intact
+    import numpy as np
+    import pyarrow as pa
+    options = storage_options(data_folder)
+    cache = StageCache(options=options, instrumentation=Instrumentation(options=options))
+    cache.put_table('storage', 'torn', pa.table({'a': pa.array(range(1000))}))
+    path = cache._path('storage', 'torn')
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    keys_path = os.path.join(data_folder, 'keys.npy')
+    with atomic_write(keys_path, 'wb') as f:
+        np.save(f, np.arange(1000))
+    with open(keys_path, 'r+b') as f:
+        f.truncate(os.path.getsize(keys_path) - 8)
+    return {'stage cache entry': cache.get_table('storage', 'torn') is None, 'npy': not is_intact(keys_path)}
+
+def folder_access(data_folder, count):
+    options = storage_options(data_folder)
+    start = time.perf_counter()
+    for _ in range(count):
+        options.stage_cache_folder
+    cached = time.perf_counter() - start
+    path = os.path.join(data_folder, 'stage_cache')
+    start = time.perf_counter()
+    for _ in range(count):
+        os.makedirs(path, exist_ok=True)
+    return cached, time.perf_counter() - start
+
+def main():
+    from src import Options
+    default_folder = os.path.join(Options().data_folder, 'benchmarks')
+    parser = argparse.ArgumentParser(description='Race processes over the stage cache and the NCBI dataset, offline.')
+    parser.add_argument('--folder', default=default_folder, help='where the runs write their data')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--compute-seconds', type=float, default=1.0, help='how long the raced stage cache entry takes to compute')
+    parser.add_argument('--appends', type=int, default=12, help='appends each process makes to the dataset')
+    parser.add_argument('--rows', type=int, default=200, help='rows per append')
+    parser.add_argument('--accesses', type=int, default=100000, help='reads of an Options folder property timed')
+    args = parser.parse_args()
+
+    data_folder = os.path.join(args.folder, 'storage')
+    shutil.rmtree(data_folder, ignore_errors=True)
+    os.makedirs(data_folder)
+
+    computes, wall, complete = race_cache(data_folder, args.processes, args.compute_seconds)
+    print(f'{args.processes} processes missing one stage cache entry: computed {computes} time(s), all done after {wall:.2f}s '
+          f'({args.compute_seconds:.2f}s to compute it once)')
+    written, read, unique, fragments = race_dataset(data_folder, args.processes, args.appends, args.rows)
+    print(f'{args.processes} processes appending and compacting: {written} rows written, {read} read back ({unique} distinct) '
+          f'from {fragments} fragments')
+    torn = torn_reads(data_folder)
+    print('Torn files read as missing: ' + ', '.join(f'{k} {"yes" if v else "no"}' for k, v in torn.items()))
+    cached, makedirs = folder_access(data_folder, args.accesses)
+    print(f'{args.accesses} reads of Options.stage_cache_folder took {cached:.3f}s, making the folder each time takes {makedirs:.3f}s')
+
+    failed = (computes != 1) or (not complete) or (read != written) or (unique != written) or (not all(torn.values()))
+    if failed:
+        print('Storage checks failed.')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+import os, bz2, gzip, lzma, json, random, zipfile, argparse
+import numpy as np
+import pandas as pd
+
+# Deterministic stand-ins for the inputs the pipeline reads: raw genome files in both reader
+# formats, ClinVar's var_citations.txt and NCBI refsnp JSON. Same arguments, same bytes.
+
+# bump when the output of any generator changes, so cached inputs get rebuilt
+version = 3
+
+chromosomes = [str(x) for x in range(1, 23)] + ['X', 'Y', 'MT']
+# rough GRCh38 lengths in Mb, used to spread the rows like a real array does
+chromosome_lengths = [248, 242, 198, 190, 181, 171, 159, 145, 138, 134, 135, 133, 114, 107, 102, 90, 83, 80, 59, 64, 47, 51, 156, 57, 1]
+# refseq accessions of the GRCh38 chromosomes, the placement seq_id in refsnp documents
+chromosome_accessions = {x: f'NC_{n:06d}.{v}' for x, n, v in zip(chromosomes, list(range(1, 25)) + [12920],
+    [11, 12, 12, 12, 10, 12, 14, 11, 12, 11, 10, 12, 11, 9, 10, 10, 11, 10, 10, 11, 9, 11, 11, 10, 1])}
+bases = 'ACGT'
+
+def genome_table(rows=600000, seed=0, internal_fraction=0.005, no_call_fraction=0.015):
+    rng = np.random.default_rng(seed)
+    weights = np.array(chromosome_lengths, dtype=np.float64)
+    chromosome_codes = np.sort(rng.choice(len(chromosomes), size=rows, p=weights / weights.sum()))
+    positions = (rng.random(rows) * weights[chromosome_codes] * 1e6).astype(np.int64) + 1
+    order = np.lexsort((positions, chromosome_codes))
+    chromosome_codes, positions = chromosome_codes[order], positions[order]
+
+    # rsid numbers are skewed low like dbSNP's, unique, and a small share are 23andMe's internal i-probes
+    numbers = np.zeros(0, dtype=np.int64)
+    while len(numbers) < rows:
+        numbers = np.union1d(numbers, (1.2e9 * rng.random(rows) ** 3).astype(np.int64) + 3)
+    numbers = rng.permutation(numbers)[:rows]
+    internal = rng.random(rows) < internal_fraction
+    rsids = np.where(internal, np.char.add('i', (numbers % 10**7 + 5 * 10**6).astype(str)), np.char.add('rs', numbers.astype(str)))
+
+    alleles = np.array(list(bases))
+    first = alleles[rng.integers(0, 4, rows)]
+    second = np.where(rng.random(rows) < 0.6, first, alleles[rng.integers(0, 4, rows)])
+    genotypes = np.char.add(first, second).astype(object)
+
+    haploid = np.isin(chromosome_codes, [chromosomes.index('Y'), chromosomes.index('MT')])
+    genotypes[haploid] = first[haploid]
+    indels = internal & (rng.random(rows) < 0.5)
+    genotypes[indels] = np.array(['DD', 'DI', 'II'], dtype=object)[rng.integers(0, 3, indels.sum())]
+    genotypes[rng.random(rows) < no_call_fraction] = '--'
+
+    return pd.DataFrame({
+        'rsid': rsids.astype(object),
+        'chromosome': np.array(chromosomes, dtype=object)[chromosome_codes],
+        'position': positions,
+        'genotype': genotypes,
+    })
+
+def write_twentythree(path, rows=600000, seed=0):
+    table = genome_table(rows, seed)
+    with open(path, 'w') as f:
+        f.write('# This data file generated by 23andMe at: Sat Jan 01 00:00:00 2000\n')
+        f.write('#\n# Synthetic genome for benchmarking, not a real person.\n#\n')
+        f.write('# rsid\tchromosome\tposition\tgenotype\n')
+        table.to_csv(f, sep='\t', header=False, index=False)
+    return table
+
+def write_ancestry(path, rows=600000, seed=0):
+    table = genome_table(rows, seed)
+    # AncestryDNA numbers the sex chromosomes and MT, writes each allele in its own column and uses 0 for a no-call
+    chromosome = table['chromosome'].replace({'X': '23', 'Y': '24', 'MT': '26'})
+    genotype = table['genotype'].replace({'--': '00'})
+    allele1 = genotype.str[0]
+    allele2 = genotype.str[1].fillna(allele1)
+    with open(path, 'w') as f:
+        f.write('#AncestryDNA raw data download\n')
+        f.write('#Synthetic genome for benchmarking, not a real person.\n')
+        f.write('#\n')
+        pd.DataFrame({'rsid': table['rsid'], 'chromosome': chromosome, 'position': table['position'],
+                      'allele1': allele1, 'allele2': allele2}).to_csv(f, sep='\t', index=False)
+    return table
+
+def sample_studied_rsids(table:pd.DataFrame, fraction=0.04, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    rsids = table.loc[table['rsid'].str.startswith('rs'), 'rsid'].to_numpy()
+    return sorted(rng.choice(rsids, int(len(rsids) * fraction), replace=False).tolist(), key=lambda x: int(x[2:]))
+
+def write_citations(path, studied_rsids, genome_rsids=(), unrelated=200000, seed=0):
+    # ClinVar's file has far more rsids than any one genome, most of them never join. None of them
+    # may land on another rsid of the genome, only the studied ones have refsnp documents.
+    rng = np.random.default_rng(seed + 2)
+    others = rng.integers(1, 1.2e9, unrelated)
+    others = others[~np.isin(others, [int(x[2:]) for x in genome_rsids if x.startswith('rs')])]
+    numbers = np.concatenate([np.array([int(x[2:]) for x in studied_rsids], dtype=np.int64), others])
+    citations = rng.integers(1, 4, len(numbers))
+    numbers = np.repeat(numbers, citations)
+    rows = len(numbers)
+    pd.DataFrame({
+        '#AlleleID': rng.integers(15000, 2000000, rows),
+        'VariationID': rng.integers(1, 3000000, rows),
+        'rs': numbers,
+        'nsv': '',
+        'citation_source': rng.choice(['PubMed', 'PubMedCentral', 'BookShelf'], rows),
+        'citation_id': rng.integers(10**6, 4 * 10**7, rows),
+    }).to_csv(path, sep='\t', index=False)
+
+def _sequence(rng:random.Random, length):
+    return ''.join(rng.choice(bases) for _ in range(length))
+
+def _alternates(rng:random.Random, reference):
+    alternates = []
+    for _ in range(rng.choice([1, 1, 1, 2, 3])):
+        kind = rng.random()
+        if kind < 0.6:
+            alternates.append((reference[0], rng.choice([x for x in bases if x != reference[0]])))
+        elif kind < 0.72:
+            alternates.append((reference, reference[:1]))
+        elif kind < 0.84:
+            alternates.append((reference, reference + reference[-1]))
+        elif kind < 0.94:
+            alternates.append((reference, reference + _sequence(rng, 2)))
+        else:
+            alternates.append((reference + _sequence(rng, 1), reference + _sequence(rng, 1)))
+    return alternates
+
+def _frequencies(rng:random.Random, deleted, inserted, spdis):
+    result = []
+    for _ in range(rng.choice([0, 1, 2, 3])):
+        observed = (deleted, inserted) if rng.random() < 0.85 else rng.choice(spdis + [(deleted[:1], deleted[:1]), (deleted + 'T', deleted + 'T')])
+        total_count = rng.choice([0, 5008, 264690, rng.randint(1, 10**6)])
+        result.append({
+            'study_name': rng.choice(['1000Genomes', 'GnomAD', 'ALFA', 'TOPMED']),
+            'study_version': 1,
+            'local_row_id': rng.randint(1, 10**8),
+            'observation': {'seq_id': 'NC_000001.11', 'position': 0, 'deleted_sequence': observed[0], 'inserted_sequence': observed[1]},
+            'allele_count': rng.randint(0, max(total_count, 1)),
+            'total_count': total_count,
+        })
+    return result
+
+def _clinical(rng:random.Random):
+    return [{
+        'accession_version': f'RCV{rng.randint(1, 3 * 10**6):09d}.{rng.randint(1, 9)}',
+        'disease_names': rng.sample(['not provided', 'not specified', 'Hereditary breast ovarian cancer syndrome', 'Lynch syndrome',
+                                     'Familial adenomatous polyposis 1', 'Li-Fraumeni syndrome', 'Cardiovascular phenotype'], rng.randint(1, 2)),
+        'clinical_significances': rng.sample(['pathogenic', 'likely-pathogenic', 'benign', 'likely-benign', 'uncertain-significance'], rng.randint(1, 2)),
+        'review_status': rng.choice(['criteria-provided-single-submitter', 'no-assertion-criteria-provided', 'reviewed-by-expert-panel']),
+    } for _ in range(rng.choice([0, 0, 1, 1, 2]))]
+
+def refsnp_document(rsid_number, rng:random.Random, chromosome='1', position=None, merged_into=None):
+    # the shape of https://api.ncbi.nlm.nih.gov/variation/v0/refsnp/<id>, limited to the fields the pipeline reads
+    document = {'refsnp_id': str(rsid_number), 'create_date': '2000-09-19T17:02Z', 'last_update_date': '2023-09-07T16:20Z'}
+    if merged_into is not None:
+        document['merged_snapshot_data'] = {'proxy_build_id': '156', 'merged_into': [str(merged_into)]}
+        return document
+    if rng.random() < 0.01:
+        document['nosnppos_snapshot_data'] = {}
+        return document
+
+    position = position if position is not None else rng.randint(1, 10**8)
+    reference = _sequence(rng, rng.choice([1, 1, 1, 1, 2, 3]))
+    spdis = [(reference, reference)] + _alternates(rng, reference)
+    genes = [{'name': name, 'id': gene_id, 'locus': locus, 'is_pseudo': False, 'orientation': rng.choice(['plus', 'minus'])}
+             for name, gene_id, locus in rng.sample([('BRCA1 DNA repair associated', 672, 'BRCA1'), ('BRCA2 DNA repair associated', 675, 'BRCA2'),
+                                                     ('tumor protein p53', 7157, 'TP53'), ('mutL homolog 1', 4292, 'MLH1'),
+                                                     ('APC regulator of WNT signaling pathway', 324, 'APC'), ('agrin', 375790, 'AGRN')], rng.choice([0, 1, 1, 2]))]
+    accession = chromosome_accessions.get(chromosome, 'NC_000001.11')
+    placements = [
+        {'seq_id': accession, 'is_ptlp': True, 'placement_annot': {'seq_type': 'refseq_chromosome', 'is_aln_opposite_orientation': False,
+            'seq_id_traits_by_assembly': [{'assembly_name': 'GRCh38.p14', 'assembly_accession': 'GCF_000001405.40', 'is_top_level': True, 'is_chromosome': True}]},
+         'alleles': [{'allele': {'spdi': {'seq_id': accession, 'position': position - 1, 'deleted_sequence': d, 'inserted_sequence': i}},
+                      'hgvs': f'{accession}:g.{position}{d}=' if d == i else f'{accession}:g.{position}{d}>{i}'} for d, i in spdis]},
+        {'seq_id': accession[:-3] + '.10', 'is_ptlp': False, 'placement_annot': {'seq_id_traits_by_assembly': [{'assembly_name': 'GRCh37.p13'}]},
+         'alleles': [{'allele': {'spdi': {'seq_id': accession[:-3] + '.10', 'position': position + 1000, 'deleted_sequence': d, 'inserted_sequence': i}},
+                      'hgvs': f'{accession[:-3]}.10:g.{position + 1001}{d}>{i}'} for d, i in spdis]},
+    ]
+    allele_annotations = [{
+        'frequency': _frequencies(rng, d, i, spdis),
+        'clinical': _clinical(rng) if d != i else [],
+        'submissions': [f'SUB{rng.randint(1, 10**7)}' for _ in range(rng.randint(0, 4))],
+        'assembly_annotation': [{'seq_id': accession, 'annotation_release': 'Homo sapiens Annotation Release 110', 'genes': genes}] if rng.random() < 0.9 else [],
+    } for d, i in spdis]
+
+    document['primary_snapshot_data'] = {
+        'placements_with_allele': placements,
+        'allele_annotations': allele_annotations,
+        'variant_type': 'snv' if all(len(d) == len(i) == 1 for d, i in spdis) else 'delins',
+    }
+    return document
+
+def refsnp_documents(table:pd.DataFrame, rsids, seed=0, merged_fraction=0.02):
+    # (rsid, json bytes) for every rsid, plus the documents of the rsids some of them were merged into
+    rng = random.Random(seed)
+    locations = table.set_index('rsid').loc[list(rsids), ['chromosome', 'position']]
+    for rsid, chromosome, position in zip(locations.index, locations['chromosome'], locations['position']):
+        number = int(rsid[2:])
+        if rng.random() < merged_fraction:
+            # merge targets live above the range any generated genome uses
+            target = number + 2 * 10**9
+            yield rsid, json.dumps(refsnp_document(number, rng, merged_into=target)).encode()
+            yield f'rs{target}', json.dumps(refsnp_document(target, rng, chromosome, int(position))).encode()
+        else:
+            yield rsid, json.dumps(refsnp_document(number, rng, chromosome, int(position))).encode()
+
+def write_compressed(path, compression):
+    # the copy is named without the reader's suffix, so reading it depends on sniffing the header
+    target = f'{path.split(".")[0]}.{compression}'
+    with open(path, 'rb') as f:
+        data = f.read()
+    if compression == 'zip':
+        # a fixed timestamp keeps the archive the same bytes every time, like the other inputs
+        with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(zipfile.ZipInfo('README.txt', date_time=(2000, 1, 1, 0, 0, 0)), 'Synthetic genome for benchmarking.\n')
+            archive.writestr(zipfile.ZipInfo(f'genome_{os.path.basename(path)}', date_time=(2000, 1, 1, 0, 0, 0)), data, compress_type=zipfile.ZIP_DEFLATED)
+    elif compression == 'gz':
+        with open(target, 'wb') as f, gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as compressed:
+            compressed.write(data)
+    elif compression == 'bz2':
+        with bz2.open(target, 'wb') as f:
+            f.write(data)
+    else:
+        with lzma.open(target, 'wb') as f:
+            f.write(data)
+    return target
+
+def _transmitted(haplotypes:np.ndarray, chromosome_codes:np.ndarray, positions:np.ndarray, rng:np.random.Generator):
+    # one haplotype passed on by a parent: a mosaic of its two, switching at about one crossover per 100Mb
+    chosen = np.empty(len(positions), dtype=np.uint8)
+    for code in np.unique(chromosome_codes):
+        columns = np.flatnonzero(chromosome_codes == code)
+        crossovers = np.sort(rng.random(rng.poisson(chromosome_lengths[code] / 100)) * chromosome_lengths[code] * 1e6)
+        chosen[columns] = (rng.integers(0, 2) + np.searchsorted(crossovers, positions[columns])) % 2
+    return haplotypes[chosen, np.arange(len(positions))]
+
+def family_genomes(families=4, children=2, rows=600000, seed=0, no_call_fraction=0.015):
+    # Families of two unrelated parents and their children, built from haplotypes with recombination, so
+    # parent/child pairs never have opposite homozygotes and siblings share about half their genome.
+    # Yields, a family at a time, name -> genome frame (rsid, chromosome, position, alleles) and (a, b) -> relationship.
+    rng = np.random.default_rng(seed + 3)
+    table = genome_table(rows, seed)
+    autosomal = table['chromosome'].isin(chromosomes[:22]).to_numpy() & table['rsid'].str.startswith('rs').to_numpy()
+    table = table[autosomal].reset_index(drop=True)
+    chromosome_codes = table['chromosome'].map({x: i for i, x in enumerate(chromosomes)}).to_numpy()
+    positions = table['position'].to_numpy()
+    first = rng.integers(0, 4, len(table))
+    second = (first + rng.integers(1, 4, len(table))) % 4
+    frequency = rng.uniform(0.05, 0.5, len(table))
+    genotype_names = np.array([a + b for a in bases for b in bases] + ['--'], dtype=object)
+
+    def genome(haplotypes):
+        alleles = np.where(haplotypes == 1, second, first)
+        codes = np.minimum(alleles[0], alleles[1]) * 4 + np.maximum(alleles[0], alleles[1])
+        codes[rng.random(len(codes)) < no_call_fraction] = len(genotype_names) - 1
+        return pd.DataFrame({'rsid': table['rsid'], 'chromosome': table['chromosome'], 'position': positions,
+                             'alleles': pd.Categorical.from_codes(codes, genotype_names)})
+
+    for family in range(families):
+        genomes, relationships = {}, {}
+        parents = [f'family{family}_parent{x}' for x in range(2)]
+        parent_haplotypes = [(rng.random((2, len(table))) < frequency).astype(np.uint8) for _ in parents]
+        for name, haplotypes in zip(parents, parent_haplotypes):
+            genomes[name] = genome(haplotypes)
+        siblings = []
+        for child in range(children):
+            name = f'family{family}_child{child}'
+            haplotypes = np.stack([_transmitted(x, chromosome_codes, positions, rng) for x in parent_haplotypes])
+            genomes[name] = genome(haplotypes)
+            relationships.update({(parent, name): 'parent' for parent in parents})
+            relationships.update({(sibling, name): 'sibling' for sibling in siblings})
+            siblings.append(name)
+        yield genomes, relationships
+
+def write_panel_genomes(folder, count, rows=600000, seed=0):
+    # genomes typed on the same panel as write_inputs' 23andMe file, each with its genotypes shuffled, so a
+    # batch of them shares the studied rsids and refsnp documents written for that one
+    table = genome_table(rows, seed)
+    rng = np.random.default_rng(seed + 7)
+    paths = []
+    for sample in range(count):
+        path = os.path.join(folder, f'user{sample + 10}_panel.23andme.txt')
+        with open(path, 'w') as f:
+            f.write('# This data file generated by 23andMe at: Sat Jan 01 00:00:00 2000\n')
+            f.write('# rsid\tchromosome\tposition\tgenotype\n')
+            table.assign(genotype=rng.permutation(table['genotype'].to_numpy())).to_csv(f, sep='\t', header=False, index=False)
+        paths.append(path)
+    return paths
+
+def write_inputs(folder, rows=600000, seed=0, studied_fraction=0.04):
+    os.makedirs(folder, exist_ok=True)
+    paths = {
+        '23andme': os.path.join(folder, f'user1_bench.23andme.txt'),
+        'ancestry': os.path.join(folder, f'user2_bench.ancestry.txt'),
+        'citations': os.path.join(folder, 'var_citations.txt'),
+        'refsnp': os.path.join(folder, 'refsnp.jsonl'),
+    }
+    table = write_twentythree(paths['23andme'], rows, seed)
+    write_ancestry(paths['ancestry'], rows, seed + 100)
+    for compression in ['gz', 'zip', 'bz2', 'xz']:
+        paths[f'23andme_{compression}'] = write_compressed(paths['23andme'], compression)
+    for compression in ['gz', 'zip']:
+        paths[f'ancestry_{compression}'] = write_compressed(paths['ancestry'], compression)
+    studied = sample_studied_rsids(table, studied_fraction, seed)
+    write_citations(paths['citations'], studied, table['rsid'], seed=seed)
+    with open(paths['refsnp'], 'wb') as f:
+        for rsid, document in refsnp_documents(table, studied, seed):
+            f.write(rsid.encode() + b'\t' + document + b'\n')
+    return paths
+
+def read_refsnp_documents(path):
+    with open(path, 'rb') as f:
+        for line in f:
+            rsid, document = line.rstrip(b'\n').split(b'\t', 1)
+            yield rsid.decode(), document
+
+def main():
+    parser = argparse.ArgumentParser(description='Write deterministic synthetic genomes, citations and refsnp documents.')
+    parser.add_argument('folder')
+    parser.add_argument('--rows', type=int, default=600000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--studied-fraction', type=float, default=0.04)
+    args = parser.parse_args()
+    for name, path in write_inputs(args.folder, args.rows, args.seed, args.studied_fraction).items():
+        print(f'{name:<10} {path}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import os, argparse
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Compare 23andMe or Ancestry raw data files pairwise: identity by state and shared segments.')
+    parser.add_argument('filenames', nargs='+', help='two or more raw data files, as plain text or .zip, .gz, .bz2 or .xz')
+    parser.add_argument('--output', default=None, help='folder for pairs.csv and segments.csv (default: .data/output/comparison)')
+    parser.add_argument('--min-snps', type=int, default=None, help='fewest snps in a shared segment (default: 500)')
+    parser.add_argument('--min-mb', type=float, default=None, help='shortest shared segment in megabases (default: 5)')
+    parser.add_argument('--block-samples', type=int, default=None, help='genomes compared against each other at once (default: 32)')
+    parser.add_argument('--instrument', choices=['summary','jsonl'], default=None,
+                        help='print a table of stage timings at the end (summary), or append them to .data/instrumentation.jsonl (jsonl)')
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args()
+    if len(args.filenames) < 2:
+        raise Exception('Pass at least two files to compare.')
+
+    from container import Container
+    container:Container = Container()
+    Container.wire(container)
+
+    options = container.Options()
+    if args.min_snps is not None:
+        options.comparison_min_segment_snps = args.min_snps
+    if args.min_mb is not None:
+        options.comparison_min_segment_bp = int(args.min_mb * 1e6)
+    if args.block_samples is not None:
+        options.comparison_block_samples = args.block_samples
+    options.instrumentation = args.instrument
+
+    comparer = container.GenomeComparer()
+    pairs, segments = comparer.compare(comparer.read_matrix(args.filenames))
+    output = args.output or options.comparison_output_folder
+    os.makedirs(output, exist_ok=True)
+    pairs.to_csv(os.path.join(output, 'pairs.csv'), index=False)
+    segments.to_csv(os.path.join(output, 'segments.csv'), index=False)
+
+    print(pairs.assign(shared_mb=(pairs['shared_bp'] / 1e6).round(1)).drop(columns='shared_bp').to_string(index=False))
+    print(f'\nWritten to {output}')
+    container.Instrumentation().report()
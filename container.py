@@ -4,14 +4,29 @@ from src import *
 class Container(containers.DeclarativeContainer):
     container = providers.Object(None)
     DNAAnalyzer = providers.Singleton(DNAAnalyzer)
+    AnalysisService = providers.Singleton(AnalysisService)
+    VariantMatcher = providers.Singleton(VariantMatcher)
+    XlsxStreamWriter = providers.Singleton(XlsxStreamWriter)
+    ReportWriter = providers.Singleton(ReportWriter)
+    GenomeComparer = providers.Singleton(GenomeComparer)
     Options = providers.Singleton(Options)
+    Instrumentation = providers.Singleton(Instrumentation)
+    StageCache = providers.Singleton(StageCache)
     CitationsDataframeGenerator = providers.Singleton(CitationsDataframeGenerator)
     NCBIDataDownloader = providers.Singleton(NCBIDataDownloader)
+    RefSnpAsyncDownloader = providers.Singleton(RefSnpAsyncDownloader)
+    RefSnpStore = providers.Singleton(RefSnpStore)
+    RefSnpParser = providers.Singleton(RefSnpParser)
+    RefSnpParseExecutor = providers.Singleton(RefSnpParseExecutor)
+    NCBIDataset = providers.Singleton(NCBIDataset)
+    VariantIndex = providers.Singleton(VariantIndex)
     NCBIDataFrameGenerator = providers.Singleton(NCBIDataFrameGenerator)
+    NCBIDataRefresher = providers.Singleton(NCBIDataRefresher)
     AncestryReader = providers.Singleton(AncestryReader)
     TwentyThreeReader = providers.Singleton(TwentyThreeReader)
     GeneticFileReader = providers.Singleton(GeneticFileReader)
     GeneticDataToDataFrameConverter = providers.Singleton(GeneticDataToDataFrameConverter)
+    OpenSnpFrequencyPipeline = providers.Singleton(OpenSnpFrequencyPipeline)
 
     def wire(container: containers.DeclarativeContainer, mod='__main__'):
         import src
@@ -0,0 +1,46 @@
+import os, argparse
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Find variants by gene, region or disease in the NCBI data, or in the reports of analyzed raw data files.')
+    parser.add_argument('filenames', nargs='*', help='raw data files analyzed before with the parquet format, whose reports are searched (default: the NCBI data)')
+    parser.add_argument('--gene', nargs='+', default=None, help='gene symbols such as BRCA1 BRCA2, any of them matches')
+    parser.add_argument('--region', default=None,
+                        help='chromosome:start-end such as chr17:43,000,000-43,200,000, or a whole chromosome; GRCh38 for the NCBI data, the raw data\'s build for reports')
+    parser.add_argument('--disease', default=None, help='a word or phrase in the disease names, case insensitive')
+    parser.add_argument('--output', default=None, help='write the matches to this csv instead of printing them')
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args()
+    if (args.gene is None) and (args.region is None) and (args.disease is None):
+        raise Exception('Pass --gene, --region or --disease.')
+
+    from container import Container
+    container:Container = Container()
+    Container.wire(container)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    index = container.VariantIndex()
+    criteria = {'genes': args.gene, 'region': args.region, 'disease': args.disease}
+    if len(args.filenames) == 0:
+        result = index.query_reference(**criteria)
+    else:
+        report_writer = container.ReportWriter()
+        tables = []
+        for filename in args.filenames:
+            path = report_writer.output_path(filename, 'parquet')
+            if not os.path.exists(path):
+                raise Exception(f'No parquet report for {filename}, analyze it with --formats parquet first.')
+            matches = index.query_table(pq.read_table(path), **criteria)
+            tables.append(matches.add_column(0, 'sample', pa.array([os.path.basename(filename).split('.')[0]] * matches.num_rows, pa.string())))
+        result = pa.concat_tables(tables, promote=True)
+
+    if args.output is not None:
+        import pyarrow.csv as pacsv
+        pacsv.write_csv(result, args.output)
+        print(f'{result.num_rows} matches written to {args.output}')
+    else:
+        columns = [x for x in ['sample', 'rsid', 'chromosome', 'position', 'alleles', 'description', 'gene_locus', 'significances', 'diseases'] if x in result.column_names]
+        print(result.select(columns).to_pandas().to_string(index=False))
+        print(f'\n{result.num_rows} matches')
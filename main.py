@@ -1,19 +1,68 @@
-from src import *
-from container import Container
+import argparse
 from dependency_injector.wiring import Provide
 
-raise Exception('Read the readme, then comment this out if you still want to run this code.')
-
 class Main():
-    def __init__(self, dna_analyzer:DNAAnalyzer = Provide['DNAAnalyzer']):
+    def __init__(self, dna_analyzer:'DNAAnalyzer' = Provide['DNAAnalyzer']):
         self._dna_analyzer = dna_analyzer
 
     def run_analysis(self, filename:str):
         self._dna_analyzer.analyze(filename)
 
+    def run_batch_analysis(self, filenames, combined=False):
+        self._dna_analyzer.analyze_many(filenames, combined)
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Match a 23andMe or Ancestry raw data file against NCBI variant data.')
+    parser.add_argument('filenames', nargs='+', help='23andMe or Ancestry raw data files, as plain text or .zip, .gz, .bz2 or .xz')
+    parser.add_argument('--accept-disclaimer', action='store_true', help='confirm you have read the readme, nothing runs without it')
+    parser.add_argument('--ncbi-data', choices=['ask','public','generate'], default='ask',
+                        help='use the pre-processed public NCBI data (public), build it from the refsnp store (generate), or prompt (ask)')
+    parser.add_argument('--no-download', action='store_true', help='only use refsnp data that has already been downloaded')
+    parser.add_argument('--force-regenerate', action='store_true', help='rebuild the NCBI data for the genome even when it is cached')
+    parser.add_argument('--parse-backend', default=None,
+                        help="where refsnp documents are parsed: serial, thread, process, or a dask scheduler address (default: processes on more than one core)")
+    parser.add_argument('--parse-workers', type=int, default=None, help='workers parsing refsnp documents (default: one per core)')
+    parser.add_argument('--engine', choices=['pandas','arrow'], default=None,
+                        help='run the read, citation filter, NCBI join and classification on pandas dataframes or arrow tables (default: pandas)')
+    parser.add_argument('--batch', action='store_true',
+                        help='analyze the files together: the reference data is loaded and fetched once and the genomes are classified in parallel')
+    parser.add_argument('--combined', action='store_true', help='with --batch, also write every genome\'s matches to one table in .data/output/combined')
+    parser.add_argument('--workers', type=int, default=None, help='processes classifying genomes with --batch (default: one per core)')
+    parser.add_argument('--formats', nargs='+', choices=['xlsx','parquet','csv','jsonl','significant'], default=None,
+                        help='report files to write, significant is a workbook of the clinically significant matches only (default: xlsx parquet)')
+    parser.add_argument('--instrument', choices=['summary','jsonl'], default=None,
+                        help='print a table of stage timings at the end (summary), or append them to .data/instrumentation.jsonl (jsonl)')
+    return parser.parse_args(args)
+
 if __name__ == '__main__':
+    args = parse_args()
+    if not args.accept_disclaimer:
+        raise Exception('Read the readme, then pass --accept-disclaimer if you still want to run this code.')
+
+    # the container pulls in pandas and pyarrow, so it's only imported once there's something to run
+    from container import Container
     container:Container = Container()
     Container.wire(container)
 
+    options = container.Options()
+    options.public_ncbi_data_policy = args.ncbi_data
+    options.allow_download = not args.no_download
+    options.force_regenerate_ncbi_data = args.force_regenerate
+    options.instrumentation = args.instrument
+    if args.parse_backend is not None:
+        options.ncbi_parse_backend = args.parse_backend
+    options.ncbi_parse_workers = args.parse_workers
+    if args.engine is not None:
+        options.pipeline_engine = args.engine
+    if args.formats is not None:
+        options.report_formats = args.formats
+
+    options.analyze_workers = args.workers
+
     m = Main()
-    m.run_analysis('.data/dna_samples/david.23andme.txt')
+    if args.batch or args.combined:
+        m.run_batch_analysis(args.filenames, args.combined)
+    else:
+        for filename in args.filenames:
+            m.run_analysis(filename)
+    container.Instrumentation().report()
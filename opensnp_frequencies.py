@@ -0,0 +1,26 @@
+import argparse
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Build per-rsid genotype and allele frequencies from openSNP user files in .data/opensnp.')
+    parser.add_argument('--batch-size', type=int, default=None, help='genomes read per batch, and the most held in memory at once (default: 20)')
+    parser.add_argument('--workers', type=int, default=None, help='processes reading files (default: one per core)')
+    parser.add_argument('--force-reduce', action='store_true', help='rebuild the frequency tables even when no new batch was added')
+    parser.add_argument('--instrument', choices=['summary','jsonl'], default=None,
+                        help='print a table of stage timings at the end (summary), or append them to .data/instrumentation.jsonl (jsonl)')
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    from container import Container
+    container:Container = Container()
+    Container.wire(container)
+
+    options = container.Options()
+    if args.batch_size is not None:
+        options.opensnp_batch_size = args.batch_size
+    options.opensnp_workers = args.workers
+    options.instrumentation = args.instrument
+
+    container.OpenSnpFrequencyPipeline().run(force_reduce=args.force_reduce)
+    container.Instrumentation().report()
@@ -0,0 +1,33 @@
+import argparse
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Bring the downloaded refsnp data and the NCBI data generated from it up to date with NCBI and ClinVar.')
+    parser.add_argument('--max-age', type=float, default=None, help='refetch refsnp documents fetched more than this many days ago (default: 30)')
+    parser.add_argument('--citations', default=None,
+                        help='a var_citations.txt already downloaded to use as the new ClinVar snapshot (default: download the current one)')
+    parser.add_argument('--parse-backend', default=None,
+                        help="where changed refsnp documents are parsed: serial, thread, process, or a dask scheduler address (default: processes on more than one core)")
+    parser.add_argument('--instrument', choices=['summary','jsonl'], default=None,
+                        help='print a table of stage timings at the end (summary), or append them to .data/instrumentation.jsonl (jsonl)')
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    from container import Container
+    container:Container = Container()
+    Container.wire(container)
+
+    options = container.Options()
+    if args.parse_backend is not None:
+        options.ncbi_parse_backend = args.parse_backend
+    options.instrumentation = args.instrument
+
+    summary = container.NCBIDataRefresher().refresh(args.citations, args.max_age)
+    if summary['citations_changed'] is None:
+        print('No previous ClinVar snapshot to compare with, only documents past their age were refetched.')
+    else:
+        print(f'{summary["citations_changed"]} rsids had their ClinVar citations change.')
+    print(f'{summary["due"]} refsnp documents were due, {summary["refetched"]} refetched, {summary["changed"]} of them had changed '
+          f'and {summary["rows_upserted"]} NCBI rows were written for them.')
+    container.Instrumentation().report()
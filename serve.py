@@ -0,0 +1,108 @@
+import io, json, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# A local HTTP front for AnalysisService:
+#   POST /analyze            the body is a raw data file (plain or compressed), the reply its detected variants
+#   POST /analyze?path=...   a raw data file already on this machine
+#   ?format=json|csv|parquet picks the reply's format, json records by default
+#   GET  /status             the loaded reference data
+#   POST /reload             reloads the reference data now instead of waiting for the next version check
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Serve analyses of 23andMe and Ancestry raw data against NCBI data kept in memory.')
+    parser.add_argument('--host', default=None, help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=None, help='port to listen on (default: 8765)')
+    parser.add_argument('--reload-interval', type=float, default=None, help='seconds between checks for new NCBI data (default: 5)')
+    parser.add_argument('--ncbi-data', choices=['ask','public','generate'], default=None,
+                        help='use the pre-processed public NCBI data, or the data generated from the refsnp store (default: ask once)')
+    parser.add_argument('--instrument', choices=['summary','jsonl'], default=None,
+                        help='print a table of stage timings on shutdown (summary), or append them to .data/instrumentation.jsonl (jsonl)')
+    return parser.parse_args(args)
+
+def make_handler(service):
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    class AnalysisRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status, body:bytes, content_type='application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _reply_json(self, status, value):
+            self._reply(status, json.dumps(value).encode())
+
+        def _encode(self, detected, format):
+            if format == 'parquet':
+                sink = io.BytesIO()
+                pq.write_table(detected, sink)
+                return sink.getvalue(), 'application/vnd.apache.parquet'
+            if format == 'csv':
+                sink = io.BytesIO()
+                pacsv.write_csv(detected, sink)
+                return sink.getvalue(), 'text/csv'
+            return json.dumps(detected.to_pylist()).encode(), 'application/json'
+
+        def do_GET(self):
+            if urlparse(self.path).path != '/status':
+                return self._reply_json(404, {'error': 'not found'})
+            self._reply_json(200, service.status())
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if url.path == '/reload':
+                service.reload(force=True)
+                return self._reply_json(200, service.status())
+            if url.path != '/analyze':
+                return self._reply_json(404, {'error': 'not found'})
+
+            format = query.get('format', 'json')
+            if format not in ['json', 'csv', 'parquet']:
+                return self._reply_json(400, {'error': f'Unknown format {format}, expected json, csv or parquet.'})
+            try:
+                detected = service.analyze(query['path'] if 'path' in query else body)
+            except Exception as e:
+                return self._reply_json(400, {'error': str(e)})
+            self._reply(200, *self._encode(detected, format))
+
+        def log_message(self, format, *args):
+            pass
+
+    return AnalysisRequestHandler
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    from container import Container
+    container:Container = Container()
+    Container.wire(container)
+
+    options = container.Options()
+    if args.reload_interval is not None:
+        options.service_reload_interval = args.reload_interval
+    if args.ncbi_data is not None:
+        options.public_ncbi_data_policy = args.ncbi_data
+    options.instrumentation = args.instrument
+
+    service = container.AnalysisService()
+    # loaded before listening, so the first request doesn't pay for it
+    reference = service.reload()
+    host = args.host or options.service_host
+    port = options.service_port if args.port is None else args.port
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f'Serving {reference[1].num_rows} NCBI rows on http://{host}:{server.server_port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        container.Instrumentation().report()
@@ -1,4 +1,24 @@
-from .common import *
-from .file_readers import *
-from .analysis import *
-from .ncbi import *
\ No newline at end of file
+import importlib
+
+# subpackages are only imported when one of their names is first used, so `import src` (and the
+# command line's --help) doesn't pay for pandas and pyarrow up front
+_exports = {
+    'common': ['Options', 'Instrumentation', 'StageCache', 'rsid_to_key', 'key_to_rsid', 'with_rsid_key', 'isin_sorted', 'merge_on_rsid_key', 'table_with_rsid_key', 'merge_tables_on_rsid_key', 'atomic_write', 'write_bytes', 'write_json', 'file_lock', 'is_intact', 'single_flight'],
+    'file_readers': ['GeneticFileReader', 'AncestryReader', 'TwentyThreeReader', 'RawDataFile', 'GeneticDataToDataFrameConverter'],
+    'analysis': ['VariantMatcher', 'XlsxStreamWriter', 'ReportWriter', 'GenotypeMatrix', 'GenomeComparer', 'DNAAnalyzer', 'AnalysisService'],
+    'ncbi': ['NCBIDataset', 'RefSnpParser', 'RefSnpParseExecutor', 'RefSnpStore', 'TokenBucket', 'RefSnpAsyncDownloader', 'NCBIDataDownloader', 'NCBIDataFrameGenerator', 'CitationsDataframeGenerator', 'NCBIDataRefresher', 'VariantIndex', 'parse_region'],
+    'opensnp': ['OpenSnpFrequencyPipeline'],
+}
+_packages = {name:package for package, names in _exports.items() for name in names}
+
+__all__ = list(_packages)
+
+def __getattr__(name):
+    if name not in _packages:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_packages[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
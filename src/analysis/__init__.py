@@ -1 +1,7 @@
-from .dna_analyzer import *
\ No newline at end of file
+from .variant_matcher import *
+from .xlsx_stream_writer import *
+from .report_writer import *
+from .genotype_matrix import *
+from .genome_comparison import *
+from .dna_analyzer import *
+from .analysis_service import *
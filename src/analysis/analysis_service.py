@@ -0,0 +1,113 @@
+from ..file_readers import GeneticDataToDataFrameConverter
+from ..common import Options, Instrumentation, rsid_to_key, table_with_rsid_key, merge_tables_on_rsid_key
+from ..ncbi import *
+from .variant_matcher import VariantMatcher
+from .dna_analyzer import _report_order
+import io, os, time, threading
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from dependency_injector.wiring import Provide
+
+class AnalysisService:
+    # Keeps the NCBI rows of every studied rsid loaded and sorted on rsid key between analyses, so an analysis
+    # is a read of the genome, one join and the classification of the rows that joined. Nothing is downloaded
+    # or regenerated here: an rsid the dataset doesn't have yet isn't detected, and once a run of main.py adds
+    # it the new dataset version is noticed within Options.service_reload_interval and the reference reloaded,
+    # without holding up analyses already running against the old one.
+    def __init__(self,
+                 genetic_data_reader:GeneticDataToDataFrameConverter = Provide['GeneticDataToDataFrameConverter'],
+                 ncbi_dataframe_generator:NCBIDataFrameGenerator = Provide['NCBIDataFrameGenerator'],
+                 citations_dataframe_generator:CitationsDataframeGenerator = Provide['CitationsDataframeGenerator'],
+                 variant_matcher:VariantMatcher = Provide['VariantMatcher'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore'],
+                 options:Options = Provide['Options'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._genetic_data_reader = genetic_data_reader
+        self._ncbi_dataframe_generator = ncbi_dataframe_generator
+        self._citations_dataframe_generator = citations_dataframe_generator
+        self._variant_matcher = variant_matcher
+        self._refsnp_store = refsnp_store
+        self._options = options
+        self._instrumentation = instrumentation
+        self._lock = threading.Lock()
+        # (version, table, loaded_at), swapped whole so a reader never sees half of a reload
+        self._reference = None
+        self._checked_at = 0.0
+        self._use_public = None
+
+    def _reference_version(self):
+        # cheap enough to check every few seconds: a listing of the dataset, a stat of the citations and one sqlite row
+        citations = self._options.citations_rsid_keys_file
+        stat = os.stat(citations) if os.path.exists(citations) else None
+        return (self._ncbi_dataframe_generator.get_data_version(), None if stat is None else (stat.st_size, stat.st_mtime_ns),
+                self._refsnp_store.alias_version())
+
+    def _load_reference(self, version):
+        with self._instrumentation.span('service.reload') as span:
+            if self._use_public is None:
+                # asked once, the answer holds for every reload
+                self._use_public = self._ncbi_dataframe_generator.uses_public_data()
+            studied_rsid_keys = self._citations_dataframe_generator.get_studied_rsid_keys()
+            studied_rsid_keys = np.union1d(studied_rsid_keys, self._refsnp_store.canonical_keys(studied_rsid_keys))
+            table = self._ncbi_dataframe_generator.get_reference_table(studied_rsid_keys, self._use_public)
+            # combined so each join gathers from one chunk per column
+            table = table.combine_chunks()
+            span.add_rows(table.num_rows)
+        return (version, table, time.time())
+
+    def _refresh(self, force=False):
+        self._checked_at = time.monotonic()
+        version = self._reference_version()
+        if force or (self._reference is None) or (self._reference[0] != version):
+            self._reference = self._load_reference(version)
+            self._instrumentation.count('service.reloads')
+        return self._reference
+
+    def reload(self, force=False):
+        with self._lock:
+            return self._refresh(force)
+
+    def _current_reference(self):
+        reference = self._reference
+        if (reference is not None) and (time.monotonic() - self._checked_at < self._options.service_reload_interval):
+            return reference
+        # one thread checks for a new version while the others carry on with the reference they have
+        if not self._lock.acquire(blocking=reference is None):
+            return reference
+        try:
+            return self._refresh()
+        finally:
+            self._lock.release()
+
+    def status(self):
+        reference = self._current_reference()
+        return {'reference_rows': reference[1].num_rows, 'reference_bytes': reference[1].nbytes, 'loaded_at': reference[2],
+                'dataset_version': reference[0][0][0], 'alias_version': reference[0][2]}
+
+    def _read_genome(self, source, reference_keys:pa.Array):
+        dna = self._genetic_data_reader.read_table(source, throw_on_error=True)
+        if dna is None:
+            raise Exception('Not a 23andMe or Ancestry raw data file.')
+        # only the rows that can join are canonicalized and sorted, a stable sort of them is the order they'd
+        # have in the whole sorted genome, so the join sees the same left side analyze does
+        keys = rsid_to_key(dna['rsid'])
+        kept = pc.is_in(pa.array(self._refsnp_store.canonical_keys(keys)), value_set=reference_keys)
+        kept = np.flatnonzero(kept.to_numpy(zero_copy_only=False))
+        dna = dna.take(kept).append_column('rsid_key', pa.array(keys[kept], pa.int64()))
+        return table_with_rsid_key(self._refsnp_store.canonicalize_table(dna))
+
+    def analyze(self, source) -> pa.Table:
+        # source is a file name, an open binary file or the bytes of one, plain or compressed. The detected
+        # variants are the rows analyze reports for the same genome and the same NCBI data.
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with self._instrumentation.span('service.analyze') as span:
+            reference = self._current_reference()
+            with self._instrumentation.span('service.genome'):
+                genome = self._read_genome(source, reference[1]['rsid_key'].combine_chunks())
+            with self._instrumentation.span('service.detected'):
+                dna_ncbi_augmented = merge_tables_on_rsid_key(genome, reference[1])
+                detected = _report_order(self._variant_matcher.classify_table(dna_ncbi_augmented).drop(['rsid_key']))
+            span.add_rows(detected.num_rows)
+        return detected
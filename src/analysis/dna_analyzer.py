@@ -1,48 +1,308 @@
 from ..file_readers import GeneticDataToDataFrameConverter
-from ..common import Options
+from ..common import Options, Instrumentation, StageCache, with_rsid_key, isin_sorted, merge_on_rsid_key, table_with_rsid_key, merge_tables_on_rsid_key
 from ..ncbi import *
-import os
+from .variant_matcher import VariantMatcher
+from .report_writer import ReportWriter
+import os, hashlib, collections
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc
+from concurrent.futures import ProcessPoolExecutor
 import natsort
 from dependency_injector.wiring import Provide
 
+def _report_order(detected:pa.Table):
+    # the result is small, so its columns take the plain types the pandas engine's report has
+    detected = detected.set_column(detected.column_names.index('chromosome'), 'chromosome', pc.cast(detected['chromosome'], pa.string()))
+    detected = detected.set_column(detected.column_names.index('alleles'), 'alleles', pc.cast(detected['alleles'], pa.string()))
+    detected = detected.set_column(detected.column_names.index('position'), 'position', pc.cast(detected['position'], pa.int64()))
+    chromosomes = pc.unique(detected['chromosome']).to_pylist()
+    ranks = np.empty(len(chromosomes), dtype=np.int64)
+    ranks[natsort.index_humansorted(chromosomes)] = np.arange(len(chromosomes))
+    chromosome_rank = ranks[pc.index_in(detected['chromosome'], value_set=pa.array(chromosomes, pa.string())).to_numpy()]
+    # the same two sorts as _classify, so rows sharing a position come out in the same order
+    order = np.argsort(detected['position'].to_numpy(), kind='quicksort')
+    order = order[np.argsort(chromosome_rank[order], kind='stable')]
+    return detected.take(order)
+
+_worker_matcher = VariantMatcher()
+_worker_references = {}
+
+def _classify_sample(genome:pa.Table, reference_path):
+    # Runs in analyze_many's workers. The NCBI table is memory mapped from the arrow file the batch wrote,
+    # so every worker reads the same pages from the page cache instead of unpickling a copy of its own.
+    if reference_path not in _worker_references:
+        _worker_references.clear()
+        _worker_references[reference_path] = pa.ipc.open_file(pa.memory_map(reference_path, 'r')).read_all()
+    dna_ncbi_augmented = merge_tables_on_rsid_key(genome, _worker_references[reference_path])
+    return _report_order(_worker_matcher.classify_table(dna_ncbi_augmented).drop(['rsid_key']))
+
 class DNAAnalyzer:
     def __init__(self, 
                  genetic_data_reader:GeneticDataToDataFrameConverter = Provide['GeneticDataToDataFrameConverter'],
                  ncbi_dataframe_generator:NCBIDataFrameGenerator = Provide['NCBIDataFrameGenerator'],
                  citations_dataframe_generator:CitationsDataframeGenerator = Provide['CitationsDataframeGenerator'],
-                 options:Options = Provide['Options']):
+                 variant_matcher:VariantMatcher = Provide['VariantMatcher'],
+                 report_writer:ReportWriter = Provide['ReportWriter'],
+                 stage_cache:StageCache = Provide['StageCache'],
+                 options:Options = Provide['Options'],
+                 instrumentation:Instrumentation = Provide['Instrumentation'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore']):
         self._genetic_data_reader = genetic_data_reader
         self._ncbi_dataframe_generator = ncbi_dataframe_generator
         self._citations_dataframe_generator = citations_dataframe_generator
+        self._variant_matcher = variant_matcher
+        self._report_writer = report_writer
+        self._stage_cache = stage_cache
         self._options = options
+        self._instrumentation = instrumentation
+        self._refsnp_store = refsnp_store
+
+    def _studied_rsid_keys(self):
+        studied_rsid_keys = self._citations_dataframe_generator.get_studied_rsid_keys()
+        # a citation of a retired rsid counts for the rsid it was merged into
+        return np.union1d(studied_rsid_keys, self._refsnp_store.canonical_keys(studied_rsid_keys))
+
+    def _read_keys(self, studied_rsid_keys):
+        # the rsids a genome is read with: the studied ones, the retired rsids the alias map sends to them, and every
+        # rsid of the public data when that may be what's used, since its rows join whether they're studied or not
+        read_keys = np.union1d(studied_rsid_keys, self._refsnp_store.retired_keys(studied_rsid_keys))
+        return np.union1d(read_keys, self._ncbi_dataframe_generator.public_rsid_keys())
+
+    def _read_genome(self, filename, read_keys=None):
+        if read_keys is None:
+            dna = self._genetic_data_reader.read_data(filename).drop(columns=['user','source'])
+        else:
+            # only the rows that can join are kept, a block at a time, in the types read_data gives
+            dna = self._genetic_data_reader.read_data_streaming(filename, read_keys)
+            dna = dna.astype({'chromosome': str, 'position': np.int64, 'alleles': str})
+        # retired rsids are read as the rsid they were merged into, which is what the NCBI data is under
+        return with_rsid_key(self._refsnp_store.canonicalize(with_rsid_key(dna, sort=False))).reset_index(drop=True)
+
+    def _get_genome_key(self, filename, read_keys=None):
+        return self._stage_cache.key('genome', self._stage_cache.file_hash(filename), self._genetic_data_reader.get_reader_version(filename),
+                                     self._refsnp_store.alias_version(), None if read_keys is None else hashlib.sha256(read_keys.tobytes()).hexdigest())
 
     def get_cached_merge_dataframe(self, filename):
-        file_location = os.path.join(self._options.output_cache_folder(filename), 'raw_merged.parquet')
-        if os.path.exists(file_location):
-            return pd.read_parquet(file_location)
-        dna = self._genetic_data_reader.read_data(filename)
-        dna = dna.drop(columns=['user','source'])
-        dna.to_parquet(file_location)
-        return dna
+        return self._stage_cache.get_or_compute('genome', self._get_genome_key(filename), lambda: self._read_genome(filename))
 
-    def analyze(self, filename):
-        merged_dna = self.get_cached_merge_dataframe(filename)
-        citations_dataframe = self._citations_dataframe_generator.get_dataframe()
-        studied_rsids = citations_dataframe[['rsid']].drop_duplicates()
-        merged_dna_data_with_studied_rsids = merged_dna.merge(studied_rsids, on=['rsid'], how='inner')
-        ncbi_data = self._ncbi_dataframe_generator.get_dataframe_of_data(merged_dna_data_with_studied_rsids, allow_download=True, force_regenerate_dataframe=False)
-        dna_ncbi_augmented = merged_dna.merge(ncbi_data, on=['rsid'], how='inner')
-        detected_snvs = dna_ncbi_augmented[dna_ncbi_augmented.apply(lambda x:x['inserted'] in x['alleles'], axis=1) & (dna_ncbi_augmented['variant_type'] == 'snv')]
-        detected_delinv = dna_ncbi_augmented[(dna_ncbi_augmented['alleles'] == 'DI') & (dna_ncbi_augmented['variant_type'].isin(['del','ins','dup']))]
-        dd = dna_ncbi_augmented[(dna_ncbi_augmented['alleles'] == 'DD') & (dna_ncbi_augmented['variant_type'].isin(['std'])) & (dna_ncbi_augmented['deleted'] == '') & (dna_ncbi_augmented['inserted'] == '')]
-        ii = dna_ncbi_augmented[(dna_ncbi_augmented['alleles'] == 'II') & (dna_ncbi_augmented['variant_type'].isin(['std'])) & (dna_ncbi_augmented['deleted'] != '') & (dna_ncbi_augmented['inserted'] != '')]
-        std = dna_ncbi_augmented[(dna_ncbi_augmented['variant_type'] == 'std') & ((dna_ncbi_augmented['alleles'] == (dna_ncbi_augmented['inserted']*2)) | (dna_ncbi_augmented['alleles'] == dna_ncbi_augmented['inserted']))]
-
-        detected = pd.concat([detected_snvs, detected_delinv, dd, ii, std]).reset_index(drop=True)
+    def _uses_public_data(self, force_regenerate):
+        # resolved before the ncbi key is, so with the ask policy the key holds the answer given, not the policy
+        return (not force_regenerate) and self._ncbi_dataframe_generator.uses_public_data()
+
+    def _get_ncbi_key(self, studied_key, use_public):
+        return self._stage_cache.key('ncbi', studied_key, self._ncbi_dataframe_generator.get_data_version(), use_public)
+
+    def _get_ncbi_data(self, studied_key, merged_dna_data_with_studied_rsids):
+        force_regenerate = self._options.force_regenerate_ncbi_data
+        use_public = self._uses_public_data(force_regenerate)
+        ncbi_key = self._get_ncbi_key(studied_key, use_public)
+        ncbi_data = None if force_regenerate else self._stage_cache.get('ncbi', ncbi_key)
+        if ncbi_data is not None:
+            return ncbi_key, ncbi_data
+
+        ncbi_data = self._ncbi_dataframe_generator.get_dataframe_of_data(merged_dna_data_with_studied_rsids, 
+            allow_download=self._options.allow_download, force_regenerate_dataframe=force_regenerate, use_public=use_public)
+        # keyed on the version after the fetch, so a run that added rows is a hit next time
+        ncbi_key = self._get_ncbi_key(studied_key, use_public)
+        self._stage_cache.put('ncbi', ncbi_key, ncbi_data)
+        return ncbi_key, ncbi_data
+
+    def _classify(self, merged_dna, ncbi_data):
+        with self._instrumentation.span('merge') as span:
+            dna_ncbi_augmented = merge_on_rsid_key(merged_dna, ncbi_data)
+            span.add_rows(len(dna_ncbi_augmented))
+        with self._instrumentation.span('classify', rows=len(dna_ncbi_augmented)):
+            detected = self._variant_matcher.classify(dna_ncbi_augmented).drop(columns='rsid_key')
         
         detected = detected.sort_values(by='position').reset_index(drop=True)
         detected = detected.iloc[natsort.index_humansorted(detected.chromosome)].reset_index(drop=True)
-        
-        detected.to_excel(os.path.join(self._options.output_cache_folder(filename), f'{os.path.basename(filename).split(".")[0]}_variations.xlsx'), index=False)
-        detected.to_parquet(os.path.join(self._options.output_cache_folder(filename), f'{os.path.basename(filename).split(".")[0]}_variations.parquet'))
+        return detected
+
+    def _read_genome_table(self, filename, read_keys=None):
+        dna = self._genetic_data_reader.read_table(filename, read_keys)
+        return table_with_rsid_key(self._refsnp_store.canonicalize_table(table_with_rsid_key(dna, sort=False)))
+
+    def _get_ncbi_table(self, studied_key, studied_table):
+        force_regenerate = self._options.force_regenerate_ncbi_data
+        use_public = self._uses_public_data(force_regenerate)
+        ncbi_key = self._get_ncbi_key(studied_key, use_public)
+        ncbi_data = None if force_regenerate else self._stage_cache.get_table('ncbi_arrow', ncbi_key)
+        if ncbi_data is not None:
+            return ncbi_key, ncbi_data
+
+        ncbi_data = self._ncbi_dataframe_generator.get_table_of_data(studied_table,
+            allow_download=self._options.allow_download, force_regenerate_dataframe=force_regenerate, use_public=use_public)
+        ncbi_key = self._get_ncbi_key(studied_key, use_public)
+        self._stage_cache.put_table('ncbi_arrow', ncbi_key, ncbi_data)
+        return ncbi_key, ncbi_data
+
+    def _classify_table(self, genome:pa.Table, ncbi_data:pa.Table):
+        with self._instrumentation.span('merge') as span:
+            dna_ncbi_augmented = merge_tables_on_rsid_key(genome, ncbi_data)
+            span.add_rows(dna_ncbi_augmented.num_rows)
+        with self._instrumentation.span('classify', rows=dna_ncbi_augmented.num_rows):
+            detected = self._variant_matcher.classify_table(dna_ncbi_augmented).drop(['rsid_key'])
+        return _report_order(detected)
+
+    def _analyze_arrow(self, filename):
+        # analyze on arrow tables, with the stage keys of the pandas engine so a report written by either is reused
+        with self._instrumentation.span('analyze'):
+            with self._instrumentation.span('genome') as span:
+                alias_version = self._refsnp_store.alias_version()
+                studied_rsid_keys = self._studied_rsid_keys()
+                read_keys = self._read_keys(studied_rsid_keys)
+                genome_key = self._get_genome_key(filename, read_keys)
+                merged_dna = self._stage_cache.get_or_compute_table('genome_arrow', genome_key, lambda: self._read_genome_table(filename, read_keys))
+                span.add_rows(merged_dna.num_rows)
+
+            with self._instrumentation.span('studied') as span:
+                studied_key = self._stage_cache.key('studied', genome_key, self._citations_dataframe_generator.get_snapshot_version())
+                studied = self._stage_cache.get_or_compute_table('studied_arrow', studied_key,
+                    lambda: merged_dna.filter(pa.array(isin_sorted(merged_dna['rsid_key'].to_numpy(), studied_rsid_keys))))
+                span.add_rows(studied.num_rows)
+
+            with self._instrumentation.span('ncbi') as span:
+                ncbi_key, ncbi_data = self._get_ncbi_table(studied_key, studied)
+                span.add_rows(ncbi_data.num_rows)
+            if self._refsnp_store.alias_version() != alias_version:
+                # parsing found retired rsids, read again with them so the rows they were read under join
+                read_keys = self._read_keys(self._studied_rsid_keys())
+                genome_key = self._get_genome_key(filename, read_keys)
+                merged_dna = self._stage_cache.get_or_compute_table('genome_arrow', genome_key, lambda: self._read_genome_table(filename, read_keys))
+
+            with self._instrumentation.span('detected') as span:
+                detected_key = self._stage_cache.key('detected', genome_key, ncbi_key)
+                detected = self._stage_cache.get_or_compute_table('detected_arrow', detected_key, lambda: self._classify_table(merged_dna, ncbi_data))
+                span.add_rows(detected.num_rows)
+
+            with self._instrumentation.span('write_outputs'):
+                self._report_writer.write(filename, detected_key, detected)
+
+    def _workers(self, samples):
+        return min(self._options.analyze_workers or os.cpu_count() or 1, samples)
+
+    def _map_samples(self, items, reference_path):
+        # items are (filename, genome) pairs, classified a few at a time so only those genomes are in flight
+        items = list(items)
+        workers = self._workers(len(items))
+        if workers <= 1:
+            for filename, genome in items:
+                yield filename, _classify_sample(genome, reference_path)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            for filename, genome in items:
+                pending.append((filename, executor.submit(_classify_sample, genome, reference_path)))
+                if len(pending) >= workers * 2:
+                    filename, future = pending.popleft()
+                    yield filename, future.result()
+            while len(pending) > 0:
+                filename, future = pending.popleft()
+                yield filename, future.result()
+
+    def analyze_many(self, filenames, combined=False):
+        # Several genomes against one load of the reference data: the citations are read once, the NCBI rows of
+        # every genome's studied rsids are fetched and regenerated in one pass, and the genomes are classified in
+        # worker processes that memory map the NCBI table. Reports are written per genome as analyze writes them,
+        # and with combined=True a table of every genome's matches, a sample column first, goes to output/combined.
+        filenames = list(dict.fromkeys(filenames))
+        with self._instrumentation.span('analyze_many', rows=len(filenames)):
+            with self._instrumentation.span('genomes') as span:
+                alias_version = self._refsnp_store.alias_version()
+                studied_rsid_keys = self._studied_rsid_keys()
+                read_keys = self._read_keys(studied_rsid_keys)
+                snapshot_version = self._citations_dataframe_generator.get_snapshot_version()
+                genome_keys, studied_keys, studied = {}, {}, []
+                for filename in filenames:
+                    genome_keys[filename] = self._get_genome_key(filename, read_keys)
+                    genome = self._stage_cache.get_or_compute_table('genome_arrow', genome_keys[filename], lambda: self._read_genome_table(filename, read_keys))
+                    studied_keys[filename] = self._stage_cache.key('studied', genome_keys[filename], snapshot_version)
+                    studied.append(self._stage_cache.get_or_compute_table('studied_arrow', studied_keys[filename],
+                        lambda: genome.filter(pa.array(isin_sorted(genome['rsid_key'].to_numpy(), studied_rsid_keys)))))
+                studied = pa.concat_tables(studied) if len(studied) > 0 else None
+                span.add_rows(0 if studied is None else studied.num_rows)
+            if studied is None:
+                return {}
+
+            with self._instrumentation.span('ncbi') as span:
+                # every genome's studied rsids at once, so one download and one regeneration cover the batch
+                _, first = np.unique(studied['rsid_key'].to_numpy(), return_index=True)
+                ncbi_key, ncbi_data = self._get_ncbi_table(sorted(studied_keys.values()), studied.take(np.sort(first)))
+                span.add_rows(ncbi_data.num_rows)
+            if self._refsnp_store.alias_version() != alias_version:
+                # parsing found retired rsids, the genomes are read again with them so the rows they were read under join
+                read_keys = self._read_keys(self._studied_rsid_keys())
+                genome_keys = {x: self._get_genome_key(x, read_keys) for x in filenames}
+
+            detected_keys, results = {}, {}
+            pending = []
+            for filename in filenames:
+                detected_keys[filename] = self._stage_cache.key('detected', genome_keys[filename], ncbi_key)
+                results[filename] = self._stage_cache.get_table('detected_arrow', detected_keys[filename])
+                if results[filename] is None:
+                    pending.append(filename)
+
+            def genomes():
+                for filename in pending:
+                    yield filename, self._stage_cache.get_or_compute_table('genome_arrow', genome_keys[filename], lambda: self._read_genome_table(filename, read_keys))
+
+            if len(pending) > 0:
+                with self._instrumentation.span('detected', rows=len(pending)):
+                    # a stage cache entry, so batches of the same NCBI data in two processes share one file and
+                    # neither removes it from under the other
+                    reference_path = self._stage_cache.get_or_compute_arrow_file('reference_arrow', ncbi_key, lambda: ncbi_data)
+                    for filename, detected in self._map_samples(genomes(), reference_path):
+                        self._stage_cache.put_table('detected_arrow', detected_keys[filename], detected)
+                        results[filename] = detected
+                _worker_references.clear()
+
+            with self._instrumentation.span('write_outputs'):
+                for filename in filenames:
+                    self._report_writer.write(filename, detected_keys[filename], results[filename])
+                if combined:
+                    samples = [os.path.basename(x).split('.')[0] for x in filenames]
+                    tables = [results[x].add_column(0, 'sample', pa.array([sample] * results[x].num_rows, pa.string())) for x, sample in zip(filenames, samples)]
+                    self._report_writer.write('combined', self._stage_cache.key('combined', samples, [detected_keys[x] for x in filenames]),
+                                              pa.concat_tables(tables))
+            return results
+
+    def analyze(self, filename):
+        if self._options.pipeline_engine == 'arrow':
+            return self._analyze_arrow(filename)
+        if self._options.pipeline_engine != 'pandas':
+            raise Exception(f'Unknown pipeline engine {self._options.pipeline_engine}, expected pandas or arrow.')
+        with self._instrumentation.span('analyze'):
+            with self._instrumentation.span('genome') as span:
+                alias_version = self._refsnp_store.alias_version()
+                studied_rsid_keys = self._studied_rsid_keys()
+                read_keys = self._read_keys(studied_rsid_keys)
+                genome_key = self._get_genome_key(filename, read_keys)
+                merged_dna = self._stage_cache.get_or_compute('genome', genome_key, lambda: self._read_genome(filename, read_keys))
+                span.add_rows(len(merged_dna))
+
+            with self._instrumentation.span('studied') as span:
+                studied_key = self._stage_cache.key('studied', genome_key, self._citations_dataframe_generator.get_snapshot_version())
+                merged_dna_data_with_studied_rsids = self._stage_cache.get_or_compute('studied', studied_key, 
+                    lambda: merged_dna[isin_sorted(merged_dna['rsid_key'], studied_rsid_keys)].reset_index(drop=True))
+                span.add_rows(len(merged_dna_data_with_studied_rsids))
+
+            with self._instrumentation.span('ncbi') as span:
+                ncbi_key, ncbi_data = self._get_ncbi_data(studied_key, merged_dna_data_with_studied_rsids)
+                span.add_rows(len(ncbi_data))
+            if self._refsnp_store.alias_version() != alias_version:
+                # parsing found retired rsids the genome was read with, their NCBI rows are under the new ones, and
+                # the genome is read again so rows under a retired rsid it wasn't read with join too
+                read_keys = self._read_keys(self._studied_rsid_keys())
+                genome_key = self._get_genome_key(filename, read_keys)
+                merged_dna = self._stage_cache.get_or_compute('genome', genome_key, lambda: self._read_genome(filename, read_keys))
+
+            with self._instrumentation.span('detected') as span:
+                detected_key = self._stage_cache.key('detected', genome_key, ncbi_key)
+                detected = self._stage_cache.get_or_compute('detected', detected_key, lambda: self._classify(merged_dna, ncbi_data))
+                span.add_rows(len(detected))
+
+            with self._instrumentation.span('write_outputs'):
+                self._report_writer.write(filename, detected_key, detected)
@@ -0,0 +1,231 @@
+from ..common import Options, Instrumentation, with_rsid_key
+from ..file_readers import GeneticDataToDataFrameConverter, RawDataFile
+from ..ncbi import RefSnpStore
+from .genotype_matrix import GenotypeMatrix
+import os
+import numpy as np
+import pandas as pd
+from dependency_injector.wiring import Provide
+
+class GenomeComparer:
+    # Pairwise identity by state between genomes on one shared variant index. Every biallelic variant
+    # becomes a dosage (copies of the variant's first allele, -1 where a genome has no diploid call) and:
+    #   ibs0/ibs1/ibs2 count the variants two genomes both call where they share 0, 1 or 2 alleles,
+    #   shared segments are runs along a chromosome with no opposite homozygotes (no ibs0 site), the
+    #   half-identical stretches a parent, sibling or cousin shares.
+    alleles = 'ACGTDI'
+    no_allele = 0xFF
+    pair_columns = ['sample_a', 'sample_b', 'overlap', 'ibs0', 'ibs1', 'ibs2', 'ibs_similarity', 'segments', 'shared_bp']
+    segment_columns = ['sample_a', 'sample_b', 'chromosome', 'start', 'end', 'snps', 'ibs2_snps']
+
+    def __init__(self,
+                 options:Options = Provide['Options'],
+                 instrumentation:Instrumentation = Provide['Instrumentation'],
+                 genetic_data_reader:GeneticDataToDataFrameConverter = Provide['GeneticDataToDataFrameConverter'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore']):
+        self._options = options
+        self._instrumentation = instrumentation
+        self._genetic_data_reader = genetic_data_reader
+        self._refsnp_store = refsnp_store
+
+    def sample_name(self, filename):
+        return os.path.basename(RawDataFile.strip_compression_suffix(filename)).split('.')[0]
+
+    def sample_names(self, filenames):
+        # files from different folders sharing a name are told apart by their folder, rather than one replacing the other
+        names = [self.sample_name(x) for x in filenames]
+        clashing = {x for x in names if names.count(x) > 1}
+        names = [os.path.join(os.path.basename(os.path.dirname(os.path.abspath(x))), name) if name in clashing else name
+                 for x, name in zip(filenames, names)]
+        duplicated = sorted({x for x in names if names.count(x) > 1})
+        if len(duplicated) > 0:
+            raise Exception(f'More than one file would be compared as {", ".join(duplicated)}, rename them or pass each once.')
+        return names
+
+    def read_matrix(self, filenames):
+        # genomes are read with retired rsids swapped for current ones, so two files name a variant the same way, and
+        # packed a block at a time so only one block of genome frames is ever held in memory
+        batches = []
+        names = dict(zip(filenames, self.sample_names(filenames)))
+        with self._instrumentation.span('comparison.read', rows=len(filenames)):
+            for block in range(0, len(filenames), self._options.comparison_block_samples):
+                genomes = {}
+                for filename in filenames[block:block + self._options.comparison_block_samples]:
+                    genome = self._genetic_data_reader.read_data(filename, throw_on_error=True)
+                    genomes[names[filename]] = self._refsnp_store.canonicalize(with_rsid_key(genome, sort=False))
+                batches.append(GenotypeMatrix.from_dataframes(genomes))
+        return batches[0] if len(batches) == 1 else GenotypeMatrix.concat(batches)
+
+    def _genotype_tables(self, genotypes):
+        # per genotype string: the bit of each allele in it, and the two allele indexes packed low and high
+        bits = np.zeros(len(genotypes), dtype=np.uint8)
+        pairs = np.full(len(genotypes), self.no_allele, dtype=np.uint8)
+        for i, genotype in enumerate(genotypes):
+            if isinstance(genotype, str) and (len(genotype) == 2) and all(x in self.alleles for x in genotype):
+                first, second = self.alleles.index(genotype[0]), self.alleles.index(genotype[1])
+                bits[i] = (1 << first) | (1 << second)
+                pairs[i] = first | (second << 4)
+        return bits, pairs
+
+    def _tables(self, matrix:GenotypeMatrix):
+        codebook = matrix.codebook + [None] * (matrix.exception_code + 1 - len(matrix.codebook))
+        return self._genotype_tables(codebook), self._genotype_tables(matrix.exception_codebook + [None])
+
+    def _variant_chunks(self, count):
+        step = self._options.comparison_chunk_variants
+        return [slice(x, min(x + step, count)) for x in range(0, count, step)]
+
+    def reference_alleles(self, matrix:GenotypeMatrix):
+        # the first allele seen at each variant, or no_allele where the genomes between them show more than two
+        # (or none), since a dosage can't say which of three alleles two genomes share
+        (bits, _), (exception_bits, _) = self._tables(matrix)
+        seen = np.zeros(matrix.shape[1], dtype=np.uint8)
+        with self._instrumentation.span('comparison.references', rows=matrix.shape[1]):
+            for chunk in self._variant_chunks(matrix.shape[1]):
+                seen[chunk] = np.bitwise_or.reduce(matrix.map_codes(bits, exception_bits, variants=chunk), axis=0)
+        allele_counts = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint8)[seen]
+        lowest_bit = np.array([(x & -x).bit_length() - 1 if x > 0 else self.no_allele for x in range(256)], dtype=np.uint8)
+        return np.where((allele_counts >= 1) & (allele_counts <= 2), lowest_bit[seen], self.no_allele).astype(np.uint8)
+
+    def dosages(self, matrix:GenotypeMatrix, references:np.ndarray, samples, variants):
+        # int8 copies of the reference allele per sample and variant, -1 where there's no call to compare
+        (_, pairs), (_, exception_pairs) = self._tables(matrix)
+        codes = matrix.map_codes(pairs, exception_pairs, samples, variants)
+        reference = references[variants]
+        dosage = ((codes & 0x0F) == reference).astype(np.int8) + ((codes >> 4) == reference).astype(np.int8)
+        dosage[(codes == self.no_allele) | (reference == self.no_allele)] = -1
+        return dosage
+
+    def ibs_counts(self, matrix:GenotypeMatrix, references:np.ndarray):
+        # Each chunk of variants becomes three 0/1 matrices, one per dosage, and every pair's counts come out of
+        # matrix products: ibs2 = same dosage, ibs0 = opposite homozygotes, overlap = both called. float32 keeps
+        # the products on BLAS and stays exact while a chunk has fewer than 2**24 variants.
+        n = matrix.shape[0]
+        overlap, ibs0, ibs2 = (np.zeros((n, n), dtype=np.int64) for _ in range(3))
+        kept = np.flatnonzero(references != self.no_allele)
+        with self._instrumentation.span('comparison.ibs', rows=len(kept)):
+            for chunk in self._variant_chunks(len(kept)):
+                dosage = self.dosages(matrix, references, None, kept[chunk])
+                by_dosage = [(dosage == x).astype(np.float32) for x in range(3)]
+                called = (dosage >= 0).astype(np.float32)
+                stacked = np.concatenate(by_dosage, axis=1)
+                overlap += np.rint(called @ called.T).astype(np.int64)
+                ibs2 += np.rint(stacked @ stacked.T).astype(np.int64)
+                ibs0 += np.rint(np.concatenate([by_dosage[0], by_dosage[2]], axis=1) @ np.concatenate([by_dosage[2], by_dosage[0]], axis=1).T).astype(np.int64)
+        return overlap, ibs0, overlap - ibs0 - ibs2, ibs2
+
+    def _chromosome_bounds(self, chromosome_codes:np.ndarray):
+        # first and one past the last column of every chromosome, with columns in chromosome order
+        starts = np.flatnonzero(np.r_[True, chromosome_codes[1:] != chromosome_codes[:-1]]) if len(chromosome_codes) > 0 else np.zeros(0, dtype=np.int64)
+        return starts, np.r_[starts[1:], len(chromosome_codes)]
+
+    def _candidate_runs(self, opposite:np.ndarray, min_snps):
+        # Gaps between ibs0 sites at least min_snps columns long, as (row, start, end) over a block of pairs. Each
+        # row is laid out one column wider with a break in the extra column, so no gap runs from one row into the next.
+        rows, width = opposite.shape
+        breaks = np.flatnonzero(opposite.ravel())
+        breaks = np.concatenate([[-1], breaks + breaks // width, np.arange(rows) * (width + 1) + width])
+        breaks.sort(kind='stable')
+        starts, ends = breaks[:-1] + 1, breaks[1:]
+        long = ends - starts >= min_snps
+        starts, ends = starts[long], ends[long]
+        row = starts // (width + 1)
+        return row, starts - row * (width + 1), ends - row * (width + 1)
+
+    def _split_on_chromosomes(self, row, start, end, chromosome_of, bounds_start, bounds_end):
+        first, last = chromosome_of[start], chromosome_of[end - 1]
+        pieces = last - first + 1
+        offsets = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        chromosome = np.repeat(first, pieces) + offsets
+        piece_start = np.maximum(np.repeat(start, pieces), bounds_start[chromosome])
+        piece_end = np.minimum(np.repeat(end, pieces), bounds_end[chromosome])
+        return np.repeat(row, pieces), piece_start, piece_end, chromosome
+
+    def _segments_for_sample(self, index, own, partners, partner_indexes, context):
+        # the runs one genome shares with a block of later ones, everything as (pairs x columns) arrays
+        positions, chromosome_names, chromosome_of, bounds_start, bounds_end = context
+        min_snps, min_bp = self._options.comparison_min_segment_snps, self._options.comparison_min_segment_bp
+        opposite = ((own == 0) & (partners == 2)) | ((own == 2) & (partners == 0))
+        row, start, end = self._candidate_runs(opposite, min_snps)
+        if len(row) == 0:
+            return []
+        row, start, end, chromosome = self._split_on_chromosomes(row, start, end, chromosome_of, bounds_start, bounds_end)
+
+        segments = []
+        for partner_row in np.unique(row):
+            mine = row == partner_row
+            both = (own >= 0) & (partners[partner_row] >= 0)
+            # prefix counts of the sites both genomes call, and of those they call the same
+            called = np.r_[0, np.cumsum(both)]
+            same = np.r_[0, np.cumsum(both & (own == partners[partner_row]))]
+            piece_start, piece_end = start[mine], end[mine]
+            snps = called[piece_end] - called[piece_start]
+            has_sites = snps > 0
+            first_site = np.searchsorted(called, called[piece_start] + 1) - 1
+            last_site = np.searchsorted(called, called[piece_end]) - 1
+            first_bp = positions[np.minimum(first_site, len(positions) - 1)]
+            last_bp = positions[np.minimum(last_site, len(positions) - 1)]
+            keep = has_sites & (snps >= min_snps) & (last_bp.astype(np.int64) - first_bp >= min_bp)
+            if keep.any():
+                segments.append(pd.DataFrame({
+                    'sample_a': index, 'sample_b': partner_indexes[partner_row],
+                    'chromosome': chromosome_names[chromosome[mine][keep]],
+                    'start': first_bp[keep].astype(np.int64), 'end': last_bp[keep].astype(np.int64), 'snps': snps[keep],
+                    'ibs2_snps': (same[piece_end] - same[piece_start])[keep],
+                }))
+        return segments
+
+    def shared_segments(self, matrix:GenotypeMatrix, references:np.ndarray):
+        # Genomes go through in blocks of comparison_block_samples, so at most two blocks of dosages (in chromosome
+        # and position order) and one block of pair arrays are held at once, however many genomes there are.
+        kept = np.flatnonzero(references != self.no_allele)
+        ordered = matrix.human_order(kept)
+        chromosome_codes, positions = matrix.locations(None, ordered)
+        # dosages come out in key order, which keeps the lookups on the fast path, and are put in human order after
+        in_human_order = np.searchsorted(kept, ordered)
+        bounds_start, bounds_end = self._chromosome_bounds(chromosome_codes)
+        chromosome_of = np.repeat(np.arange(len(bounds_start)), bounds_end - bounds_start)
+        chromosome_names = np.array(matrix.chromosomes, dtype=object)[chromosome_codes[bounds_start]] if len(bounds_start) > 0 else np.zeros(0, dtype=object)
+        context = (positions, chromosome_names, chromosome_of, bounds_start, bounds_end)
+
+        n = matrix.shape[0]
+        block = self._options.comparison_block_samples
+        segments = []
+        with self._instrumentation.span('comparison.segments', rows=n * (n - 1) // 2):
+            for block_start in range(0, n, block):
+                block_indexes = np.arange(block_start, min(block_start + block, n))
+                own_block = self.dosages(matrix, references, block_indexes, kept)[:, in_human_order]
+                for partner_start in range(block_start, n, block):
+                    partner_indexes = np.arange(partner_start, min(partner_start + block, n))
+                    partner_block = own_block if partner_start == block_start else self.dosages(matrix, references, partner_indexes, kept)[:, in_human_order]
+                    for row, index in enumerate(block_indexes):
+                        later = partner_indexes > index
+                        if later.any():
+                            segments.extend(self._segments_for_sample(index, own_block[row], partner_block[later], partner_indexes[later], context))
+
+        if len(segments) == 0:
+            return pd.DataFrame({x: pd.Series(dtype=object if x in ['sample_a', 'sample_b', 'chromosome'] else np.int64) for x in self.segment_columns})
+        segments = pd.concat(segments, ignore_index=True)
+        samples = np.array(matrix.samples, dtype=object)
+        return segments.assign(sample_a=samples[segments['sample_a']], sample_b=samples[segments['sample_b']])
+
+    def compare(self, matrix:GenotypeMatrix):
+        references = self.reference_alleles(matrix)
+        overlap, ibs0, ibs1, ibs2 = self.ibs_counts(matrix, references)
+        segments = self.shared_segments(matrix, references)
+
+        first, second = np.triu_indices(matrix.shape[0], k=1)
+        samples = np.array(matrix.samples, dtype=object)
+        pairs = pd.DataFrame({
+            'sample_a': samples[first], 'sample_b': samples[second],
+            'overlap': overlap[first, second], 'ibs0': ibs0[first, second], 'ibs1': ibs1[first, second], 'ibs2': ibs2[first, second],
+        })
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pairs['ibs_similarity'] = np.nan_to_num((pairs['ibs1'] + 2 * pairs['ibs2']) / (2 * pairs['overlap']))
+        totals = segments.assign(length=segments['end'] - segments['start']).groupby(['sample_a', 'sample_b'], sort=False) \
+            .agg(segments=('length', 'size'), shared_bp=('length', 'sum')).reset_index()
+        pairs = pairs.merge(totals, on=['sample_a', 'sample_b'], how='left').fillna({'segments': 0, 'shared_bp': 0})
+        pairs = pairs.astype({'segments': np.int64, 'shared_bp': np.int64})[self.pair_columns]
+        self._instrumentation.count('comparison.pairs', len(pairs))
+        self._instrumentation.count('comparison.segments', len(segments))
+        return pairs, segments
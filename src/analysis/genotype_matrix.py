@@ -0,0 +1,454 @@
+from ..common import rsid_to_key, key_to_rsid, atomic_write
+import os, json
+import numpy as np
+import pandas as pd
+import natsort
+
+class GenotypeMatrix:
+    # Genotypes of several samples against one shared variant index sorted by rsid key. Each call is a
+    # 4 bit code, two to a byte: 0 is no call in that sample's file, 1-14 are the most common genotypes
+    # of the matrix and 15 sends the lookup to a small side table holding everything rarer (indels,
+    # haploid calls, odd orderings), so any genotype string round trips exactly.
+    missing_code = 0
+    exception_code = 15
+    magic = b'DNAGTM01'
+    alignment = 64
+    # Ancestry numbers the sex chromosomes and mitochondria where 23andMe names them
+    chromosome_aliases = {'23': 'X', '24': 'Y', '25': 'XY', '26': 'MT'}
+    exception_columns = {'sample': np.int32, 'variant': np.int64, 'code': np.uint32}
+    relocation_columns = {'sample': np.int32, 'variant': np.int64, 'chromosome_code': np.uint8, 'position': np.uint32}
+
+    def __init__(self, samples, variant_keys, chromosome_codes, positions, chromosomes, codebook, packed,
+                 exceptions=None, exception_codebook=None, relocations=None, sample_attrs=None, sample_chromosomes=None):
+        self.samples = list(samples)
+        self.variant_keys = variant_keys
+        self.chromosome_codes = chromosome_codes
+        self.positions = positions
+        self.chromosomes = list(chromosomes)
+        self.codebook = list(codebook)
+        self.packed = packed
+        self.exceptions = exceptions if exceptions is not None else self._empty_table(self.exception_columns)
+        self.exception_codebook = list(exception_codebook or [])
+        # a sample whose file puts a variant somewhere other than the shared index does gets a relocation row
+        self.relocations = relocations if relocations is not None else self._empty_table(self.relocation_columns)
+        self.sample_attrs = sample_attrs if sample_attrs is not None else [{} for _ in self.samples]
+        # each sample keeps the chromosome names its own file used
+        self.sample_chromosomes = sample_chromosomes if sample_chromosomes is not None else [list(self.chromosomes) for _ in self.samples]
+
+    @staticmethod
+    def _empty_table(columns):
+        return {k: np.zeros(0, dtype=v) for k, v in columns.items()}
+
+    @staticmethod
+    def _concat_table(parts, columns):
+        return {k: np.concatenate([x[k] for x in parts] + [np.zeros(0, dtype=v)]).astype(v) for k, v in columns.items()}
+
+    @property
+    def shape(self):
+        return len(self.samples), len(self.variant_keys)
+
+    @property
+    def nbytes(self):
+        return sum(x.nbytes for x in self._arrays().values())
+
+    @staticmethod
+    def _pack(codes:np.ndarray):
+        if codes.shape[-1] % 2 == 1:
+            codes = np.concatenate([codes, np.zeros(codes.shape[:-1] + (1,), dtype=np.uint8)], axis=-1)
+        return codes[..., 0::2] | (codes[..., 1::2] << 4)
+
+    @staticmethod
+    def _unpack(packed:np.ndarray, count):
+        codes = np.empty(packed.shape[:-1] + (packed.shape[-1] * 2,), dtype=np.uint8)
+        codes[..., 0::2] = packed & 0x0F
+        codes[..., 1::2] = packed >> 4
+        return codes[..., :count]
+
+    @staticmethod
+    def _categorical(values:pd.Series):
+        # the streaming readers already hand back categoricals, only their categories need to be strings
+        values = values.astype('category')
+        values = values.cat.rename_categories([str(x) for x in values.cat.categories])
+        if values.isna().any():
+            if '' not in values.cat.categories:
+                values = values.cat.add_categories('')
+            values = values.fillna('')
+        return values
+
+    @classmethod
+    def _canonical_chromosome(cls, label):
+        return cls.chromosome_aliases.get(label, label)
+
+    @classmethod
+    def from_dataframes(cls, genomes:dict):
+        # genomes maps a sample name to a genome frame (rsid, chromosome, position, alleles), as the readers return
+        # it. Rows whose rsid doesn't key (neither rsN nor iN) have no place in the index and are left out.
+        frames = {}
+        for name, dataframe in genomes.items():
+            keys = dataframe['rsid_key'].to_numpy() if 'rsid_key' in dataframe.columns else rsid_to_key(dataframe['rsid'])
+            frame = pd.DataFrame({
+                'rsid_key': keys,
+                'chromosome': cls._categorical(dataframe['chromosome']),
+                'position': dataframe['position'].to_numpy(),
+                'alleles': cls._categorical(dataframe['alleles']),
+            })
+            frames[name] = frame[keys != 0].drop_duplicates(subset='rsid_key', keep='last')
+
+        variant_keys, inverse = np.unique(np.concatenate([x['rsid_key'].to_numpy() for x in frames.values()] + [np.zeros(0, dtype=np.int64)]), return_inverse=True)
+        sample_columns = np.split(inverse, np.cumsum([len(x) for x in frames.values()])[:-1]) if len(frames) > 0 else []
+        # ordinals follow natural sort order of the canonical names, so sorting on (ordinal, position) gives the
+        # order natsort.index_humansorted gave on the strings, whichever naming a file uses
+        chromosomes = natsort.natsorted({cls._canonical_chromosome(x) for frame in frames.values() for x in frame['chromosome'].cat.categories})
+        chromosome_lookup = {x: i for i, x in enumerate(chromosomes)}
+
+        genotype_counts = pd.Series(dtype=np.int64)
+        for frame in frames.values():
+            genotype_counts = genotype_counts.add(frame['alleles'].value_counts(), fill_value=0)
+        genotype_counts = genotype_counts.sort_values(ascending=False, kind='stable')
+        codebook = [None] + genotype_counts.index[:cls.exception_code - 1].tolist()
+        code_lookup = {x: i for i, x in enumerate(codebook) if i > 0}
+
+        chromosome_codes = np.zeros(len(variant_keys), dtype=np.uint8)
+        positions = np.zeros(len(variant_keys), dtype=np.uint32)
+        located = np.zeros(len(variant_keys), dtype=bool)
+        packed = np.zeros((len(frames), (len(variant_keys) + 1) // 2), dtype=np.uint8)
+        sample_chromosomes = []
+        exception_codebook, exception_lookup = [], {}
+        exceptions, relocations = [], []
+
+        for sample, (frame, columns) in enumerate(zip(frames.values(), sample_columns)):
+            labels = frame['chromosome'].cat.categories
+            ordinals = np.array([chromosome_lookup[cls._canonical_chromosome(x)] for x in labels], dtype=np.uint8)
+            own_labels = list(chromosomes)
+            for label, ordinal in zip(labels, ordinals):
+                own_labels[ordinal] = label
+            sample_chromosomes.append(own_labels)
+
+            # the first sample carrying a variant places it in the index, any later one that disagrees is relocated
+            sample_chromosome_codes = ordinals[frame['chromosome'].cat.codes.to_numpy()]
+            sample_positions = frame['position'].to_numpy()
+            new = ~located[columns]
+            chromosome_codes[columns[new]] = sample_chromosome_codes[new]
+            positions[columns[new]] = sample_positions[new]
+            located[columns[new]] = True
+            moved = (chromosome_codes[columns] != sample_chromosome_codes) | (positions[columns] != sample_positions)
+            if moved.any():
+                relocations.append({'sample': np.full(moved.sum(), sample), 'variant': columns[moved],
+                                    'chromosome_code': sample_chromosome_codes[moved], 'position': sample_positions[moved]})
+
+            genotypes = frame['alleles'].cat.categories
+            genotype_codes = np.array([code_lookup.get(x, cls.exception_code) for x in genotypes] + [0], dtype=np.uint8)
+            sample_codes = genotype_codes[frame['alleles'].cat.codes.to_numpy()]
+            codes = np.zeros(len(variant_keys), dtype=np.uint8)
+            codes[columns] = sample_codes
+            packed[sample] = cls._pack(codes)
+
+            rare = sample_codes == cls.exception_code
+            if rare.any():
+                for genotype in genotypes[genotype_codes[:-1] == cls.exception_code]:
+                    if genotype not in exception_lookup:
+                        exception_lookup[genotype] = len(exception_codebook)
+                        exception_codebook.append(genotype)
+                rare_codes = np.array([exception_lookup.get(x, 0) for x in genotypes], dtype=np.uint32)
+                exceptions.append({'sample': np.full(rare.sum(), sample), 'variant': columns[rare],
+                                   'code': rare_codes[frame['alleles'].cat.codes.to_numpy()[rare]]})
+
+        sample_attrs = [{k: v for k, v in genomes[x].attrs.items() if isinstance(v, (str, int, float, type(None)))} for x in frames]
+        return cls(frames.keys(), variant_keys, chromosome_codes, positions, chromosomes, codebook, packed,
+                   cls._concat_table(exceptions, cls.exception_columns), exception_codebook,
+                   cls._concat_table(relocations, cls.relocation_columns), sample_attrs, sample_chromosomes)
+
+    @classmethod
+    def concat(cls, matrices):
+        # Every sample of the given matrices on the union of their variant indexes, so a large set of genomes can be
+        # built a batch at a time. The codebook is chosen from the combined genotype counts as from_dataframes
+        # would, and a variant keeps the location of the first matrix that has it.
+        matrices = list(matrices)
+        variant_keys = np.unique(np.concatenate([np.asarray(x.variant_keys) for x in matrices] + [np.zeros(0, dtype=np.int64)]))
+        chromosomes = natsort.natsorted({x for matrix in matrices for x in matrix.chromosomes})
+        chromosome_lookup = {x: i for i, x in enumerate(chromosomes)}
+
+        genotype_counts = pd.Series(dtype=np.int64)
+        for matrix in matrices:
+            code_counts = np.bincount(matrix.codes().ravel(), minlength=cls.exception_code + 1)
+            counts = pd.Series(code_counts[1:len(matrix.codebook)], index=matrix.codebook[1:], dtype=np.int64)
+            exception_counts = np.bincount(matrix.exceptions['code'], minlength=len(matrix.exception_codebook))
+            counts = counts.add(pd.Series(exception_counts, index=matrix.exception_codebook, dtype=np.int64), fill_value=0)
+            genotype_counts = genotype_counts.add(counts.groupby(level=0).sum(), fill_value=0)
+        genotype_counts = genotype_counts[genotype_counts > 0].sort_values(ascending=False, kind='stable')
+        codebook = [None] + genotype_counts.index[:cls.exception_code - 1].tolist()
+        code_lookup = {x: i for i, x in enumerate(codebook) if i > 0}
+        exception_codebook = genotype_counts.index[cls.exception_code - 1:].tolist()
+        exception_lookup = {x: i for i, x in enumerate(exception_codebook)}
+
+        chromosome_codes = np.zeros(len(variant_keys), dtype=np.uint8)
+        positions = np.zeros(len(variant_keys), dtype=np.uint32)
+        located = np.zeros(len(variant_keys), dtype=bool)
+        packed = np.zeros((sum(x.shape[0] for x in matrices), (len(variant_keys) + 1) // 2), dtype=np.uint8)
+        samples, sample_attrs, sample_chromosomes = [], [], []
+        exceptions, relocations = [], []
+
+        for matrix in matrices:
+            columns = np.searchsorted(variant_keys, np.asarray(matrix.variant_keys))
+            ordinals = np.array([chromosome_lookup[x] for x in matrix.chromosomes], dtype=np.uint8)
+            matrix_chromosome_codes = ordinals[np.asarray(matrix.chromosome_codes)] if len(ordinals) > 0 else np.zeros(len(columns), dtype=np.uint8)
+            matrix_positions = np.asarray(matrix.positions)
+            new = ~located[columns]
+            chromosome_codes[columns[new]] = matrix_chromosome_codes[new]
+            positions[columns[new]] = matrix_positions[new]
+            located[columns[new]] = True
+
+            code_map = np.array([0] + [code_lookup.get(x, cls.exception_code) for x in matrix.codebook[1:]], dtype=np.uint8)
+            code_map = np.concatenate([code_map, np.full(cls.exception_code + 1 - len(code_map), cls.exception_code, dtype=np.uint8)])
+            exception_map = np.array([code_lookup.get(x, cls.exception_code) for x in matrix.exception_codebook] + [0], dtype=np.uint8)
+            rare_codes = np.array([exception_lookup.get(x, 0) for x in matrix.codebook[1:]], dtype=np.uint32)
+            rare_exception_codes = np.array([exception_lookup.get(x, 0) for x in matrix.exception_codebook] + [0], dtype=np.uint32)
+
+            for sample_index, name in enumerate(matrix.samples):
+                sample = len(samples)
+                old_codes = matrix.codes(sample_index)[0]
+                sample_codes = code_map[old_codes]
+                mine = np.flatnonzero(matrix.exceptions['sample'] == sample_index)
+                exception_variants = np.asarray(matrix.exceptions['variant'][mine])
+                exception_codes = np.asarray(matrix.exceptions['code'][mine])
+                sample_codes[exception_variants] = exception_map[exception_codes]
+                codes = np.zeros(len(variant_keys), dtype=np.uint8)
+                codes[columns] = sample_codes
+                packed[sample] = cls._pack(codes)
+
+                # whatever is rare in the combined codebook, whether it was a common code or an exception before
+                rare = np.flatnonzero((sample_codes == cls.exception_code) & (old_codes != cls.exception_code))
+                rare_from_exceptions = exception_map[exception_codes] == cls.exception_code
+                exceptions.append({'sample': np.full(len(rare) + rare_from_exceptions.sum(), sample),
+                                   'variant': np.concatenate([columns[rare], columns[exception_variants[rare_from_exceptions]]]),
+                                   'code': np.concatenate([rare_codes[old_codes[rare] - 1], rare_exception_codes[exception_codes[rare_from_exceptions]]])})
+
+                # a sample is relocated where its own location (shared, or from its relocations) isn't the new shared one
+                own_chromosome_codes, own_positions = matrix_chromosome_codes.copy(), matrix_positions.copy()
+                moved_rows = np.flatnonzero(matrix.relocations['sample'] == sample_index)
+                relocated_variants = np.asarray(matrix.relocations['variant'][moved_rows])
+                own_chromosome_codes[relocated_variants] = ordinals[np.asarray(matrix.relocations['chromosome_code'][moved_rows])]
+                own_positions[relocated_variants] = np.asarray(matrix.relocations['position'][moved_rows])
+                differs = (chromosome_codes[columns] != own_chromosome_codes) | (positions[columns] != own_positions)
+                differs &= (old_codes != cls.missing_code)
+                relocations.append({'sample': np.full(differs.sum(), sample), 'variant': columns[differs],
+                                    'chromosome_code': own_chromosome_codes[differs], 'position': own_positions[differs]})
+
+                own_labels = list(chromosomes)
+                for ordinal, label in zip(ordinals, matrix.sample_chromosomes[sample_index]):
+                    own_labels[ordinal] = label
+                samples.append(name)
+                sample_attrs.append(matrix.sample_attrs[sample_index])
+                sample_chromosomes.append(own_labels)
+
+        exceptions = cls._concat_table(exceptions, cls.exception_columns)
+        order = np.lexsort((exceptions['variant'], exceptions['sample']))
+        return cls(samples, variant_keys, chromosome_codes, positions, chromosomes, codebook, packed,
+                   {k: v[order] for k, v in exceptions.items()}, exception_codebook,
+                   cls._concat_table(relocations, cls.relocation_columns), sample_attrs, sample_chromosomes)
+
+    def _sample_indexes(self, samples):
+        if samples is None:
+            return np.arange(len(self.samples))
+        if isinstance(samples, (str, int, np.integer)):
+            samples = [samples]
+        lookup = {x: i for i, x in enumerate(self.samples)}
+        return np.array([lookup[x] if x in lookup else int(x) for x in samples], dtype=np.int64)
+
+    def _variant_indexes(self, variants):
+        if variants is None:
+            return np.arange(len(self.variant_keys))
+        if isinstance(variants, slice):
+            return np.arange(len(self.variant_keys))[variants]
+        variants = np.asarray(variants)
+        if variants.dtype == bool:
+            return np.flatnonzero(variants)
+        return variants.astype(np.int64)
+
+    def _sample_rows(self, table, sample_index, variant_indexes):
+        # the side table rows of one sample, keyed by where their variant sits in variant_indexes
+        mine = np.flatnonzero(table['sample'] == sample_index)
+        order = np.arange(len(variant_indexes)) if np.all(np.diff(variant_indexes) > 0) else np.argsort(variant_indexes, kind='stable')
+        found = np.searchsorted(variant_indexes[order], table['variant'][mine])
+        found[found == len(order)] = 0
+        hit = (len(order) > 0) & (variant_indexes[order][found] == table['variant'][mine]) if len(order) > 0 else np.zeros(len(mine), dtype=bool)
+        return order[found[hit]], mine[hit]
+
+    def codes(self, samples=None, variants=None):
+        sample_indexes = self._sample_indexes(samples)
+        if variants is None:
+            return self._unpack(np.asarray(self.packed[sample_indexes]), len(self.variant_keys))
+        variant_indexes = self._variant_indexes(variants)
+        if len(variant_indexes) > 0 and np.all(np.diff(variant_indexes) == 1):
+            # a contiguous run only unpacks the bytes it covers, which keeps memory mapped slices cheap
+            start, stop = variant_indexes[0], variant_indexes[-1] + 1
+            codes = self._unpack(np.asarray(self.packed[sample_indexes, start // 2:(stop + 1) // 2]), stop - (start // 2) * 2)
+            return codes[:, start % 2:]
+        return self._unpack(np.asarray(self.packed[sample_indexes]), len(self.variant_keys))[:, variant_indexes]
+
+    def variant_indexes(self, rsids):
+        # positions of the given rsids in the variant index, -1 where the matrix doesn't have them
+        keys = rsids if isinstance(rsids, np.ndarray) and rsids.dtype.kind == 'i' else rsid_to_key(pd.Series(list(rsids), dtype=object))
+        if len(self.variant_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.searchsorted(self.variant_keys, keys)
+        positions[positions == len(self.variant_keys)] = 0
+        return np.where(self.variant_keys[positions] == keys, positions, -1)
+
+    def locations(self, sample=None, variants=None):
+        # chromosome ordinals and positions of the variants, as the given sample's file has them
+        variant_indexes = self._variant_indexes(variants)
+        chromosome_codes = np.array(self.chromosome_codes[variant_indexes])
+        positions = np.array(self.positions[variant_indexes])
+        if sample is not None:
+            at, rows = self._sample_rows(self.relocations, self._sample_indexes(sample)[0], variant_indexes)
+            chromosome_codes[at] = self.relocations['chromosome_code'][rows]
+            positions[at] = self.relocations['position'][rows]
+        return chromosome_codes, positions
+
+    def human_order(self, variants=None, sample=None):
+        variant_indexes = self._variant_indexes(variants)
+        chromosome_codes, positions = self.locations(sample, variant_indexes)
+        return variant_indexes[np.lexsort((positions, chromosome_codes))]
+
+    def _select_table(self, table, sample_remap, variant_remap):
+        keep = (sample_remap[table['sample']] >= 0) & (variant_remap[table['variant']] >= 0)
+        selected = {k: np.asarray(v[keep]) for k, v in table.items()}
+        selected['sample'] = sample_remap[selected['sample']].astype(table['sample'].dtype)
+        selected['variant'] = variant_remap[selected['variant']].astype(table['variant'].dtype)
+        return selected
+
+    def select(self, samples=None, variants=None):
+        sample_indexes = self._sample_indexes(samples)
+        # the index has to stay sorted by key for lookups to work
+        variant_indexes = np.unique(self._variant_indexes(variants))
+
+        packed = self._pack(self.codes(sample_indexes, variant_indexes))
+        sample_remap = np.full(len(self.samples), -1, dtype=np.int64)
+        sample_remap[sample_indexes] = np.arange(len(sample_indexes))
+        variant_remap = np.full(len(self.variant_keys), -1, dtype=np.int64)
+        variant_remap[variant_indexes] = np.arange(len(variant_indexes))
+
+        return GenotypeMatrix([self.samples[x] for x in sample_indexes], np.asarray(self.variant_keys[variant_indexes]),
+                              np.asarray(self.chromosome_codes[variant_indexes]), np.asarray(self.positions[variant_indexes]),
+                              self.chromosomes, self.codebook, packed,
+                              self._select_table(self.exceptions, sample_remap, variant_remap), self.exception_codebook,
+                              self._select_table(self.relocations, sample_remap, variant_remap),
+                              [self.sample_attrs[x] for x in sample_indexes], [self.sample_chromosomes[x] for x in sample_indexes])
+
+    def select_rsids(self, rsids, samples=None):
+        indexes = self.variant_indexes(rsids)
+        return self.select(samples, indexes[indexes >= 0])
+
+    def genotypes(self, sample, variants=None):
+        # genotype strings of one sample, None where the sample has no call
+        sample_index = self._sample_indexes(sample)[0]
+        variant_indexes = self._variant_indexes(variants)
+        codes = self.codes(sample_index, variant_indexes)[0]
+        result = np.array(self.codebook + [None] * (self.exception_code + 1 - len(self.codebook)), dtype=object)[codes]
+
+        if (codes == self.exception_code).any():
+            at, rows = self._sample_rows(self.exceptions, sample_index, variant_indexes)
+            result[at] = np.array(self.exception_codebook, dtype=object)[self.exceptions['code'][rows]]
+        return result
+
+    def map_codes(self, values:np.ndarray, exception_values:np.ndarray, samples=None, variants=None):
+        # values[code] for every call, rare genotypes taking exception_values[their exception code] instead, so a
+        # lookup per genotype (alleles, dosages) runs over the codes without going through strings
+        sample_indexes = self._sample_indexes(samples)
+        variant_indexes = self._variant_indexes(variants)
+        result = values[self.codes(sample_indexes, variant_indexes)]
+        with_exceptions = np.flatnonzero(np.isin(sample_indexes, self.exceptions['sample']))
+        for row in with_exceptions:
+            at, rows = self._sample_rows(self.exceptions, sample_indexes[row], variant_indexes)
+            result[row, at] = exception_values[self.exceptions['code'][rows]]
+        return result
+
+    def to_dataframe(self, sample):
+        # the shape the streaming readers produce: rsid, chromosome, position, alleles for the rows the sample has
+        sample_index = self._sample_indexes(sample)[0]
+        present = np.flatnonzero(self.codes(sample_index)[0] != self.missing_code)
+        chromosome_codes, positions = self.locations(sample_index, present)
+        order = np.lexsort((positions, chromosome_codes))
+        labels = self.sample_chromosomes[sample_index]
+        if len(set(labels)) < len(labels):
+            labels = self.chromosomes
+        dataframe = pd.DataFrame({
+            'rsid': key_to_rsid(self.variant_keys[present[order]]),
+            'chromosome': pd.Categorical.from_codes(chromosome_codes[order], labels).remove_unused_categories(),
+            'position': positions[order],
+            'alleles': pd.Categorical(self.genotypes(sample_index, present)[order]),
+        })
+        dataframe.attrs.update(self.sample_attrs[sample_index])
+        return dataframe
+
+    def variant_dataframe(self, variants=None):
+        variant_indexes = self._variant_indexes(variants)
+        return pd.DataFrame({
+            'rsid': key_to_rsid(self.variant_keys[variant_indexes]),
+            'chromosome': pd.Categorical.from_codes(np.asarray(self.chromosome_codes[variant_indexes]), self.chromosomes),
+            'position': np.asarray(self.positions[variant_indexes]),
+            'rsid_key': np.asarray(self.variant_keys[variant_indexes]),
+        })
+
+    def _arrays(self):
+        arrays = {
+            'variant_keys': self.variant_keys,
+            'chromosome_codes': self.chromosome_codes,
+            'positions': self.positions,
+            'packed': self.packed,
+        }
+        arrays.update({f'exceptions.{k}': v for k, v in self.exceptions.items()})
+        arrays.update({f'relocations.{k}': v for k, v in self.relocations.items()})
+        return arrays
+
+    @classmethod
+    def _data_start(cls, header_length):
+        return -(-(len(cls.magic) + 8 + header_length) // cls.alignment) * cls.alignment
+
+    def save(self, path):
+        # one file: magic, header length, a json header, then every array at an aligned offset so load can memory map them
+        arrays = {k: np.ascontiguousarray(v) for k, v in self._arrays().items()}
+        header = {'samples': self.samples, 'sample_attrs': self.sample_attrs, 'sample_chromosomes': self.sample_chromosomes,
+                  'chromosomes': self.chromosomes, 'codebook': self.codebook, 'exception_codebook': self.exception_codebook, 'arrays': {}}
+        offset = 0
+        for name, array in arrays.items():
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // self.alignment) * self.alignment
+        encoded_header = json.dumps(header).encode()
+        data_start = self._data_start(len(encoded_header))
+
+        with atomic_write(path, 'wb') as f:
+            f.write(self.magic)
+            f.write(len(encoded_header).to_bytes(8, 'little'))
+            f.write(encoded_header)
+            for name, array in arrays.items():
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path, 'rb') as f:
+            if f.read(len(cls.magic)) != cls.magic:
+                raise Exception(f'{path} is not a genotype matrix file.')
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length))
+        data_start = cls._data_start(header_length)
+
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            dtype = np.dtype(spec['dtype'])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + spec['offset'], shape=shape)
+            else:
+                arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=data_start + spec['offset']).reshape(shape)
+
+        exceptions = {k: arrays[f'exceptions.{k}'] for k in cls.exception_columns}
+        relocations = {k: arrays[f'relocations.{k}'] for k in cls.relocation_columns}
+        return cls(header['samples'], arrays['variant_keys'], arrays['chromosome_codes'], arrays['positions'], header['chromosomes'],
+                   header['codebook'], arrays['packed'], exceptions, header['exception_codebook'], relocations,
+                   header['sample_attrs'], header['sample_chromosomes'])
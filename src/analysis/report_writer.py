@@ -0,0 +1,121 @@
+from ..common import Options, Instrumentation, atomic_write, write_json, file_lock, is_intact
+from .xlsx_stream_writer import XlsxStreamWriter
+import os, json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from dependency_injector.wiring import Provide
+
+class ReportWriter:
+    formats = ['xlsx', 'parquet', 'csv', 'jsonl', 'significant']
+    # written straight from an arrow table, the others get it converted to pandas once
+    arrow_formats = ['parquet', 'csv']
+    # ClinVar significances that say nothing worth a look, every other one (and any term ClinVar adds) is significant
+    not_clinically_significant = ['benign', 'likely-benign', 'benign-likely-benign', 'uncertain-significance', 'not-provided', 'other']
+
+    def __init__(self,
+                 options:Options = Provide['Options'],
+                 instrumentation:Instrumentation = Provide['Instrumentation'],
+                 xlsx_writer:XlsxStreamWriter = Provide['XlsxStreamWriter']):
+        self._options = options
+        self._instrumentation = instrumentation
+        self._xlsx_writer = xlsx_writer
+
+    def _output_prefix(self, filename):
+        return os.path.join(self._options.output_cache_folder(filename), os.path.basename(filename).split('.')[0])
+
+    def output_path(self, filename, format):
+        prefix = self._output_prefix(filename)
+        if format == 'significant':
+            return f'{prefix}_significant.xlsx'
+        return f'{prefix}_variations.{format}'
+
+    def _keys_path(self, filename):
+        return f'{self._output_prefix(filename)}_reports.json'
+
+    def _load_keys(self, filename):
+        path = self._keys_path(filename)
+        # a damaged record only means every format is written again
+        if not is_intact(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_keys(self, filename, keys):
+        write_json(self._keys_path(filename), keys, indent=1)
+
+    def _is_significant(self, significance):
+        return (significance != '') and (significance not in self.not_clinically_significant)
+
+    def significant_rows(self, detected:pd.DataFrame):
+        if len(detected) == 0:
+            return detected
+        significances = detected['significances'].fillna('').str.split(', ')
+        keep = significances.map(lambda x: any(self._is_significant(s) for s in x)).to_numpy(dtype=bool)
+        return detected[keep].reset_index(drop=True)
+
+    def _write_xlsx(self, detected:pd.DataFrame, path):
+        self._xlsx_writer.write(path, {'Sheet1': detected})
+
+    def _write_significant(self, detected:pd.DataFrame, path):
+        significant = self.significant_rows(detected)
+        counts = significant['significances'].fillna('').str.split(', ').explode()
+        counts = counts[(counts != '') & ~counts.isin(self.not_clinically_significant)].value_counts()
+        by_significance = pd.DataFrame({'significance': counts.index.to_numpy(dtype=object), 'variants': counts.to_numpy()})
+        self._xlsx_writer.write(path, {'significant': significant, 'by_significance': by_significance})
+
+    def _write_parquet(self, detected, path):
+        if isinstance(detected, pa.Table):
+            pq.write_table(detected, path)
+        else:
+            detected.to_parquet(path)
+
+    def _write_csv(self, detected, path):
+        pacsv.write_csv(detected if isinstance(detected, pa.Table) else pa.Table.from_pandas(detected, preserve_index=False), path)
+
+    def _write_jsonl(self, detected:pd.DataFrame, path):
+        detected.to_json(path, orient='records', lines=True)
+
+    def _write_format(self, format, detected, path):
+        with self._instrumentation.span(f'report.{format}', rows=len(detected)):
+            with atomic_write(path) as temp_path:
+                getattr(self, f'_write_{format}')(detected, temp_path)
+
+    def write(self, filename, key, detected, formats=None):
+        # detected is a dataframe, or an arrow table from the arrow engine
+        formats = self._options.report_formats if formats is None else formats
+        unknown = [x for x in formats if x not in self.formats]
+        if len(unknown) > 0:
+            raise Exception(f'Unknown report formats {", ".join(unknown)}, expected some of {", ".join(self.formats)}.')
+
+        # two processes writing one genome's reports take turns, so the record of what each format was written
+        # from always matches the files
+        with file_lock(self._keys_path(filename)):
+            return self._write_pending(filename, key, detected, formats)
+
+    def _write_pending(self, filename, key, detected, formats):
+        # a format is only rewritten when its file is missing or was written from a different result
+        keys = self._load_keys(filename)
+        pending = [x for x in dict.fromkeys(formats) if (keys.get(x) != key) or not os.path.exists(self.output_path(filename, x))]
+        for format in formats:
+            if format not in pending:
+                self._instrumentation.count(f'report.{format}.unchanged')
+        if len(pending) == 0:
+            return []
+
+        inputs = {x: detected for x in pending}
+        if isinstance(detected, pa.Table) and any(x not in self.arrow_formats for x in pending):
+            dataframe = detected.to_pandas()
+            inputs.update({x: dataframe for x in pending if x not in self.arrow_formats})
+
+        # parquet, csv and the zip compression behind xlsx all run outside the GIL, so the formats overlap
+        write_format = self._instrumentation.carried(self._write_format)
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = {x: executor.submit(write_format, x, inputs[x], self.output_path(filename, x)) for x in pending}
+            for format, future in futures.items():
+                future.result()
+                keys[format] = key
+        self._save_keys(filename, keys)
+        return pending
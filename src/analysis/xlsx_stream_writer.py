@@ -0,0 +1,112 @@
+import zipfile
+import numpy as np
+import pandas as pd
+from xml.sax.saxutils import escape
+
+class XlsxStreamWriter:
+    # Writes the spreadsheetml parts straight into the zip a column at a time, with inline strings,
+    # so nothing holds a cell object per value the way openpyxl does. Only values, no formatting.
+    chunk_rows = 20000
+    compress_level = 1
+
+    content_types = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '{sheets}</Types>')
+    sheet_content_type = '<Override PartName="/xl/worksheets/sheet{index}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    root_relationships = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>')
+    workbook = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets>{sheets}</sheets></workbook>')
+    workbook_sheet = '<sheet name="{name}" sheetId="{index}" r:id="rId{index}"/>'
+    workbook_relationships = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{sheets}'
+        '<Relationship Id="rId{styles}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>')
+    workbook_sheet_relationship = '<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{index}.xml"/>'
+    styles = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>')
+    sheet_start = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    sheet_end = '</sheetData></worksheet>'
+
+    def _column_letter(self, index):
+        letters = ''
+        index += 1
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            letters = chr(65 + remainder) + letters
+        return letters
+
+    def _string_cells(self, values:pd.Series, references:pd.Series):
+        missing = values.isna().to_numpy()
+        text = values.astype(str)
+        # xml 1.0 has no way to carry most control characters, so they're dropped
+        text = text.str.replace(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', regex=True)
+        text = text.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False).str.replace('>', '&gt;', regex=False)
+        cells = '<c r="' + references + '" t="inlineStr"><is><t xml:space="preserve">' + text + '</t></is></c>'
+        return cells.where(~missing, '')
+
+    def _number_cells(self, values:pd.Series, references:pd.Series):
+        numbers = values.to_numpy()
+        if numbers.dtype.kind == 'f':
+            missing = ~np.isfinite(numbers)
+        else:
+            missing = np.zeros(len(numbers), dtype=bool)
+        text = pd.Series(numbers.astype(str), index=values.index, dtype=object)
+        cells = '<c r="' + references + '"><v>' + text + '</v></c>'
+        return cells.where(~missing, '')
+
+    def _bool_cells(self, values:pd.Series, references:pd.Series):
+        text = pd.Series(np.where(values.to_numpy(), '1', '0'), index=values.index, dtype=object)
+        return '<c r="' + references + '" t="b"><v>' + text + '</v></c>'
+
+    def _cells(self, values:pd.Series, references:pd.Series):
+        kind = values.dtype.kind if not isinstance(values.dtype, pd.CategoricalDtype) else 'O'
+        if kind == 'b':
+            return self._bool_cells(values, references)
+        if kind in 'iuf':
+            return self._number_cells(values, references)
+        return self._string_cells(values.astype(object), references)
+
+    def _rows(self, dataframe:pd.DataFrame, first_row):
+        row_numbers = pd.Series(np.arange(first_row, first_row + len(dataframe)).astype(str), index=dataframe.index, dtype=object)
+        rows = '<row r="' + row_numbers + '">'
+        for index, column in enumerate(dataframe.columns):
+            rows = rows + self._cells(dataframe[column], self._column_letter(index) + row_numbers)
+        return rows + '</row>'
+
+    def _write_sheet(self, file, dataframe:pd.DataFrame):
+        file.write(self.sheet_start.encode())
+        header = ''.join(f'<c r="{self._column_letter(i)}1" t="inlineStr"><is><t xml:space="preserve">{escape(str(x))}</t></is></c>' for i, x in enumerate(dataframe.columns))
+        file.write(f'<row r="1">{header}</row>'.encode())
+        for start in range(0, len(dataframe), self.chunk_rows):
+            chunk = dataframe.iloc[start:start + self.chunk_rows]
+            file.write(''.join(self._rows(chunk, start + 2)).encode())
+        file.write(self.sheet_end.encode())
+
+    def write(self, path, sheets:dict):
+        names = list(sheets)
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=self.compress_level) as archive:
+            archive.writestr('[Content_Types].xml', self.content_types.format(sheets=''.join(self.sheet_content_type.format(index=i + 1) for i in range(len(names)))))
+            archive.writestr('_rels/.rels', self.root_relationships)
+            archive.writestr('xl/workbook.xml', self.workbook.format(sheets=''.join(self.workbook_sheet.format(name=escape(x[:31]), index=i + 1) for i, x in enumerate(names))))
+            archive.writestr('xl/_rels/workbook.xml.rels', self.workbook_relationships.format(
+                sheets=''.join(self.workbook_sheet_relationship.format(index=i + 1) for i in range(len(names))), styles=len(names) + 1))
+            archive.writestr('xl/styles.xml', self.styles)
+            for i, name in enumerate(names):
+                with archive.open(f'xl/worksheets/sheet{i + 1}.xml', 'w', force_zip64=True) as file:
+                    self._write_sheet(file, sheets[name])
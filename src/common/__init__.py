@@ -1 +1,5 @@
-from .options import Options
\ No newline at end of file
+from .options import Options
+from .rsid_keys import *
+from .instrumentation import Instrumentation
+from .stage_cache import StageCache
+from .storage import *
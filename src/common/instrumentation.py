@@ -0,0 +1,164 @@
+from .options import Options
+import os, sys, json, time, threading
+from dependency_injector.wiring import Provide
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add_rows(self, rows):
+        pass
+
+_null_span = _NullSpan()
+
+class _Span:
+    def __init__(self, instrumentation, name, rows):
+        self._instrumentation = instrumentation
+        self.name = name
+        self.rows = rows
+
+    def add_rows(self, rows):
+        self.rows = (self.rows or 0) + rows
+
+    def __enter__(self):
+        self.path = self._instrumentation._push(self.name)
+        self._start_rss = _max_rss_mb()
+        self._start_cpu = time.process_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self._start
+        cpu = time.process_time() - self._start_cpu
+        peak_rss = _max_rss_mb()
+        self._instrumentation._pop()
+        self._instrumentation._record({
+            'type': 'span',
+            'name': self.path,
+            'start': time.time() - wall,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'peak_rss_mb': peak_rss,
+            'rss_growth_mb': None if peak_rss is None else peak_rss - self._start_rss,
+            'rows': self.rows,
+            'rows_per_second': None if (self.rows is None or wall == 0) else self.rows / wall,
+            'error': None if exc_type is None else exc_type.__name__,
+        })
+        return False
+
+class Instrumentation:
+    def __init__(self, options:Options = Provide['Options']):
+        self._options = options
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._spans = []
+        self._counters = {}
+
+    @property
+    def enabled(self):
+        return self._options.instrumentation is not None
+
+    def span(self, name, rows=None):
+        # disabled, every span is the same do-nothing object, so leaving the calls in costs next to nothing
+        if self._options.instrumentation is None:
+            return _null_span
+        return _Span(self, name, rows)
+
+    def count(self, name, value=1):
+        if self._options.instrumentation is None:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def _push(self, name):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+        return '/'.join(stack)
+
+    def _pop(self):
+        self._local.stack.pop()
+
+    def carried(self, function):
+        # function for another thread to run, with the spans it opens recorded under the ones open on this thread
+        # rather than as stages of their own
+        parents = list(getattr(self._local, 'stack', None) or [])
+        def run(*args, **kwargs):
+            previous = getattr(self._local, 'stack', None)
+            self._local.stack = list(parents)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.stack = previous
+        return run
+
+    def _record(self, record):
+        with self._lock:
+            self._spans.append(record)
+            if self._options.instrumentation == 'jsonl':
+                with open(self._options.instrumentation_file, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    @property
+    def spans(self):
+        return list(self._spans)
+
+    @property
+    def counters(self):
+        return dict(self._counters)
+
+    def summary(self):
+        by_name = {}
+        for span in self._spans:
+            total = by_name.setdefault(span['name'], {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_mb': None, 'rows': None})
+            total['calls'] += 1
+            total['wall_seconds'] += span['wall_seconds']
+            total['cpu_seconds'] += span['cpu_seconds']
+            if span['peak_rss_mb'] is not None:
+                total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0, span['peak_rss_mb'])
+            if span['rows'] is not None:
+                total['rows'] = (total['rows'] or 0) + span['rows']
+        return by_name
+
+    def summary_table(self):
+        lines = [f'{"span":<40} {"calls":>6} {"wall s":>9} {"cpu s":>9} {"peak MB":>9} {"rows":>10} {"rows/s":>11}']
+        for name, total in sorted(self.summary().items(), key=lambda x: min(s['start'] for s in self._spans if s['name'] == x[0])):
+            peak_rss = '-' if total['peak_rss_mb'] is None else f'{total["peak_rss_mb"]:.0f}'
+            rows = '-' if total['rows'] is None else total['rows']
+            rate = '-' if (total['rows'] is None or total['wall_seconds'] == 0) else f'{total["rows"] / total["wall_seconds"]:.0f}'
+            lines.append(f'{name:<40} {total["calls"]:>6} {total["wall_seconds"]:>9.3f} {total["cpu_seconds"]:>9.3f} {peak_rss:>9} {rows:>10} {rate:>11}')
+        if len(self._counters) > 0:
+            lines.append('')
+            lines.append(f'{"counter":<40} {"value":>10}')
+            for name, value in sorted(self._counters.items()):
+                lines.append(f'{name:<40} {value:>10}')
+        return '\n'.join(lines)
+
+    def report(self):
+        if self._options.instrumentation == 'summary':
+            print(self.summary_table())
+        elif self._options.instrumentation == 'jsonl':
+            # spans went out as they finished, the counters only make sense at the end
+            with open(self._options.instrumentation_file, 'a') as f:
+                f.write(json.dumps({'type': 'counters', 'time': time.time(), 'counters': self.counters}) + '\n')
+
+    def reset(self):
+        with self._lock:
+            self._spans = []
+            self._counters = {}
@@ -1,17 +1,70 @@
 import os
 
+# folders already created by this process, so a property read on every call (every rsid, every report) is a
+# path join rather than a makedirs system call. Writers create the parent of what they write as well, through
+# atomic_write, so a folder removed while the process runs is made again where it's needed.
+_created_folders = set()
+
+def _folder(path):
+    if path not in _created_folders:
+        os.makedirs(path, exist_ok=True)
+        _created_folders.add(path)
+    return path
+
 class Options:
+    ncbi_refsnp_url = 'https://api.ncbi.nlm.nih.gov/variation/v0/refsnp/'
+    # NCBI asks for no more than one request per second against the variation services
+    ncbi_requests_per_second = 1.0
+    ncbi_max_concurrent_requests = 4
+    ncbi_request_retries = 5
+    ncbi_request_timeout = 30
+    # where refsnp documents are parsed: 'serial', 'thread', 'process', the address of a running dask scheduler
+    # such as 'tcp://10.0.0.5:8786' (its workers need this repo importable), or 'auto' for processes on more than one core
+    ncbi_parse_backend = 'auto'
+    # None uses one worker per core
+    ncbi_parse_workers = None
+    # documents shipped to a worker at once
+    ncbi_parse_batch_size = 2000
+    stage_cache_max_bytes = 2 << 30
+    # what to do when the pre-processed public NCBI parquet exists: 'ask' prompts for it,
+    # 'public' always uses it and 'generate' always builds the data from the refsnp store
+    public_ncbi_data_policy = 'ask'
+    allow_download = True
+    force_regenerate_ncbi_data = False
+    # a refresh refetches refsnp documents fetched longer ago than this, and those whose ClinVar citations changed
+    ncbi_refresh_max_age_days = 30.0
+    # any of 'xlsx', 'parquet', 'csv', 'jsonl' and 'significant' (an xlsx of the clinically significant rows only)
+    report_formats = ['xlsx', 'parquet']
+    # 'arrow' keeps the genome, the citation filter, the NCBI join and the classification as arrow tables and only
+    # converts to pandas for the report formats that need it, 'pandas' runs them on dataframes
+    pipeline_engine = 'pandas'
+    # processes analyze_many classifies genomes in, None uses one per core
+    analyze_workers = None
+    # how often a running AnalysisService looks for a new NCBI dataset, citations snapshot or alias map, and where serve.py listens
+    service_reload_interval = 5.0
+    service_host = '127.0.0.1'
+    service_port = 8765
+    # None turns instrumentation off, 'summary' prints a table at the end and 'jsonl' appends to instrumentation_file
+    instrumentation = None
+    # openSNP files are read this many to a batch, which is also the most genomes held in memory at once
+    opensnp_batch_size = 20
+    # None lets the process pool use every core
+    opensnp_workers = None
+    opensnp_reduce_chunk = 1 << 18
+    # genomes whose shared segments are worked out against each other at once, and variants per step of the ibs counts
+    comparison_block_samples = 32
+    comparison_chunk_variants = 1 << 16
+    # a shared segment is a run without opposite homozygotes at least this many snps and base pairs long
+    comparison_min_segment_snps = 500
+    comparison_min_segment_bp = 5_000_000
+
     @property
     def data_folder(self):
-        data_folder = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', '.data'))
-        os.makedirs(data_folder, exist_ok=True)
-        return data_folder
+        return _folder(os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', '.data')))
     
     @property
     def public_data_folder(self):
-        data_folder = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
-        os.makedirs(data_folder, exist_ok=True)
-        return data_folder
+        return _folder(os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'data')))
     
     @property
     def opensnp_raw_data(self):
@@ -23,9 +76,7 @@ class Options:
     
     @property
     def combined_user_data_subset_directory(self):
-        result = os.path.join(self.data_folder, 'combined_subsets')
-        os.makedirs(result, exist_ok=True)
-        return result
+        return _folder(os.path.join(self.data_folder, 'combined_subsets'))
     
     @property
     def frequency_raw_combined_parquet(self):
@@ -39,8 +90,16 @@ class Options:
     
     @property
     def ncbi_data_cache(self):
-        result = os.path.join(self.data_folder, 'raw_ncbi_data')
-        os.makedirs(result, exist_ok=True)
+        return _folder(os.path.join(self.data_folder, 'raw_ncbi_data'))
+    
+    @property
+    def ncbi_data_store(self):
+        result = os.path.join(self.data_folder, 'raw_ncbi_data.sqlite')
+        return result
+    
+    @property
+    def ncbi_download_failures(self):
+        result = os.path.join(self.data_folder, 'ncbi_download_failures.json')
         return result
     
     @property
@@ -48,6 +107,14 @@ class Options:
         result = os.path.join(self.data_folder, 'ncbi_data.parquet')
         return result
     
+    @property
+    def ncbi_dataset_folder(self):
+        return _folder(os.path.join(self.data_folder, 'ncbi_dataset'))
+    
+    @property
+    def ncbi_index_folder(self):
+        return _folder(os.path.join(self.data_folder, 'ncbi_index'))
+    
     @property
     def public_ncbi_dataframe_parquet(self):
         result = os.path.join(self.public_data_folder, 'ncbi_data.parquet')
@@ -63,7 +130,31 @@ class Options:
         result = os.path.join(self.data_folder, 'var_citations.parquet')
         return result
     
+    @property
+    def citations_rsid_keys_file(self):
+        result = os.path.join(self.data_folder, 'var_citations_rsid_keys.npy')
+        return result
+    
+    def public_ncbi_rsid_keys_file(self, version):
+        return os.path.join(self.data_folder, f'ncbi_data_rsid_keys_{version}.npy')
+
+    @property
+    def citations_digests_file(self):
+        result = os.path.join(self.data_folder, 'var_citations_digests.parquet')
+        return result
+    
+    @property
+    def stage_cache_folder(self):
+        return _folder(os.path.join(self.data_folder, 'stage_cache'))
+    
+    @property
+    def instrumentation_file(self):
+        result = os.path.join(self.data_folder, 'instrumentation.jsonl')
+        return result
+    
+    @property
+    def comparison_output_folder(self):
+        return _folder(os.path.join(self.data_folder, 'output', 'comparison'))
+
     def output_cache_folder(self, filename):
-        result = os.path.join(self.data_folder,'output',os.path.basename(filename).split('.')[0])
-        os.makedirs(result, exist_ok=True)
-        return result
\ No newline at end of file
+        return _folder(os.path.join(self.data_folder,'output',os.path.basename(filename).split('.')[0]))
\ No newline at end of file
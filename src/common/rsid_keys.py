@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# rsids are keyed as int64: 'rs123' -> 123, and 23andMe's internal probes 'i123' -> -123 so
+# they can never collide with a real rsid. Anything else gets 0 and never joins.
+
+def rsid_to_key(rsids) -> np.ndarray:
+    if isinstance(rsids, (pd.Series, pd.Index)):
+        rsids = rsids.astype(object).to_numpy()
+    if isinstance(rsids, pa.ChunkedArray):
+        rsids = rsids.combine_chunks()
+    values = pc.cast(rsids, pa.string()) if isinstance(rsids, pa.Array) else pa.array(rsids, type=pa.string(), from_pandas=True)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    is_rs = pc.fill_null(pc.starts_with(values, 'rs'), False)
+    is_internal = pc.fill_null(pc.starts_with(values, 'i'), False)
+    digits = pc.if_else(is_rs, pc.utf8_slice_codeunits(values, 2), pc.utf8_slice_codeunits(values, 1))
+    valid = pc.and_(pc.or_(is_rs, is_internal), pc.fill_null(pc.utf8_is_digit(digits), False))
+    numbers = pc.cast(pc.if_else(valid, digits, '0'), pa.int64())
+    keys = pc.if_else(is_rs, numbers, pc.negate(numbers))
+    return keys.to_numpy(zero_copy_only=False).astype(np.int64, copy=False)
+
+def key_to_rsid(keys) -> np.ndarray:
+    keys = np.asarray(keys, dtype=np.int64)
+    digits = pc.cast(pa.array(np.abs(keys)), pa.string())
+    rsids = pc.if_else(pa.array(keys > 0), pc.binary_join_element_wise('rs', digits, ''), pc.binary_join_element_wise('i', digits, ''))
+    return pc.if_else(pa.array(keys == 0), '', rsids).to_numpy(zero_copy_only=False)
+
+def with_rsid_key(dataframe:pd.DataFrame, sort=True) -> pd.DataFrame:
+    if 'rsid_key' not in dataframe.columns:
+        dataframe = dataframe.assign(rsid_key=rsid_to_key(dataframe['rsid']))
+    if sort and not dataframe['rsid_key'].is_monotonic_increasing:
+        dataframe = dataframe.sort_values(by='rsid_key', kind='stable')
+    return dataframe
+
+def isin_sorted(keys, sorted_keys:np.ndarray) -> np.ndarray:
+    keys = np.asarray(keys, dtype=np.int64)
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.searchsorted(sorted_keys, keys)
+    positions[positions == len(sorted_keys)] = 0
+    return (sorted_keys[positions] == keys) & (keys != 0)
+
+def _join_positions(left_keys:np.ndarray, right_keys:np.ndarray):
+    starts = np.searchsorted(right_keys, left_keys, side='left')
+    ends = np.searchsorted(right_keys, left_keys, side='right')
+    counts = np.where(left_keys != 0, ends - starts, 0)
+
+    left_positions = np.repeat(np.arange(len(left_keys)), counts)
+    run_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    right_positions = np.repeat(starts, counts) + run_offsets
+    return left_positions, right_positions
+
+def merge_on_rsid_key(left:pd.DataFrame, right:pd.DataFrame) -> pd.DataFrame:
+    # inner join through searchsorted on the sorted right hand keys; same rows and order as
+    # left.merge(right, on='rsid', how='inner'), without hashing any strings
+    left = with_rsid_key(left, sort=False)
+    right = with_rsid_key(right)
+    left_positions, right_positions = _join_positions(left['rsid_key'].to_numpy(), right['rsid_key'].to_numpy())
+
+    right_columns = [x for x in right.columns if x not in left.columns]
+    result = left.take(left_positions).reset_index(drop=True)
+    right_part = right[right_columns].take(right_positions).reset_index(drop=True)
+    return pd.concat([result, right_part], axis=1)
+
+def table_with_rsid_key(table:pa.Table, sort=True) -> pa.Table:
+    # with_rsid_key for an arrow table, the sort is a take so the columns are never converted
+    if 'rsid_key' not in table.column_names:
+        table = table.append_column('rsid_key', pa.array(rsid_to_key(table['rsid']), pa.int64()))
+    keys = table['rsid_key'].to_numpy()
+    if sort and np.any(np.diff(keys) < 0):
+        table = table.take(np.argsort(keys, kind='stable'))
+    return table
+
+def merge_tables_on_rsid_key(left:pa.Table, right:pa.Table) -> pa.Table:
+    # merge_on_rsid_key for arrow tables: the same rows in the same order, gathered column by column
+    left = table_with_rsid_key(left, sort=False)
+    right = table_with_rsid_key(right)
+    left_positions, right_positions = _join_positions(left['rsid_key'].to_numpy(), right['rsid_key'].to_numpy())
+
+    right_columns = [x for x in right.column_names if x not in left.column_names]
+    result = left.take(left_positions)
+    right_part = right.select(right_columns).take(right_positions)
+    return pa.Table.from_arrays(result.columns + right_part.columns, names=result.column_names + right_columns)
+
@@ -0,0 +1,129 @@
+from .options import Options
+from .instrumentation import Instrumentation
+from .storage import atomic_write, file_lock, is_intact, single_flight
+import os, json, hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.ipc
+from dependency_injector.wiring import Provide
+
+class StageCache:
+    def __init__(self, 
+                 options:Options = Provide['Options'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._options = options
+        self._instrumentation = instrumentation
+
+    def file_hash(self, filename, chunk_size=1 << 20):
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def key(self, *parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self._options.stage_cache_folder, stage, f'{key}.parquet')
+
+    def _hit(self, stage, path):
+        if not os.path.exists(path):
+            self._instrumentation.count(f'stage_cache.{stage}.miss')
+            return False
+        if not is_intact(path):
+            # a torn entry is a miss, and the put that follows writes over it
+            self._instrumentation.count(f'stage_cache.{stage}.damaged')
+            return False
+        self._instrumentation.count(f'stage_cache.{stage}.hit')
+        # access time is tracked through mtime, since atime is often disabled on the mount
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process since the check
+            return False
+        return True
+
+    def get(self, stage, key):
+        path = self._path(stage, key)
+        if not self._hit(stage, path):
+            return None
+        try:
+            return pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+
+    def put(self, stage, key, dataframe:pd.DataFrame):
+        with atomic_write(self._path(stage, key)) as temp_path:
+            dataframe.to_parquet(temp_path)
+        self.evict()
+
+    def _single_flight(self, stage, key, get, compute, put):
+        # a process that misses computes the entry under its lock, and any other process missing the same entry
+        # meanwhile waits and reads what it wrote instead of computing it again
+        result = get(stage, key)
+        if result is not None:
+            return result
+        with file_lock(self._path(stage, key)):
+            result = get(stage, key)
+            if result is not None:
+                return result
+            result = compute()
+            put(stage, key, result)
+        return result
+
+    def get_or_compute(self, stage, key, compute):
+        return self._single_flight(stage, key, self.get, compute, self.put)
+
+    def get_table(self, stage, key):
+        path = self._path(stage, key)
+        if not self._hit(stage, path):
+            return None
+        try:
+            return pq.read_table(path, memory_map=True)
+        except FileNotFoundError:
+            return None
+
+    def put_table(self, stage, key, table:pa.Table):
+        with atomic_write(self._path(stage, key)) as temp_path:
+            pq.write_table(table, temp_path)
+        self.evict()
+
+    def get_or_compute_table(self, stage, key, compute):
+        return self._single_flight(stage, key, self.get_table, compute, self.put_table)
+
+    def get_or_compute_arrow_file(self, stage, key, compute):
+        # the path of an entry kept in arrow's file format, for readers in other processes that memory map it. It
+        # is never removed by the processes reading it, only evicted with the other entries once it's the oldest.
+        path = os.path.join(self._options.stage_cache_folder, stage, f'{key}.arrow')
+        if self._hit(stage, path):
+            return path
+        def build(temp_path):
+            table = compute()
+            with pa.OSFile(temp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        return single_flight(path, build)
+
+    def evict(self, max_bytes=None):
+        max_bytes = self._options.stage_cache_max_bytes if max_bytes is None else max_bytes
+        entries = []
+        for folder, _, files in os.walk(self._options.stage_cache_folder):
+            for file in files:
+                if file.endswith(('.parquet', '.arrow')) and not file.startswith('.'):
+                    try:
+                        stat = os.stat(os.path.join(folder, file))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(folder, file)))
+        total = sum(x[1] for x in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another process evicted it first
+                pass
+            total -= size
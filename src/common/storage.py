@@ -0,0 +1,124 @@
+import os, json, time, uuid, contextlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Everything under .data is written through here, so a reader in another process (or thread) only ever sees
+# the previous file or the complete new one, and an artifact two processes find missing at once is built by
+# one of them while the other waits for it.
+
+def temp_path_for(path):
+    # next to path so the rename stays on one filesystem, dot-prefixed so dataset listings skip it, and unique
+    # per writer so two threads of one process don't write over each other
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp')
+
+@contextlib.contextmanager
+def atomic_write(path, mode=None):
+    # yields a temp path to write (or with mode, the temp file open in it), renamed over path once the block
+    # finishes and removed if it raises
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = temp_path_for(path)
+    try:
+        if mode is None:
+            yield temp_path
+        else:
+            with open(temp_path, mode) as f:
+                yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def write_bytes(path, content:bytes):
+    with atomic_write(path, 'wb') as f:
+        f.write(content)
+
+def write_json(path, value, indent=None):
+    with atomic_write(path, 'w') as f:
+        json.dump(value, f, indent=indent)
+
+def lock_path_for(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}.lock')
+
+@contextlib.contextmanager
+def file_lock(path):
+    # an exclusive lock on path's artifact, held across processes. flock locks belong to the open file, so
+    # threads of one process opening the lock file separately exclude each other too. Not reentrant.
+    lock_path = lock_path_for(path)
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _ends_with_magic(path, magic:bytes, padding=0):
+    size = os.path.getsize(path)
+    if size < 2 * len(magic) + padding:
+        return False
+    with open(path, 'rb') as f:
+        head = f.read(len(magic))
+        f.seek(size - len(magic))
+        return (head == magic) and (f.read(len(magic)) == magic)
+
+def _npy_intact(path):
+    import numpy as np
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version[0] == 1 else np.lib.format.read_array_header_2_0
+        shape, _, dtype = read_header(f)
+        expected = f.tell() + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    return os.path.getsize(path) == expected
+
+def _json_intact(path):
+    with open(path) as f:
+        json.load(f)
+    return True
+
+_checks = {
+    '.parquet': lambda path: _ends_with_magic(path, b'PAR1', padding=4),
+    '.arrow': lambda path: _ends_with_magic(path, b'ARROW1'),
+    '.npy': _npy_intact,
+    '.json': _json_intact,
+}
+
+def is_intact(path):
+    # a cheap check that a file is there and was written to the end, for files renamed into place by something
+    # other than atomic_write or torn by a crash before the filesystem flushed them: parquet and arrow files end
+    # with the magic they start with, an npy holds the bytes its header promises and json parses. Anything else
+    # only has to exist and not be empty.
+    if not os.path.isfile(path):
+        return False
+    check = _checks.get(os.path.splitext(path)[1])
+    try:
+        return check(path) if check is not None else os.path.getsize(path) > 0
+    except (OSError, ValueError):
+        return False
+
+def single_flight(path, build, intact=is_intact):
+    # path once it holds an intact artifact. Missing or damaged, the first process to take its lock builds it
+    # with build(temp_path), and the others wait on the lock and then reuse what it wrote.
+    if intact(path):
+        return path
+    with file_lock(path):
+        if not intact(path):
+            with atomic_write(path) as temp_path:
+                build(temp_path)
+    return path
@@ -1,3 +1,4 @@
 from .ancestry_reader import *
 from .twentythree_reader import *
+from .raw_data_file import *
 from .genetic_data_to_dataframe_converter import *
\ No newline at end of file
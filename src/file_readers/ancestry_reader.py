@@ -1,18 +1,24 @@
 from .genetic_file_reader import GeneticFileReader
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 class AncestryReader(GeneticFileReader):
-    def _get_file_data_impl(self, filename):
-        skiplines = self.get_line_skips(filename)
-        if skiplines is None:
-            return None
-        skiplines+=1
+    source = 'ancestry'
+    stream_columns = ['rsid','chromosome','position','allele1','allele2']
 
-        user_id = self.get_user_id(filename)
-        result = pd.read_csv(filename, sep='\t', skiprows=skiplines, engine='pyarrow', header=None, dtype={'rsid':str,'chromosome':str,'position':int,'allele1':str,'allele2':str}, names=['rsid','chromosome','position','allele1','allele2'])
+    def _get_file_data_impl(self, filename):
+        with self._open_raw_data(filename) as raw_data:
+            result = self._read_dataframe(raw_data, {'rsid':str,'chromosome':str,'position':int,'allele1':str,'allele2':str})
+            user_id = self.get_user_id(raw_data.filename)
         result['alleles'] = result['allele1'].replace('None', '') + result['allele2'].replace('None','')
         result = result.drop(columns=['allele1','allele2'])
         result['user'] = user_id
         result['source'] = 'ancestry'
         result = self.post_process_genome_data(result)
         return result
+
+    def _get_stream_alleles(self, table:pa.Table):
+        allele1 = pc.if_else(pc.equal(table['allele1'], 'None'), '', table['allele1'])
+        allele2 = pc.if_else(pc.equal(table['allele2'], 'None'), '', table['allele2'])
+        return pc.binary_join_element_wise(allele1, allele2, '')
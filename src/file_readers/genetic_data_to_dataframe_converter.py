@@ -1,25 +1,92 @@
 from .ancestry_reader import AncestryReader
 from .twentythree_reader import TwentyThreeReader
 from .genetic_file_reader import GeneticFileReader
+from .raw_data_file import RawDataFile
+from ..common import Instrumentation
+import os
+from contextlib import contextmanager
 from dependency_injector.wiring import Provide
 
 class GeneticDataToDataFrameConverter:
     def __init__(self,
                  ancestry_reader:AncestryReader = Provide['AncestryReader'],
-                 twenty_three_reader:TwentyThreeReader = Provide['TwentyThreeReader']):
+                 twenty_three_reader:TwentyThreeReader = Provide['TwentyThreeReader'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._instrumentation = instrumentation
         self._readers = {
-            'ancestry.txt': ancestry_reader,
-            '23andme.txt': twenty_three_reader
+            'ancestry': ancestry_reader,
+            '23andme': twenty_three_reader
         }
 
-    def _get_reader(self, filename)-> GeneticFileReader:
-        readers = [v for k,v in self._readers.items() if filename.endswith(k)]
+    def _suffix_reader(self, filename)-> GeneticFileReader:
+        name = RawDataFile.strip_compression_suffix(os.path.basename(filename))
+        readers = [v for k,v in self._readers.items() if name.endswith(f'{k}.txt')]
         if len(readers) == 1:
             return readers[0]
         return None
 
+    def _get_reader(self, raw_data:RawDataFile)-> GeneticFileReader:
+        # the header decides, the file name is only a fallback for a header nobody recognises
+        if raw_data.format is not None:
+            return self._readers[raw_data.format]
+        return self._suffix_reader(raw_data.filename)
+
+    @contextmanager
+    def _open(self, filename, throw_on_error=False):
+        try:
+            raw_data = RawDataFile(filename)
+        except Exception:
+            if throw_on_error:
+                raise
+            yield None, None
+            return
+        with raw_data:
+            yield raw_data, self._get_reader(raw_data)
+
+    def get_reader_version(self, filename):
+        with self._open(filename) as (raw_data, reader):
+            if reader is None:
+                return None
+            return f'{type(reader).__name__}:{reader.version}'
+
+    def get_user_id(self, filename):
+        # the user id only comes from the file name, any reader parses it the same way
+        return self._readers['23andme'].get_user_id(filename)
+
     def read_data(self, filename, throw_on_error=False):
-        reader = self._get_reader(filename)
-        if reader is not None:
-            return reader.get_file_data(filename, throw_on_error)
+        with self._open(filename, throw_on_error) as (raw_data, reader):
+            if reader is not None:
+                with self._instrumentation.span(f'read.{reader.source}') as span:
+                    result = reader.get_file_data(raw_data, throw_on_error)
+                    span.add_rows(0 if result is None else len(result))
+                return result
+        return None
+
+    def read_data_streaming(self, filename, rsids=None, block_size=None, throw_on_error=False):
+        with self._open(filename, throw_on_error) as (raw_data, reader):
+            if reader is not None:
+                with self._instrumentation.span(f'read_streaming.{reader.source}') as span:
+                    result = reader.get_file_data_streaming(raw_data, rsids, block_size, throw_on_error)
+                    span.add_rows(0 if result is None else len(result))
+                return result
+        return None
+
+    def iter_file_batches(self, filename, rsids=None, block_size=None, throw_on_error=False):
+        # the genome a block at a time, so a caller that folds the blocks as they come never holds all of it
+        with self._open(filename, throw_on_error) as (raw_data, reader):
+            if reader is None:
+                return
+            try:
+                yield from reader.iter_file_batches(raw_data, rsids, block_size)
+            except Exception:
+                if throw_on_error:
+                    raise
+
+    def read_table(self, filename, rsids=None, block_size=None, throw_on_error=False):
+        with self._open(filename, throw_on_error) as (raw_data, reader):
+            if reader is not None:
+                with self._instrumentation.span(f'read_table.{reader.source}') as span:
+                    result = reader.get_file_table(raw_data, rsids, block_size, throw_on_error)
+                    span.add_rows(0 if result is None else result.num_rows)
+                return result
         return None
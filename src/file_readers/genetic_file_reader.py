@@ -1,28 +1,29 @@
+from .raw_data_file import RawDataFile
+from ..common import rsid_to_key, isin_sorted
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 
 class GeneticFileReader(ABC):
-    def get_line_skips(self, filename):
-        try:
-            skiplines = 0
-            with open(filename, 'r') as f:
-                line = f.readline()
-                if line.startswith('\x00'):
-                    return None
-                while line.startswith('#'):
-                    skiplines+=1
-                    line = f.readline()
-            return skiplines
-        except:
-            return None
-        
+    # bump when a change to the reader changes the frames it produces, it invalidates cached reads
+    version = 1
+    source = None
+    stream_columns = ['rsid','chromosome','position','alleles']
+    stream_block_size = 4 << 20
+
     def get_user_id(self, filename):
+        if isinstance(filename, RawDataFile):
+            filename = filename.filename
         try:
             return int(os.path.basename(filename).split('_')[0].replace('user', ''))
         except:
             return 0
-    
+
     def post_process_genome_data(self, result):
         result['position'] = pd.to_numeric(result['position'], errors='coerce')
         result = result.dropna().copy()
@@ -42,4 +43,115 @@ class GeneticFileReader(ABC):
                 return self._get_file_data_impl(filename)
             except:
                 return None
-        
\ No newline at end of file
+
+    @contextmanager
+    def _open_raw_data(self, source):
+        # source is a file name, or a RawDataFile the caller already opened to find out which reader to use
+        if isinstance(source, RawDataFile):
+            yield source
+        else:
+            with RawDataFile(source) as raw_data:
+                yield raw_data
+
+    def _read_dataframe(self, raw_data:RawDataFile, dtype:dict):
+        # the header has been read off the stream already, everything left is rows
+        return pd.read_csv(raw_data.stream, sep='\t', engine='pyarrow', header=None, dtype=dtype, names=list(dtype))
+
+    def _get_stream_alleles(self, table:pa.Table):
+        return table['alleles']
+
+    def _open_stream(self, raw_data:RawDataFile, block_size=None):
+        read_options = pacsv.ReadOptions(column_names=self.stream_columns, block_size=block_size or self.stream_block_size)
+        parse_options = pacsv.ParseOptions(delimiter='\t')
+        # everything comes in as strings so a bad position drops the row instead of failing the batch,
+        # the same as the to_numeric(errors='coerce') in post_process_genome_data.
+        convert_options = pacsv.ConvertOptions(column_types={x:pa.string() for x in self.stream_columns})
+        return pacsv.open_csv(raw_data.stream, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+
+    def _compact_batch(self, batch:pa.RecordBatch, rsids:pa.Array=None):
+        table = pa.Table.from_batches([batch])
+        table = pa.table({
+            'rsid': table['rsid'],
+            'chromosome': table['chromosome'],
+            'position': table['position'],
+            'alleles': self._get_stream_alleles(table),
+        }).drop_null()
+
+        keep = pc.utf8_is_digit(table['position'])
+        if isinstance(rsids, np.ndarray):
+            keep = pc.and_(keep, pa.array(isin_sorted(rsid_to_key(table['rsid']), rsids)))
+        elif rsids is not None:
+            keep = pc.and_(keep, pc.is_in(table['rsid'], value_set=rsids))
+        table = table.filter(keep)
+
+        return pa.table({
+            'rsid': table['rsid'],
+            'chromosome': table['chromosome'].dictionary_encode(),
+            'position': pc.cast(table['position'], pa.uint32()),
+            'alleles': table['alleles'].dictionary_encode(),
+        })
+
+    def _get_rsid_filter(self, rsids):
+        # rsids to keep, or a numpy array of sorted rsid keys, which is searched rather than hashed per batch
+        if (rsids is None) or isinstance(rsids, np.ndarray):
+            return rsids
+        if isinstance(rsids, (pd.Series, pd.Index)):
+            rsids = rsids.drop_duplicates().tolist()
+        return pa.array(list(rsids), type=pa.string())
+
+    def _concat_tables(self, tables):
+        if len(tables) == 0:
+            return pa.table({
+                'rsid': pa.array([], pa.string()),
+                'chromosome': pa.array([], pa.string()).dictionary_encode(),
+                'position': pa.array([], pa.uint32()),
+                'alleles': pa.array([], pa.string()).dictionary_encode(),
+            })
+        return pa.concat_tables(tables).unify_dictionaries()
+
+    def _to_genome_dataframe(self, tables, filename):
+        result = self._concat_tables(tables).to_pandas(self_destruct=True)
+        result.attrs['user'] = self.get_user_id(filename)
+        result.attrs['source'] = self.source
+        return result
+
+    def iter_file_batches(self, filename, rsids=None, block_size=None):
+        rsid_filter = self._get_rsid_filter(rsids)
+        with self._open_raw_data(filename) as raw_data:
+            for batch in self._open_stream(raw_data, block_size):
+                table = self._compact_batch(batch, rsid_filter)
+                if table.num_rows > 0:
+                    yield self._to_genome_dataframe([table], raw_data.filename)
+
+    def _read_tables(self, raw_data:RawDataFile, rsids=None, block_size=None):
+        rsid_filter = self._get_rsid_filter(rsids)
+        tables = [self._compact_batch(batch, rsid_filter) for batch in self._open_stream(raw_data, block_size)]
+        return [x for x in tables if x.num_rows > 0]
+
+    def _get_file_data_streaming_impl(self, filename, rsids=None, block_size=None):
+        with self._open_raw_data(filename) as raw_data:
+            return self._to_genome_dataframe(self._read_tables(raw_data, rsids, block_size), raw_data.filename)
+
+    def _get_file_table_impl(self, filename, rsids=None, block_size=None):
+        # the streamed batches as one arrow table, never converted to pandas
+        with self._open_raw_data(filename) as raw_data:
+            table = self._concat_tables(self._read_tables(raw_data, rsids, block_size))
+            return table.replace_schema_metadata({'user': str(self.get_user_id(raw_data.filename)), 'source': self.source})
+
+    def get_file_table(self, filename, rsids=None, block_size=None, throw_on_error=False):
+        if throw_on_error:
+            return self._get_file_table_impl(filename, rsids, block_size)
+        else:
+            try:
+                return self._get_file_table_impl(filename, rsids, block_size)
+            except:
+                return None
+
+    def get_file_data_streaming(self, filename, rsids=None, block_size=None, throw_on_error=False):
+        if throw_on_error:
+            return self._get_file_data_streaming_impl(filename, rsids, block_size)
+        else:
+            try:
+                return self._get_file_data_streaming_impl(filename, rsids, block_size)
+            except:
+                return None
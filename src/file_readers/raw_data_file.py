@@ -0,0 +1,102 @@
+import io, os, bz2, gzip, lzma, zipfile
+
+class RawDataFile:
+    # Opens a raw data download whether it's plain text or wrapped in gzip, bz2, xz or zip, reads the
+    # header once and leaves stream at the first data row. The compression comes from the leading
+    # bytes and the format from the header, so neither depends on what the file is called.
+    magic_numbers = {b'\x1f\x8b': 'gzip', b'BZh': 'bz2', b'\xfd7zXZ\x00': 'xz', b'PK\x03\x04': 'zip'}
+    compression_suffixes = ['.gz', '.gzip', '.bz2', '.xz', '.zip']
+    buffer_size = 1 << 20
+
+    def __init__(self, filename):
+        # filename can also be an open binary file, such as an upload held in a BytesIO
+        self._file = filename if hasattr(filename, 'read') else None
+        self.filename = filename if self._file is None else getattr(self._file, 'name', 'stream')
+        self.compression = None
+        self.member = None
+        self.comments = []
+        self.column_header = None
+        self.first_row = None
+        self.format = None
+        self._closables = []
+        try:
+            self.stream = self._open()
+            self._read_header()
+        except:
+            self.close()
+            raise
+
+    def _open(self):
+        if self._file is None:
+            file = open(self.filename, 'rb', buffering=self.buffer_size)
+        else:
+            file = self._file if hasattr(self._file, 'peek') else io.BufferedReader(self._file, buffer_size=self.buffer_size)
+        self._closables.append(file)
+        start = file.peek(8)[:8]
+        self.compression = next((v for k, v in self.magic_numbers.items() if start.startswith(k)), None)
+
+        if self.compression is None:
+            return file
+        if self.compression == 'zip':
+            archive = zipfile.ZipFile(file)
+            self._closables.append(archive)
+            self.member = self._pick_member(archive)
+            stream = archive.open(self.member)
+        elif self.compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=file, mode='rb')
+        elif self.compression == 'bz2':
+            stream = bz2.BZ2File(file, mode='rb')
+        else:
+            stream = lzma.LZMAFile(file, mode='rb')
+        self._closables.append(stream)
+        return io.BufferedReader(stream, buffer_size=self.buffer_size)
+
+    def _pick_member(self, archive:zipfile.ZipFile):
+        # the downloads hold one text file, sometimes next to a readme or macOS resource forks
+        members = [x for x in archive.infolist() if not x.is_dir() and not x.filename.startswith('__MACOSX/')]
+        text_members = [x for x in members if x.filename.lower().endswith('.txt')]
+        if len(members) == 0:
+            raise Exception(f'{self.filename} is an empty archive.')
+        return max(text_members or members, key=lambda x: x.file_size).filename
+
+    def _read_header(self):
+        while True:
+            buffered = self.stream.peek(1)
+            if buffered.startswith(b'\x00'):
+                raise Exception(f'{self.filename} is not a text file.')
+            if buffered.startswith(b'#'):
+                self.comments.append(self.stream.readline().decode('utf-8', errors='replace').rstrip('\r\n'))
+            elif self.column_header is None and buffered[:4].lower() == b'rsid':
+                self.column_header = self.stream.readline().decode('utf-8', errors='replace').rstrip('\r\n')
+            else:
+                break
+        first_row = self.stream.peek(1 << 12).split(b'\n', 1)[0]
+        self.first_row = first_row.decode('utf-8', errors='replace').rstrip('\r')
+        self.format = self._sniff_format()
+
+    def _sniff_format(self):
+        header = '\n'.join(self.comments + [self.column_header or ''])
+        if 'allele1' in header.lower() or 'AncestryDNA' in header:
+            return 'ancestry'
+        if '23andMe' in header or 'genotype' in header.lower():
+            return '23andme'
+        # a header we don't recognise, the tab separated columns of the first row still tell the two apart
+        columns = len(self.first_row.split('\t')) if len(self.first_row) > 0 else 0
+        return {4: '23andme', 5: 'ancestry'}.get(columns)
+
+    @classmethod
+    def strip_compression_suffix(cls, filename):
+        root, extension = os.path.splitext(filename)
+        return root if extension.lower() in cls.compression_suffixes else filename
+
+    def close(self):
+        for closable in reversed(self._closables):
+            closable.close()
+        self._closables = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
@@ -1,3 +1,10 @@
+from .ncbi_dataset import *
+from .refsnp_parser import *
+from .refsnp_parse_executor import *
+from .refsnp_store import *
+from .refsnp_async_downloader import *
 from .ncbi_data_downloader import *
+from .variant_index import *
 from .ncbi_dataframe_generator import *
-from .citations_dataframe import *
\ No newline at end of file
+from .citations_dataframe import *
+from .ncbi_data_refresher import *
\ No newline at end of file
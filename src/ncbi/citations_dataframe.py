@@ -1,31 +1,162 @@
-from ..common import Options
-import os, requests
+from ..common import Options, with_rsid_key, rsid_to_key, atomic_write, file_lock, is_intact, single_flight
+import os, shutil, hashlib
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 from dependency_injector.wiring import Provide
 
 class CitationsDataframeGenerator:
+    citations_url = 'https://ftp.ncbi.nlm.nih.gov/pub/clinvar/tab_delimited/var_citations.txt'
+    chunk_size = 1 << 20
+
     def __init__(self, options:Options = Provide['Options']):
         self._options = options
 
+    def _download(self, temp_path):
+        import requests
+        with requests.get(self.citations_url, stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                raise Exception(f'Unable to download {self.citations_url}, HTTP {response.status_code}.')
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+
     def _download_citations(self):
-        if not os.path.exists(self._options.citations_text_file):
-            url = 'https://ftp.ncbi.nlm.nih.gov/pub/clinvar/tab_delimited/var_citations.txt'
-            response = requests.get(url)
-            if response.status_code == 200:
-                with open(self._options.citations_text_file, 'w') as f:
-                    f.write(response.content.decode())
+        # one process downloads, any other needing the file meanwhile waits for it
+        single_flight(self._options.citations_text_file, self._download)
 
-    def get_dataframe(self):
-        if os.path.exists(self._options.citations_parquet_file):
-            result = pd.read_parquet(self._options.citations_parquet_file)
-            return result
-        
+    def _write_keys(self, keys:np.ndarray):
+        with atomic_write(self._options.citations_rsid_keys_file, 'wb') as f:
+            np.save(f, keys)
+
+    def _iter_rsid_keys(self, filename):
+        read_options = pacsv.ReadOptions(block_size=self.chunk_size)
+        parse_options = pacsv.ParseOptions(delimiter='\t')
+        convert_options = pacsv.ConvertOptions(include_columns=['rs'], column_types={'rs':pa.string()})
+        for batch in pacsv.open_csv(filename, read_options=read_options, parse_options=parse_options, convert_options=convert_options):
+            rs = batch.column(0)
+            rs = rs.filter(pc.fill_null(pc.utf8_is_digit(rs), False))
+            yield np.unique(pc.cast(rs, pa.int64()).to_numpy())
+
+    def ingest(self, filename=None):
+        filename = filename or self._options.citations_text_file
+        if filename == self._options.citations_text_file:
+            self._download_citations()
+
+        # only the distinct keys of each block are kept, so memory stays flat however big the file is
+        keys = np.zeros(0, dtype=np.int64)
+        for batch_keys in self._iter_rsid_keys(filename):
+            keys = np.union1d(keys, batch_keys)
+
+        self._write_keys(keys)
+        return keys
+
+    def _build_dataframe(self, temp_path):
         self._download_citations()
         result = pd.read_csv(self._options.citations_text_file, delimiter='\t')
         result = result[~result['rs'].isna()]
-        result['rs'] = 'rs' + result['rs'].astype(int).astype(str)
+        result['rsid_key'] = result['rs'].astype('int64')
+        result['rs'] = 'rs' + result['rsid_key'].astype(str)
         result = result.rename(columns={'rs':'rsid'})
-        result.to_parquet(self._options.citations_parquet_file)
-        return result
+        result = result.sort_values(by='rsid_key', kind='stable').reset_index(drop=True)
+        result.to_parquet(temp_path)
+
+    def get_dataframe(self):
+        single_flight(self._options.citations_parquet_file, self._build_dataframe)
+        return with_rsid_key(pd.read_parquet(self._options.citations_parquet_file))
+
+    def get_studied_rsid_keys(self):
+        path = self._options.citations_rsid_keys_file
+        if not is_intact(path):
+            with file_lock(path):
+                if not is_intact(path):
+                    if is_intact(self._options.citations_parquet_file):
+                        keys = np.unique(rsid_to_key(pd.read_parquet(self._options.citations_parquet_file, columns=['rsid'])['rsid']))
+                        self._write_keys(keys[keys > 0])
+                    else:
+                        self.ingest()
+        return np.load(path)
+
+    def _sum_by_key(self, keys:np.ndarray, values:np.ndarray):
+        # uint64 sums wrap around, so they don't depend on the order the values come in
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        if len(keys) == 0:
+            return keys, values
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return keys[starts], np.add.reduceat(values, starts)
+
+    def _iter_digests(self, filename):
+        read_options = pacsv.ReadOptions(block_size=self.chunk_size)
+        parse_options = pacsv.ParseOptions(delimiter='\t')
+        names = pacsv.open_csv(filename, read_options=read_options, parse_options=parse_options).schema.names
+        # every column as text, so the types a block happens to be inferred as can't change how a row hashes
+        convert_options = pacsv.ConvertOptions(column_types={x: pa.string() for x in names})
+        for batch in pacsv.open_csv(filename, read_options=read_options, parse_options=parse_options, convert_options=convert_options):
+            batch = batch.filter(pc.fill_null(pc.utf8_is_digit(batch.column(names.index('rs'))), False))
+            keys = pc.cast(batch.column(names.index('rs')), pa.int64()).to_numpy()
+            # a row hashed as one string, several times quicker than hashing the columns of a dataframe
+            rows = pc.binary_join_element_wise(*batch.columns, '\t', null_handling='replace')
+            yield self._sum_by_key(keys, pd.util.hash_array(rows.to_numpy(zero_copy_only=False), categorize=False))
+
+    def _digests(self, filename):
+        # per rsid, the sum of its rows' hashes: the same rows in any order give the same digest, and it moves when
+        # a row is added, removed or edited. Sorted keys and their digests.
+        parts = list(self._iter_digests(filename))
+        if len(parts) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+        return self._sum_by_key(np.concatenate([x[0] for x in parts]), np.concatenate([x[1] for x in parts]))
+
+    def _source(self, filename):
+        stat = os.stat(filename)
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def _write_digests(self, keys, digests, source):
+        table = pa.table({'rsid_key': pa.array(keys, pa.int64()), 'digest': pa.array(digests, pa.uint64())})
+        with atomic_write(self._options.citations_digests_file) as temp_path:
+            pq.write_table(table.replace_schema_metadata({b'citations_source': source.encode()}), temp_path)
+
+    def _current_digests(self):
+        # the digests of the citations file in place, kept from the refresh that put it there, or worked out
+        # from the file when it came some other way
+        text_file = self._options.citations_text_file
+        if not is_intact(text_file):
+            return None
+        if is_intact(self._options.citations_digests_file):
+            metadata = pq.read_schema(self._options.citations_digests_file).metadata or {}
+            if metadata.get(b'citations_source', b'').decode() == self._source(text_file):
+                table = pq.read_table(self._options.citations_digests_file)
+                return table['rsid_key'].to_numpy(), table['digest'].to_numpy()
+        return self._digests(text_file)
+
+    def refresh(self, filename=None):
+        # Swaps the citations for a new snapshot, filename or else a fresh download of ClinVar's, and returns the
+        # sorted rsid keys whose citation rows were added, removed or changed since the one it replaced, or None
+        # when there wasn't one to compare with. The studied keys follow the new snapshot.
+        text_file = self._options.citations_text_file
+        with file_lock(text_file):
+            previous = self._current_digests()
+            with atomic_write(text_file) as temp_path:
+                if filename is None:
+                    self._download(temp_path)
+                else:
+                    shutil.copyfile(filename, temp_path)
+                keys, digests = self._digests(temp_path)
+            self._write_digests(keys, digests, self._source(text_file))
+            self._write_keys(keys)
+            # built again from the new file the next time it's asked for
+            with file_lock(self._options.citations_parquet_file):
+                if os.path.exists(self._options.citations_parquet_file):
+                    os.remove(self._options.citations_parquet_file)
+        if previous is None:
+            return None
+        previous_keys, previous_digests = previous
+        common, before, after = np.intersect1d(previous_keys, keys, assume_unique=True, return_indices=True)
+        return np.union1d(np.setxor1d(previous_keys, keys, assume_unique=True), common[previous_digests[before] != digests[after]])
 
+    def get_snapshot_version(self):
+        return hashlib.sha256(self.get_studied_rsid_keys().tobytes()).hexdigest()
@@ -1,41 +1,40 @@
-from ..common import Options
-import os
-import requests
-from tqdm import trange
-from datetime import datetime, timedelta
-import time
+from ..common import Options, Instrumentation
+from .refsnp_async_downloader import RefSnpAsyncDownloader
+from .refsnp_store import RefSnpStore
+from datetime import datetime
 from dependency_injector.wiring import Provide
-from dask.distributed import Client, progress
 
 class NCBIDataDownloader:
-    def __init__(self, options:Options = Provide['Options']):
+    def __init__(self, 
+                 options:Options = Provide['Options'],
+                 refsnp_downloader:RefSnpAsyncDownloader = Provide['RefSnpAsyncDownloader'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
         self._options = options
+        self._refsnp_downloader = refsnp_downloader
+        self._refsnp_store = refsnp_store
+        self._instrumentation = instrumentation
 
     def download_individual_ncbi_data(self, rsid, prev_start_time=None, seconds_between_each=1):
-
-        targetpath = os.path.join(self._options.ncbi_data_cache, f'{rsid}.json')
-        if os.path.exists(targetpath):
+        if self._refsnp_store.contains(rsid):
             return False, prev_start_time
-        try:
-            now = datetime.now()
-            if (prev_start_time is not None) and ((prev_start_time + timedelta(seconds=seconds_between_each)) > now):
-                diff:datetime = (prev_start_time + timedelta(seconds=seconds_between_each))
-                sleeptime = abs((now - diff).total_seconds())
-                #time.sleep(0.001)
-                time.sleep(sleeptime)
-            
-            rsid_number = int(rsid.replace('rs', ''))
-            start_time = datetime.now()
-            response = requests.get(f'https://api.ncbi.nlm.nih.gov/variation/v0/refsnp/{rsid_number}', timeout=5)
-            if response.status_code == 200:
-                content = response.content.decode()
-                with open(targetpath, 'w') as f:
-                    f.write(content)
-                    return True, start_time
-        except:
+        start_time = datetime.now()
+        summary = self._refsnp_downloader.download([rsid], show_progress=False)
+        if summary['failed'] > 0:
             print('unable to download', rsid)
-            return False, datetime.now()
+        return summary['downloaded'] > 0, start_time
 
+    def download_rsids(self, rsids, show_progress=True, refetch=False):
+        rsids = [x for x in rsids if x.startswith('rs')]
+        if len(rsids) == 0:
+            return False
+        with self._instrumentation.span('download', rows=len(rsids)):
+            summary = self._refsnp_downloader.download(rsids, show_progress, refetch)
+        self._instrumentation.count('ncbi.rsids_downloaded', summary['downloaded'])
+        self._instrumentation.count('ncbi.rsids_failed', summary['failed'])
+        if summary['failed'] > 0:
+            print(f'unable to download {summary["failed"]} rsids, see {self._options.ncbi_download_failures}')
+        return summary['downloaded'] > 0
 
     def download_ncbi_data(self, merged_dna, allow_download = True):
         if not allow_download:
@@ -45,25 +44,11 @@ class NCBIDataDownloader:
         #     print('No new bulk download during work hours')
         #     return True
         
-        print('Downloading NCBI Data')
         genotypes = set(merged_dna.loc[merged_dna['rsid'].str.startswith('rs'), 'rsid'].to_list())
-        already_cached = [x.replace('.json', '') for x in os.listdir(self._options.ncbi_data_cache)]
-        for x in already_cached:
-            if x in genotypes:
-                genotypes.remove(x)
-        
-        new_data = False
-        
-        start_time = datetime.now() - timedelta(seconds=10)
-        client = Client()
-        futures = client.map(self.download_individual_ncbi_data, genotypes)
-        fut = client.compute(futures)
-        progress(fut)
-        # t_range = trange(len(genotypes))
-        # for genotype,t in zip(genotypes, t_range):
-        #     result, start_time = self.download_individual_ncbi_data(genotype, start_time, .01)
-        #     new_data = result or new_data
-        #     t_range.refresh()
+        genotypes = self._refsnp_store.missing(genotypes)
+        if len(genotypes) == 0:
+            return False
 
-        return len(genotypes) > 0
+        print('Downloading NCBI Data')
+        return self.download_rsids(sorted(genotypes))
 
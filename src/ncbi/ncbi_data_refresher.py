@@ -0,0 +1,67 @@
+from ..common import Options, Instrumentation, key_to_rsid
+from .refsnp_store import RefSnpStore
+from .ncbi_data_downloader import NCBIDataDownloader
+from .ncbi_dataframe_generator import NCBIDataFrameGenerator
+from .citations_dataframe import CitationsDataframeGenerator
+import numpy as np
+from dependency_injector.wiring import Provide
+
+class NCBIDataRefresher:
+    # Brings the refsnp store and the NCBI dataset up to date without rebuilding either. The documents refetched
+    # are the ones fetched longer ago than Options.ncbi_refresh_max_age_days and the ones whose ClinVar citation
+    # rows differ between the new var_citations.txt and the previous one. Of those, only the documents that came
+    # back different are parsed again, and their rows are appended to the dataset in place of the old ones.
+    def __init__(self,
+                 options:Options = Provide['Options'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore'],
+                 ncbi_data_downloader:NCBIDataDownloader = Provide['NCBIDataDownloader'],
+                 ncbi_dataframe_generator:NCBIDataFrameGenerator = Provide['NCBIDataFrameGenerator'],
+                 citations_dataframe_generator:CitationsDataframeGenerator = Provide['CitationsDataframeGenerator'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._options = options
+        self._refsnp_store = refsnp_store
+        self._ncbi_data_downloader = ncbi_data_downloader
+        self._ncbi_dataframe_generator = ncbi_dataframe_generator
+        self._citations_dataframe_generator = citations_dataframe_generator
+        self._instrumentation = instrumentation
+
+    def due(self, changed_citation_keys=None, max_age_days=None):
+        # stored rsids to refetch, in key order: the stale ones, and the ones whose citations changed along with
+        # the rsids they were merged into
+        max_age_days = self._options.ncbi_refresh_max_age_days if max_age_days is None else max_age_days
+        due = set(self._refsnp_store.stale(max_age_days * 86400))
+        if (changed_citation_keys is not None) and (len(changed_citation_keys) > 0):
+            keys = np.asarray(changed_citation_keys, dtype=np.int64)
+            keys = np.union1d(keys, self._refsnp_store.canonical_keys(keys))
+            due.update(self._refsnp_store.existing(key_to_rsid(keys)))
+        return sorted(due, key=lambda x: int(x[2:]))
+
+    def _refetched(self, before, after):
+        # the documents whose fetch time moved, a failed fetch leaves the stored document and its time as they were
+        merged = after.merge(before, on='rsid_key', how='left', suffixes=('', '_before'))
+        return merged[merged['fetched_at'] > merged['fetched_at_before'].fillna(-1)]
+
+    def refresh(self, citations_filename=None, max_age_days=None, show_progress=True):
+        # citations_filename is a var_citations.txt already on this machine, otherwise ClinVar's is downloaded
+        summary = {}
+        with self._instrumentation.span('refresh'):
+            with self._instrumentation.span('refresh.citations'):
+                changed_citation_keys = self._citations_dataframe_generator.refresh(citations_filename)
+            summary['citations_changed'] = None if changed_citation_keys is None else len(changed_citation_keys)
+
+            due = self.due(changed_citation_keys, max_age_days)
+            summary['due'] = len(due)
+            before = self._refsnp_store.fetch_info(due)
+            self._ncbi_data_downloader.download_rsids(due, show_progress, refetch=True)
+            refetched = self._refetched(before, self._refsnp_store.fetch_info(due))
+            summary['refetched'] = len(refetched)
+
+            # only documents that came back different are parsed again, a document stored before hashes were kept counts as different
+            changed = [f'rs{x}' for x in refetched.loc[refetched['sha256'] != refetched['sha256_before'], 'rsid_key']]
+            summary['changed'] = len(changed)
+            with self._instrumentation.span('refresh.upsert', rows=len(changed)):
+                summary['rows_upserted'] = self._ncbi_dataframe_generator.upsert(changed)
+        for name, value in summary.items():
+            if value is not None:
+                self._instrumentation.count(f'refresh.{name}', value)
+        return summary
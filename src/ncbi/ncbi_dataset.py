@@ -0,0 +1,177 @@
+from ..common import Options, rsid_to_key, with_rsid_key, table_with_rsid_key, atomic_write, file_lock
+import os, time, uuid, hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from dependency_injector.wiring import Provide
+
+class NCBIDataset:
+    bucket_count = 64
+    compaction_threshold = 16
+
+    def __init__(self, options:Options = Provide['Options']):
+        self._options = options
+
+    @property
+    def root(self):
+        return self._options.ncbi_dataset_folder
+
+    def _buckets(self, rsids:pd.Series):
+        return pd.Series(rsid_to_key(rsids) % self.bucket_count, index=rsids.index)
+
+    def _bucket_folder(self, bucket):
+        return os.path.join(self.root, f'bucket={bucket}')
+
+    def _fragment_name(self, order=None):
+        # fragments sort by creation time, and the newest fragment wins when an rsid shows up twice
+        order = order or time.time_ns()
+        return f'part-{order:020d}-{uuid.uuid4().hex[:8]}.parquet'
+
+    def _fragment_order(self, path):
+        return int(os.path.basename(path).split('-')[1])
+
+    def _write_fragment(self, bucket, table:pa.Table, order=None):
+        # atomic_write's temp files are dot-prefixed, which the dataset reader ignores until the rename makes them visible
+        with atomic_write(os.path.join(self._bucket_folder(bucket), self._fragment_name(order))) as temp_path:
+            pq.write_table(table, temp_path)
+
+    def _dataset(self):
+        if not self._has_fragments():
+            return None
+        return ds.dataset(self.root, format='parquet', partitioning='hive')
+
+    def _has_fragments(self):
+        return os.path.isdir(self.root) and any(not x.startswith('.') for x in os.listdir(self.root))
+
+    def _import_legacy_parquet(self):
+        if self._has_fragments() or not os.path.exists(self._options.ncbi_dataframe_parquet):
+            return
+        # imported once, by whichever process gets here first
+        with file_lock(self.root):
+            if not self._has_fragments():
+                self.append(pd.read_parquet(self._options.ncbi_dataframe_parquet), compact=False)
+
+    def _retrying(self, read, attempts=3):
+        # a compaction in another process can remove a fragment between listing it and reading it (discovery
+        # reads a fragment's schema too), and the compacted fragment holds the same rows, so it's listed again
+        for attempt in range(attempts):
+            try:
+                return read()
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+    def _fragments(self, buckets=None):
+        def listed():
+            dataset = self._dataset()
+            if dataset is None:
+                return []
+            partition_filter = None if buckets is None else ds.field('bucket').isin(sorted({int(x) for x in buckets}))
+            return list(dataset.get_fragments(filter=partition_filter))
+        return self._retrying(listed)
+
+    def _latest_rows(self, dataframe:pd.DataFrame):
+        if len(dataframe) == 0:
+            return dataframe
+        latest = dataframe.groupby('rsid')['_order'].transform('max')
+        return dataframe[dataframe['_order'] == latest]
+
+    def _read_fragments(self, fragments, rsids=None):
+        row_filter = None if rsids is None else ds.field('rsid').isin(list(rsids))
+        frames = []
+        for fragment in fragments:
+            frame = fragment.to_table(filter=row_filter).to_pandas()
+            frame['_order'] = self._fragment_order(fragment.path)
+            frames.append(frame)
+        if len(frames) == 0:
+            return None
+        dataframe = self._latest_rows(pd.concat(frames))
+        dataframe = dataframe.sort_values(by='_order', kind='stable').drop(columns='_order')
+        return with_rsid_key(dataframe.drop(columns='rsid_key', errors='ignore'))
+
+    def _read_fragment_tables(self, fragments, rsids=None):
+        # _read_fragments without pandas: the newest fragment's rows for each rsid, in fragment then key order
+        row_filter = None if rsids is None else ds.field('rsid').isin(list(rsids))
+        tables, orders = [], []
+        for fragment in fragments:
+            table = fragment.to_table(filter=row_filter)
+            table = table.drop([x for x in table.column_names if x.startswith('__index_level_') or x in ['rsid_key', 'bucket']])
+            tables.append(table.replace_schema_metadata(None))
+            orders.append(np.full(table.num_rows, self._fragment_order(fragment.path), dtype=np.int64))
+        if len(tables) == 0:
+            return None
+        table = pa.concat_tables(tables, promote=True)
+        orders = np.concatenate(orders)
+        keys = rsid_to_key(table['rsid'])
+        _, groups = np.unique(keys, return_inverse=True)
+        latest = np.zeros(groups.max() + 1 if len(groups) > 0 else 0, dtype=np.int64)
+        np.maximum.at(latest, groups, orders)
+        kept = np.flatnonzero(orders == latest[groups])
+        kept = kept[np.lexsort((kept, orders[kept], keys[kept]))]
+        return table.take(kept).append_column('rsid_key', pa.array(keys[kept], pa.int64()))
+
+    def version(self):
+        # fragment names are unique per write, so the listing changes whenever the data does. A plain
+        # directory listing keeps the check cheap on a cached run.
+        names = sorted(os.path.join(os.path.basename(folder), file) for folder, _, files in os.walk(self.root) 
+                       for file in files if file.endswith('.parquet') and not file.startswith('.'))
+        return hashlib.sha256('\n'.join(names).encode()).hexdigest()
+
+    def _listed_and_read(self, read_fragments, rsids=None):
+        self._import_legacy_parquet()
+        if rsids is None:
+            return self._retrying(lambda: read_fragments(self._fragments()))
+        rsids = pd.Series(list(rsids), dtype=object).drop_duplicates()
+        rsids = rsids[rsids.str.startswith('rs')]
+        if len(rsids) == 0:
+            return None
+        return self._retrying(lambda: read_fragments(self._fragments(self._buckets(rsids).unique()), rsids.tolist()))
+
+    def read(self, rsids=None):
+        return self._listed_and_read(self._read_fragments, rsids)
+
+    def is_empty(self):
+        # nothing generated yet, without listing or reading fragments
+        return (not self._has_fragments()) and (not os.path.exists(self._options.ncbi_dataframe_parquet))
+
+    def read_public_table(self):
+        # the pre-processed table shipped in data/, in the same shape read_table gives
+        public = pq.read_table(self._options.public_ncbi_dataframe_parquet)
+        return table_with_rsid_key(public.drop([x for x in public.column_names if x.startswith('__index_level_')]).replace_schema_metadata(None))
+
+    def read_table(self, rsids=None):
+        return self._listed_and_read(self._read_fragment_tables, rsids)
+
+    def append(self, dataframe:pd.DataFrame, compact=True):
+        if (dataframe is None) or (len(dataframe) == 0):
+            return
+        buckets = self._buckets(dataframe['rsid'])
+        for bucket, frame in dataframe.drop(columns='rsid_key', errors='ignore').groupby(buckets):
+            self._write_fragment(bucket, pa.Table.from_pandas(frame, preserve_index=True))
+        if compact:
+            self.compact(buckets.unique())
+
+    def compact(self, buckets=None, threshold=None):
+        threshold = threshold or self.compaction_threshold
+        by_bucket = {}
+        for fragment in self._fragments(buckets):
+            by_bucket.setdefault(os.path.dirname(fragment.path), []).append(fragment)
+
+        for folder, fragments in by_bucket.items():
+            if len(fragments) < threshold:
+                continue
+            bucket = int(os.path.basename(folder).split('=')[1])
+            # one process compacts a bucket at a time, and lists it again once it has the lock since another may
+            # have compacted it meanwhile
+            with file_lock(folder):
+                fragments = self._fragments([bucket])
+                if len(fragments) < threshold:
+                    continue
+                dataframe = self._read_fragments(fragments)
+                order = max(self._fragment_order(x.path) for x in fragments) + 1
+                self._write_fragment(bucket, pa.Table.from_pandas(dataframe.drop(columns='rsid_key'), preserve_index=True), order)
+                # only the fragments that went into the compacted file are removed, anything appended meanwhile stays
+                for fragment in fragments:
+                    os.remove(fragment.path)
@@ -0,0 +1,143 @@
+from ..common import Options, Instrumentation, write_json, is_intact
+from .refsnp_store import RefSnpStore
+import json, time, random
+import asyncio, threading
+from tqdm import tqdm
+from dependency_injector.wiring import Provide
+
+class TokenBucket:
+    def __init__(self, rate:float, capacity:float=1):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+class RefSnpAsyncDownloader:
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, 
+                 options:Options = Provide['Options'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._options = options
+        self._refsnp_store = refsnp_store
+        self._instrumentation = instrumentation
+
+    def load_failures(self):
+        # a list torn by a crash is started over, the rsids on it are retried anyway
+        if not is_intact(self._options.ncbi_download_failures):
+            return {}
+        with open(self._options.ncbi_download_failures, 'r') as f:
+            return json.loads(f.read())
+
+    def _save_failures(self, failures):
+        write_json(self._options.ncbi_download_failures, failures, indent=1)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(60, 2 ** attempt) + random.random()
+
+    async def _fetch(self, session:'aiohttp.ClientSession', limiter:TokenBucket, rsid):
+        import aiohttp
+        url = f'{self._options.ncbi_refsnp_url}{int(rsid.replace("rs", ""))}'
+        error = None
+        for attempt in range(self._options.ncbi_request_retries + 1):
+            await limiter.acquire()
+            if attempt > 0:
+                self._instrumentation.count('http.retries')
+            self._instrumentation.count('http.requests')
+            try:
+                async with session.get(url) as response:
+                    self._instrumentation.count(f'http.status.{response.status}')
+                    if response.status == 200:
+                        content = await response.read()
+                        self._refsnp_store.put(rsid, content)
+                        return None
+                    error = f'HTTP {response.status}'
+                    if response.status not in self.retry_statuses:
+                        return error
+                    retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._instrumentation.count('http.errors')
+                error = f'{type(e).__name__}: {e}'
+                retry_after = None
+            if attempt < self._options.ncbi_request_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        return error
+
+    async def download_async(self, rsids, show_progress=True, refetch=False):
+        # only the rsids the store doesn't hold yet, or with refetch every one of them again, replacing what's stored
+        rsids = list(dict.fromkeys(rsids)) if refetch else self._refsnp_store.missing(dict.fromkeys(rsids))
+        failures = self.load_failures()
+        summary = {'requested': len(rsids), 'downloaded': 0, 'failed': 0}
+        if len(rsids) == 0:
+            return summary
+
+        # aiohttp is only imported once there's something to fetch, it's a slow import
+        import aiohttp
+        limiter = TokenBucket(self._options.ncbi_requests_per_second)
+        semaphore = asyncio.Semaphore(self._options.ncbi_max_concurrent_requests)
+        timeout = aiohttp.ClientTimeout(total=self._options.ncbi_request_timeout)
+        connector = aiohttp.TCPConnector(limit=self._options.ncbi_max_concurrent_requests)
+
+        async def worker(session, rsid):
+            async with semaphore:
+                return rsid, await self._fetch(session, limiter, rsid)
+
+        progress = tqdm(total=len(rsids), disable=not show_progress)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            pending = [asyncio.ensure_future(worker(session, rsid)) for rsid in rsids]
+            try:
+                for i, task in enumerate(asyncio.as_completed(pending)):
+                    rsid, error = await task
+                    if error is None:
+                        summary['downloaded'] += 1
+                        failures.pop(rsid, None)
+                    else:
+                        summary['failed'] += 1
+                        attempts = failures.get(rsid, {}).get('attempts', 0) + 1
+                        failures[rsid] = {'error': error, 'attempts': attempts, 'time': time.time()}
+                    progress.update(1)
+                    # flushed as we go so an interrupted run still leaves an accurate list behind
+                    if i % 100 == 0:
+                        self._save_failures(failures)
+            finally:
+                for task in pending:
+                    task.cancel()
+                progress.close()
+                self._save_failures(failures)
+        return summary
+
+    def download(self, rsids, show_progress=True, refetch=False):
+        coroutine = self.download_async(rsids, show_progress, refetch)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # already inside an event loop (e.g. a notebook), so run on a loop of our own
+        result = {}
+        def run():
+            result['value'] = asyncio.run(coroutine)
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return result['value']
@@ -0,0 +1,106 @@
+from ..common import Options, Instrumentation
+from .refsnp_parser import RefSnpParser
+from .refsnp_store import RefSnpStore
+import os, json, zlib, itertools, collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dependency_injector.wiring import Provide
+
+_parser = RefSnpParser()
+
+def _parse_batch(items):
+    # Runs wherever the backend puts it, so it gets the compressed documents rather than a store to
+    # read them from, and hands back one columnar partial, the (rsid, rsid it was merged into) pairs it
+    # came across, where each document is placed and how many documents it went through.
+    documents, merged = [], []
+    for rsid, data in items:
+        json_data = json.loads(zlib.decompress(data))
+        merged_into = json_data.get('merged_snapshot_data', {}).get('merged_into', [])
+        if len(merged_into) > 0:
+            merged.append((rsid, f'rs{merged_into[0]}'))
+        else:
+            documents.append((rsid, json_data))
+    return _parser.parse_many(documents), merged, _parser.parse_placements(documents), len(items)
+
+class RefSnpParseExecutor:
+    backends = ['auto', 'serial', 'thread', 'process']
+
+    def __init__(self,
+                 options:Options = Provide['Options'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._options = options
+        self._refsnp_store = refsnp_store
+        self._instrumentation = instrumentation
+        self._client = None
+        self._client_address = None
+
+    def _workers(self):
+        return self._options.ncbi_parse_workers or os.cpu_count() or 1
+
+    def _backend(self, batch_count):
+        backend = self._options.ncbi_parse_backend
+        if backend == 'auto':
+            return 'process' if (self._workers() > 1) and (batch_count > 1) else 'serial'
+        if (backend not in self.backends) and ('://' not in backend):
+            raise Exception(f'Unknown NCBI parse backend {backend}, expected one of {", ".join(self.backends)} or a dask scheduler address.')
+        return backend
+
+    def _batches(self, rsids):
+        documents = self._refsnp_store.get_many_compressed(rsids)
+        while True:
+            batch = list(itertools.islice(documents, self._options.ncbi_parse_batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
+
+    def _dask_client(self, address):
+        # connecting is the expensive part, so the client is kept for every later call against the same cluster
+        if (self._client is None) or (self._client_address != address):
+            from distributed import Client
+            if self._client is not None:
+                self._client.close()
+            self._client = Client(address)
+            self._client_address = address
+        return self._client
+
+    def _map(self, submit, batches, window):
+        # only a few batches are in flight at once, so the documents are never all read into memory
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(submit(batch))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+    def _results(self, backend, batches):
+        if backend == 'serial':
+            yield from map(_parse_batch, batches)
+            return
+        window = self._workers() * 2
+        if '://' in backend:
+            client = self._dask_client(backend)
+            yield from self._map(lambda batch: client.submit(_parse_batch, batch, pure=False), batches, window)
+            return
+        executor_type = ThreadPoolExecutor if backend == 'thread' else ProcessPoolExecutor
+        with executor_type(max_workers=self._workers()) as executor:
+            yield from self._map(lambda batch: executor.submit(_parse_batch, batch), batches, window)
+
+    def parse(self, rsids, progress=None):
+        batch_count = -(-len(rsids) // self._options.ncbi_parse_batch_size)
+        backend = self._backend(batch_count)
+        partials, merged, placements = [], [], []
+        for partial, batch_merged, batch_placements, documents in self._results(backend, self._batches(rsids)):
+            partials.append(partial)
+            merged.extend(batch_merged)
+            placements.extend(batch_placements)
+            if progress is not None:
+                progress.update(documents)
+        self._instrumentation.count('ncbi.parse_batches', len(partials))
+        return partials, merged, placements
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._client_address = None
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+
+class RefSnpParser:
+    columns = ['variant_type','description','deleted','inserted','allele_count','total_count','observed_frequency','diseases','significances','submissions','gene_locus','gene_name','rsid']
+    intcolumns = ['submissions','total_count','allele_count']
+    floatcolumns = ['observed_frequency']
+
+    # Mirrors the per-rsid pandas parser in benchmarks/legacy_refsnp_parser.py row for row, but with plain
+    # tuples and dicts so nothing is built per rsid except the rows themselves.
+
+    def _get_variant_description(self, deleted, inserted):
+        if deleted == inserted:
+            return 'std','std',deleted, inserted
+        if deleted.startswith(inserted):
+            del_value = deleted[len(inserted):]
+            return 'del', 'del' + del_value, del_value, ''
+
+        elif inserted.startswith(deleted):
+            new_alleles = inserted[len(deleted):]
+            if deleted.endswith(new_alleles):
+                return 'dup', 'dup' + new_alleles, '', new_alleles
+            else:
+                return 'ins', 'ins' + new_alleles, '', new_alleles
+        elif (len(deleted) == 1) and (len(inserted) == 1):
+            return 'snv', f'{deleted}>{inserted}', deleted, inserted
+        return 'unknown', 'unknown', deleted, inserted
+
+    def _sum_by_key(self, rows):
+        totals = {}
+        for key, allele_count, total_count in rows:
+            current = totals.get(key, (0, 0))
+            totals[key] = (current[0] + allele_count, current[1] + total_count)
+        return {key:totals[key] for key in sorted(totals)}
+
+    def _duplication_reduction(self, frequency_table):
+        if len(frequency_table) < 2:
+            return frequency_table
+        variant_types = {key[0] for key in frequency_table}
+        if ('ins' in variant_types) and ('dup' in variant_types):
+            if len({(key[3], key[2]) for key in frequency_table}) == 1:
+                allele_count = sum(x[0] for x in frequency_table.values())
+                total_count = sum(x[1] for x in frequency_table.values())
+                return {key:(allele_count, total_count) for key in frequency_table if key[0] == 'dup'}
+        return frequency_table
+
+    def _merge_standard(self, frequency_table):
+        num_std = sum(1 for key in frequency_table if key[0] == 'std')
+        if num_std < 2:
+            return frequency_table
+
+        keys = list(frequency_table)
+        # same (quicksort) ordering sort_values(by='lengths') used, so ties resolve identically
+        lengths = np.array([len(key[2]) for key in keys])
+        short_text = keys[np.argsort(lengths, kind='quicksort')[0]][2]
+        rows = []
+        for key in keys:
+            allele_count, total_count = frequency_table[key]
+            if short_text in key[2]:
+                key = (key[0], key[1], short_text, short_text)
+            rows.append((key, allele_count, total_count))
+        return self._sum_by_key(rows)
+
+    def _process_frequencies(self, frequencies):
+        rows = []
+        for frequency in frequencies:
+            observation = frequency['observation']
+            key = self._get_variant_description(observation['deleted_sequence'], observation['inserted_sequence'])
+            rows.append((key, frequency['allele_count'], frequency['total_count']))
+        frequency_table = self._sum_by_key(rows)
+        frequency_table = self._duplication_reduction(frequency_table)
+        frequency_table = self._merge_standard(frequency_table)
+        return frequency_table
+
+    def _process_assembly_annotations(self, assembly_annotations, placements_with_allele):
+        unique_deleted_and_inserted = {(x['allele']['spdi']['deleted_sequence'],x['allele']['spdi']['inserted_sequence'],x['hgvs'].endswith('=')) for p in placements_with_allele if p['is_ptlp'] for x in p['alleles']}
+        if len(assembly_annotations) == 0:
+            return []
+        return [self._get_variant_description(d,i) + (std,) for d,i,std in unique_deleted_and_inserted]
+
+    def _process_allele_annotation(self, allele_annotation, placements_with_allele, unique_rows:dict):
+        assembly_rows = self._process_assembly_annotations(allele_annotation['assembly_annotation'], placements_with_allele)
+        if len(allele_annotation['frequency']) > 0:
+            frequency_table = self._process_frequencies(allele_annotation['frequency'])
+            is_ref_by_key = {}
+            for row in assembly_rows:
+                is_ref_by_key.setdefault(row[:4], []).append(row[4])
+            for key, counts in frequency_table.items():
+                # an unmatched right-merge row has no is_ref, and groupby drops it later
+                for is_ref in is_ref_by_key.get(key, []):
+                    unique_rows[key + (is_ref,) + counts] = None
+        else:
+            for row in assembly_rows:
+                unique_rows[row + (0, 0)] = None
+
+    def parse_rows(self, json_data):
+        primary_snapshot_data = json_data.get('primary_snapshot_data')
+        if primary_snapshot_data is None:
+            return []
+        allele_annotations = primary_snapshot_data.get('allele_annotations')
+        if (allele_annotations is None) or (len(allele_annotations) == 0):
+            return []
+        placements_with_allele = primary_snapshot_data['placements_with_allele']
+        if len(placements_with_allele) == 0:
+            return []
+
+        unique_rows = {}
+        for allele_annotation in allele_annotations:
+            self._process_allele_annotation(allele_annotation, placements_with_allele, unique_rows)
+        grouped = self._sum_by_key([(row[:5],) + row[5:] for row in unique_rows])
+        if len(grouped) == 0:
+            return []
+
+        diseases = ', '.join({disease_name for allele_annotation in allele_annotations for clinical in allele_annotation['clinical'] for disease_name in clinical['disease_names'] if disease_name not in ['not_provided','not_specified']})
+        significances = ', '.join({sig for allele_annotation in allele_annotations for clinical in allele_annotation['clinical'] for sig in clinical['clinical_significances']})
+        loci = ', '.join({gene['locus'] for allele_annotation in allele_annotations for assembly_annotation in allele_annotation['assembly_annotation'] for gene in assembly_annotation['genes']})
+        names = ', '.join({gene['name'] for allele_annotation in allele_annotations for assembly_annotation in allele_annotation['assembly_annotation'] for gene in assembly_annotation['genes']})
+        submission_count = len([sub for allele_annotation in allele_annotations for sub in allele_annotation['submissions']])
+
+        rows = []
+        for (variant_type, description, deleted, inserted, is_ref), (allele_count, total_count) in grouped.items():
+            row_diseases, row_significances = ('', '') if is_ref else (diseases, significances)
+            rows.append((variant_type, description, deleted, inserted, allele_count, total_count, row_diseases, row_significances, submission_count, loci, names))
+        return rows
+
+    def _placement_chromosome(self, seq_id:str):
+        # refseq chromosomes NC_000001 to NC_000024 are 1 to 22, X and Y, and NC_012920 is the mitochondrion
+        accession = seq_id.split('.')[0]
+        if accession == 'NC_012920':
+            return 'MT'
+        if not accession.startswith('NC_0000'):
+            return None
+        number = int(accession[3:])
+        if (number < 1) or (number > 24):
+            return None
+        return {23: 'X', 24: 'Y'}.get(number, str(number))
+
+    def placement(self, json_data):
+        # chromosome and the first and last reference base (1-based) of the primary top level placement, which is GRCh38
+        primary_snapshot_data = json_data.get('primary_snapshot_data')
+        if primary_snapshot_data is None:
+            return None
+        for placement in primary_snapshot_data.get('placements_with_allele', []):
+            if not placement.get('is_ptlp'):
+                continue
+            chromosome = self._placement_chromosome(placement['seq_id'])
+            spdis = [x['allele']['spdi'] for x in placement['alleles']]
+            if (chromosome is None) or (len(spdis) == 0):
+                return None
+            start = min(x['position'] for x in spdis) + 1
+            end = max(x['position'] + len(x['deleted_sequence']) for x in spdis)
+            return chromosome, start, max(start, end)
+        return None
+
+    def parse_placements(self, items):
+        # (rsid, chromosome, start, end) for every document with a placement
+        placements = []
+        for rsid, json_data in items:
+            placement = None if json_data is None else self.placement(json_data)
+            if placement is not None:
+                placements.append((rsid,) + placement)
+        return placements
+
+    def parse_many(self, items):
+        columns = {x:[] for x in self.columns if x != 'observed_frequency'}
+        row_numbers = []
+        names = [x for x in self.columns if x not in ['observed_frequency', 'rsid']]
+        for rsid, json_data in items:
+            if json_data is None:
+                continue
+            rows = self.parse_rows(json_data)
+            for row in rows:
+                for name, value in zip(names, row):
+                    columns[name].append(value)
+            columns['rsid'].extend([rsid] * len(rows))
+            row_numbers.extend(range(len(rows)))
+
+        allele_count = np.array(columns['allele_count'], dtype=np.int64)
+        total_count = np.array(columns['total_count'], dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            observed_frequency = allele_count / total_count
+        observed_frequency[np.isnan(observed_frequency)] = 0.0
+
+        data = {}
+        for name in self.columns:
+            if name == 'observed_frequency':
+                data[name] = observed_frequency
+            elif name in self.intcolumns:
+                data[name] = np.array(columns[name], dtype=np.int64)
+            else:
+                data[name] = np.array(columns[name], dtype=object)
+        return pd.DataFrame(data, index=pd.Index(row_numbers, dtype=np.int64))
@@ -0,0 +1,285 @@
+from ..common import Options, key_to_rsid, isin_sorted
+import os, json, zlib, time, hashlib
+import sqlite3, threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from dependency_injector.wiring import Provide
+
+class RefSnpStore:
+    batch_size = 500
+    max_alias_depth = 10
+
+    def __init__(self, options:Options = Provide['Options']):
+        self._options = options
+        self._local = threading.local()
+        self._alias_arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_local'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _rsid_number(self, rsid):
+        if isinstance(rsid, str):
+            return int(rsid.replace('rs', ''))
+        return int(rsid)
+
+    def _create(self, connection:sqlite3.Connection):
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        # fetched_at is when the document was downloaded and sha256 the hash of its json, which a refresh compares
+        # to tell a refetched document that changed from one that didn't
+        connection.execute('CREATE TABLE IF NOT EXISTS refsnp (rsid INTEGER PRIMARY KEY, data BLOB NOT NULL, fetched_at REAL, sha256 TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)')
+        # retired rsid -> the rsid it was merged into, as the retired rsid's document said
+        connection.execute('CREATE TABLE IF NOT EXISTS alias (rsid INTEGER PRIMARY KEY, current INTEGER NOT NULL)')
+        # where the document's primary top level placement puts the rsid, first and last reference base
+        connection.execute('CREATE TABLE IF NOT EXISTS placement (rsid INTEGER PRIMARY KEY, chromosome TEXT NOT NULL, start INTEGER NOT NULL, stop INTEGER NOT NULL)')
+        connection.commit()
+        self._migrate(connection)
+        connection.execute('CREATE INDEX IF NOT EXISTS refsnp_fetched_at ON refsnp (fetched_at)')
+        connection.commit()
+
+    def _migrate(self, connection:sqlite3.Connection):
+        # A store from before fetch times were kept gets the columns, and its documents count as fetched now.
+        # Their real age isn't known, and counting them as stale would refetch the whole store on the first
+        # refresh. Their hash stays empty, so a refetch of one always counts as a change.
+        if 'fetched_at' in {row[1] for row in connection.execute('PRAGMA table_info(refsnp)')}:
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # another process may have migrated it while this one waited for the write lock
+            if 'fetched_at' not in {row[1] for row in connection.execute('PRAGMA table_info(refsnp)')}:
+                connection.execute('ALTER TABLE refsnp ADD COLUMN fetched_at REAL')
+                connection.execute('ALTER TABLE refsnp ADD COLUMN sha256 TEXT')
+                connection.execute('UPDATE refsnp SET fetched_at = ?', (time.time(),))
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't cross threads or forks, so each gets its own
+        connection = getattr(self._local, 'connection', None)
+        if (connection is None) or (self._local.pid != os.getpid()):
+            connection = sqlite3.connect(self._options.ncbi_data_store, timeout=60)
+            self._create(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            self._import_legacy_cache()
+        return connection
+
+    def _import_legacy_cache(self):
+        connection = self._local.connection
+        imported = connection.execute("SELECT value FROM metadata WHERE key = 'legacy_cache_imported'").fetchone()
+        if imported is not None:
+            return
+        self.import_directory(self._options.ncbi_data_cache)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('legacy_cache_imported', '1')")
+
+    def _chunks(self, values):
+        for i in range(0, len(values), self.batch_size):
+            yield values[i:i + self.batch_size]
+
+    def contains(self, rsid):
+        row = self._connection().execute('SELECT 1 FROM refsnp WHERE rsid = ?', (self._rsid_number(rsid),)).fetchone()
+        return row is not None
+
+    def existing(self, rsids):
+        rsids = list(rsids)
+        numbers = [self._rsid_number(x) for x in rsids]
+        connection = self._connection()
+        found = set()
+        for chunk in self._chunks(sorted(set(numbers))):
+            query = f'SELECT rsid FROM refsnp WHERE rsid IN ({",".join("?" * len(chunk))})'
+            found.update(row[0] for row in connection.execute(query, chunk))
+        return {rsid for rsid, number in zip(rsids, numbers) if number in found}
+
+    def missing(self, rsids):
+        rsids = list(rsids)
+        existing = self.existing(rsids)
+        return [x for x in rsids if x not in existing]
+
+    def all_rsids(self):
+        return [f'rs{row[0]}' for row in self._connection().execute('SELECT rsid FROM refsnp ORDER BY rsid')]
+
+    def put(self, rsid, content:bytes):
+        self.put_many([(rsid, content)])
+
+    def _put_fetched(self, items):
+        # items are (rsid, json bytes, when it was fetched)
+        connection = self._connection()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO refsnp (rsid, data, fetched_at, sha256) VALUES (?, ?, ?, ?)',
+                                   ((self._rsid_number(rsid), zlib.compress(content), fetched_at, hashlib.sha256(content).hexdigest())
+                                    for rsid, content, fetched_at in items))
+
+    def put_many(self, items):
+        fetched_at = time.time()
+        self._put_fetched((rsid, content, fetched_at) for rsid, content in items)
+
+    def stale(self, max_age_seconds, rsids=None):
+        # rsids whose documents were fetched longer than max_age_seconds ago, in key order
+        cutoff = time.time() - max_age_seconds
+        connection = self._connection()
+        if rsids is None:
+            rows = connection.execute('SELECT rsid FROM refsnp WHERE fetched_at IS NULL OR fetched_at < ? ORDER BY rsid', (cutoff,)).fetchall()
+        else:
+            rows = []
+            for chunk in self._chunks(sorted({self._rsid_number(x) for x in rsids})):
+                query = f'SELECT rsid FROM refsnp WHERE rsid IN ({",".join("?" * len(chunk))}) AND (fetched_at IS NULL OR fetched_at < ?) ORDER BY rsid'
+                rows.extend(connection.execute(query, chunk + [cutoff]))
+        return [f'rs{row[0]}' for row in rows]
+
+    def fetch_info(self, rsids) -> pd.DataFrame:
+        # when each stored document was fetched and the hash of its json, missing rsids left out
+        connection = self._connection()
+        rows = []
+        for chunk in self._chunks(sorted({self._rsid_number(x) for x in rsids})):
+            query = f'SELECT rsid, fetched_at, sha256 FROM refsnp WHERE rsid IN ({",".join("?" * len(chunk))}) ORDER BY rsid'
+            rows.extend(connection.execute(query, chunk))
+        result = pd.DataFrame(rows, columns=['rsid_key', 'fetched_at', 'sha256'])
+        return result.astype({'rsid_key': np.int64, 'fetched_at': np.float64, 'sha256': object})
+
+    def get(self, rsid):
+        row = self._connection().execute('SELECT data FROM refsnp WHERE rsid = ?', (self._rsid_number(rsid),)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def get_many_compressed(self, rsids):
+        # rsids come back in key order so a cold read walks the file sequentially
+        connection = self._connection()
+        numbers = sorted({self._rsid_number(x) for x in rsids})
+        for chunk in self._chunks(numbers):
+            query = f'SELECT rsid, data FROM refsnp WHERE rsid IN ({",".join("?" * len(chunk))}) ORDER BY rsid'
+            for number, data in connection.execute(query, chunk):
+                yield f'rs{number}', data
+
+    def get_many(self, rsids):
+        for rsid, data in self.get_many_compressed(rsids):
+            yield rsid, json.loads(zlib.decompress(data))
+
+    def put_aliases(self, items):
+        connection = self._connection()
+        with connection:
+            changes = connection.total_changes
+            # an unchanged alias isn't written, so the version only moves when the map does
+            connection.executemany('INSERT INTO alias (rsid, current) VALUES (?, ?) ON CONFLICT (rsid) DO UPDATE SET current = excluded.current WHERE current != excluded.current',
+                                   ((self._rsid_number(rsid), self._rsid_number(current)) for rsid, current in items))
+            if connection.total_changes > changes:
+                connection.execute("INSERT INTO metadata (key, value) VALUES ('alias_version', '1') ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def put_placements(self, items):
+        connection = self._connection()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO placement (rsid, chromosome, start, stop) VALUES (?, ?, ?, ?)',
+                                   ((self._rsid_number(rsid), chromosome, start, stop) for rsid, chromosome, start, stop in items))
+
+    def get_placements(self, rsids=None) -> pd.DataFrame:
+        connection = self._connection()
+        if rsids is None:
+            rows = connection.execute('SELECT rsid, chromosome, start, stop FROM placement ORDER BY rsid').fetchall()
+        else:
+            rows = []
+            for chunk in self._chunks(sorted({self._rsid_number(x) for x in rsids})):
+                query = f'SELECT rsid, chromosome, start, stop FROM placement WHERE rsid IN ({",".join("?" * len(chunk))}) ORDER BY rsid'
+                rows.extend(connection.execute(query, chunk))
+        result = pd.DataFrame(rows, columns=['rsid_key', 'chromosome', 'start', 'stop'])
+        return result.astype({'rsid_key': np.int64, 'chromosome': object, 'start': np.int64, 'stop': np.int64})
+
+    def alias_version(self):
+        row = self._connection().execute("SELECT value FROM metadata WHERE key = 'alias_version'").fetchone()
+        return 0 if row is None else int(row[0])
+
+    def _aliases(self):
+        # the whole map as sorted arrays, with chains already followed to the end, reloaded when the version moves
+        version = self.alias_version()
+        if (self._alias_arrays is None) or (self._alias_arrays[0] != version):
+            rows = np.array(self._connection().execute('SELECT rsid, current FROM alias ORDER BY rsid').fetchall(), dtype=np.int64).reshape(-1, 2)
+            retired, current = rows[:, 0].copy(), rows[:, 1].copy()
+            for _ in range(self.max_alias_depth if len(retired) > 0 else 0):
+                positions = np.minimum(np.searchsorted(retired, current), len(retired) - 1)
+                chained = retired[positions] == current
+                if not chained.any():
+                    break
+                current = np.where(chained, current[positions], current)
+            self._alias_arrays = (version, retired, current)
+        return self._alias_arrays[1], self._alias_arrays[2]
+
+    def canonical_keys(self, keys) -> np.ndarray:
+        keys = np.asarray(keys, dtype=np.int64)
+        retired, current = self._aliases()
+        if len(retired) == 0:
+            return keys
+        # a hash lookup finds the few retired keys, only those are searched for in the sorted map
+        aliased = np.flatnonzero(pc.is_in(pa.array(keys), value_set=pa.array(retired)).to_numpy(zero_copy_only=False))
+        if len(aliased) == 0:
+            return keys
+        result = keys.copy()
+        result[aliased] = current[np.searchsorted(retired, keys[aliased])]
+        return result
+
+    def retired_keys(self, keys) -> np.ndarray:
+        # the retired keys the alias map sends to any of these (sorted) keys
+        retired, current = self._aliases()
+        return np.sort(retired[isin_sorted(current, np.asarray(keys, dtype=np.int64))])
+
+    def canonical_rsids(self, rsids):
+        rsids = list(rsids)
+        numbers = self.canonical_keys([self._rsid_number(x) for x in rsids])
+        return [f'rs{number}' for number in numbers]
+
+    def canonicalize(self, dataframe:pd.DataFrame) -> pd.DataFrame:
+        # swaps retired rsids for the ones they were merged into, rsid_key included
+        keys = dataframe['rsid_key'].to_numpy()
+        canonical = self.canonical_keys(keys)
+        changed = canonical != keys
+        if not changed.any():
+            return dataframe
+        rsids = dataframe['rsid'].to_numpy(dtype=object).copy()
+        rsids[changed] = key_to_rsid(canonical[changed])
+        return dataframe.assign(rsid=rsids, rsid_key=canonical)
+
+    def canonicalize_table(self, table:pa.Table) -> pa.Table:
+        # canonicalize for an arrow table, only the changed rsids are built as new strings
+        keys = table['rsid_key'].to_numpy()
+        canonical = self.canonical_keys(keys)
+        changed = canonical != keys
+        if not changed.any():
+            return table
+        rsids = pc.replace_with_mask(table['rsid'].combine_chunks(), pa.array(changed), pa.array(key_to_rsid(canonical[changed]), pa.string()))
+        table = table.set_column(table.column_names.index('rsid'), 'rsid', rsids)
+        return table.set_column(table.column_names.index('rsid_key'), 'rsid_key', pa.array(canonical, pa.int64()))
+
+    def import_directory(self, directory, remove_files=False):
+        if not os.path.isdir(directory):
+            return 0
+        files = [x for x in os.listdir(directory) if x.startswith('rs') and x.endswith('.json')]
+        imported = 0
+        for chunk in self._chunks(files):
+            items = []
+            for file in chunk:
+                with open(os.path.join(directory, file), 'rb') as f:
+                    content = f.read()
+                    # the file was written when it was downloaded
+                    fetched_at = os.fstat(f.fileno()).st_mtime
+                try:
+                    json.loads(content)
+                except ValueError:
+                    # truncated download, let it be fetched again
+                    continue
+                items.append((file.replace('.json', ''), content, fetched_at))
+            self._put_fetched(items)
+            imported += len(items)
+        if remove_files:
+            for file in files:
+                os.remove(os.path.join(directory, file))
+        return imported
@@ -0,0 +1,268 @@
+from ..common import Options, Instrumentation, rsid_to_key, key_to_rsid, table_with_rsid_key, merge_tables_on_rsid_key, atomic_write, write_json, file_lock, is_intact
+from .ncbi_dataset import NCBIDataset
+from .refsnp_store import RefSnpStore
+from .refsnp_parser import RefSnpParser
+import os, re, json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pyarrow.ipc
+import natsort
+from dependency_injector.wiring import Provide
+
+def parse_region(region):
+    # 'chr17:43,000,000-43,200,000', '17:43000000-43200000', a whole chromosome ('chrX'), or (chromosome, start, end)
+    if isinstance(region, (tuple, list)):
+        chromosome, start, end = region
+    else:
+        match = re.fullmatch(r'(?:chr)?([0-9]+|[XYM]|MT)(?::([0-9,]+)-([0-9,]+))?', region.strip(), flags=re.IGNORECASE)
+        if match is None:
+            raise Exception(f'Unknown region {region}, expected chromosome:start-end such as chr17:43,000,000-43,200,000.')
+        chromosome = match.group(1)
+        start = 1 if match.group(2) is None else int(match.group(2).replace(',', ''))
+        end = np.iinfo(np.int64).max if match.group(3) is None else int(match.group(3).replace(',', ''))
+    chromosome = str(chromosome).upper().removeprefix('CHR')
+    return ('MT' if chromosome == 'M' else chromosome), int(start), int(end)
+
+class VariantIndex:
+    # Gene and disease postings (term -> the rsid keys annotated with it) and each chromosome's placements sorted
+    # by start, built from the NCBI dataset (or the shipped public table when that's the data in use) and the
+    # placements parsed alongside it, and kept on disk next to the dataset until the source's version moves. Placements are NCBI's primary top level ones, so regions asked
+    # of the reference are GRCh38; regions asked of a report use the report's own positions, which are the build
+    # the raw data was called on (GRCh37 for most 23andMe and Ancestry files).
+
+    # bump when a change alters what gets built, it forces a rebuild
+    version = 1
+
+    def __init__(self,
+                 options:Options = Provide['Options'],
+                 ncbi_dataset:NCBIDataset = Provide['NCBIDataset'],
+                 refsnp_store:RefSnpStore = Provide['RefSnpStore'],
+                 refsnp_parser:RefSnpParser = Provide['RefSnpParser'],
+                 instrumentation:Instrumentation = Provide['Instrumentation']):
+        self._options = options
+        self._ncbi_dataset = ncbi_dataset
+        self._refsnp_store = refsnp_store
+        self._refsnp_parser = refsnp_parser
+        self._instrumentation = instrumentation
+        self._loaded = None
+
+    def _path(self, name):
+        return os.path.join(self._options.ncbi_index_folder, name)
+
+    def _uses_public_data(self):
+        # the public table when the policy says so, or when nothing has been generated and the policy allows it,
+        # which is where answering Y at the prompt leaves the dataset
+        policy = self._options.public_ncbi_data_policy
+        if (policy == 'generate') or (not os.path.exists(self._options.public_ncbi_dataframe_parquet)):
+            return False
+        return (policy == 'public') or self._ncbi_dataset.is_empty()
+
+    def _source_version(self):
+        if self._uses_public_data():
+            stat = os.stat(self._options.public_ncbi_dataframe_parquet)
+            return f'{self.version}-public-{stat.st_size}-{stat.st_mtime_ns}'
+        return f'{self.version}-{self._ncbi_dataset.version()}'
+
+    def _built_version(self):
+        if not is_intact(self._path('index.json')):
+            return None
+        with open(self._path('index.json')) as f:
+            return json.load(f)['source']
+
+    def _write(self, name, table:pa.Table):
+        with atomic_write(self._path(name)) as temp_path:
+            pq.write_table(table, temp_path)
+
+    def _postings(self, table:pa.Table, column, upper=False):
+        # the comma joined annotation exploded to one (term, rsid key) pair per term and rsid
+        values = pc.fill_null(pc.cast(table[column].combine_chunks(), pa.string()), '')
+        split = pc.split_pattern(pc.utf8_upper(values) if upper else values, ', ')
+        postings = pd.DataFrame({
+            'term': pc.list_flatten(split).to_numpy(zero_copy_only=False),
+            'rsid_key': table['rsid_key'].to_numpy()[pc.list_parent_indices(split).to_numpy()],
+        })
+        postings = postings[postings['term'] != ''].drop_duplicates()
+        return pa.Table.from_pandas(postings.sort_values(by=['term', 'rsid_key']), preserve_index=False)
+
+    def _placements(self, keys:np.ndarray):
+        placements = self._refsnp_store.get_placements(key_to_rsid(keys))
+        missing = keys[~np.isin(keys, placements['rsid_key'].to_numpy())]
+        if len(missing) > 0:
+            # rows parsed before placements were kept, read once from their documents
+            with self._instrumentation.span('variant_index.placements', rows=len(missing)):
+                self._refsnp_store.put_placements(self._refsnp_parser.parse_placements(self._refsnp_store.get_many(key_to_rsid(missing))))
+            placements = self._refsnp_store.get_placements(key_to_rsid(keys))
+        return placements
+
+    def _placed(self, table:pa.Table, placements:pd.DataFrame):
+        # the dataset's rows, in key order, with the chromosome and position they're placed at, null where there's no placement
+        keys = table['rsid_key'].to_numpy()
+        placement_keys = placements['rsid_key'].to_numpy()
+        positions = np.minimum(np.searchsorted(placement_keys, keys), max(len(placement_keys) - 1, 0))
+        placed = (placement_keys[positions] == keys) if len(placement_keys) > 0 else np.zeros(len(keys), dtype=bool)
+        chromosomes = placements['chromosome'].to_numpy()[positions] if len(placement_keys) > 0 else np.full(len(keys), None)
+        starts = placements['start'].to_numpy()[positions] if len(placement_keys) > 0 else np.zeros(len(keys), dtype=np.int64)
+        table = table.append_column('chromosome', pa.array(np.where(placed, chromosomes, None), pa.string()))
+        return table.append_column('position', pa.array(starts, pa.int64(), mask=~placed))
+
+    def _regions(self, placements:pd.DataFrame):
+        placements = placements.iloc[np.argsort(placements['start'].to_numpy(), kind='stable')]
+        placements = placements.iloc[natsort.index_humansorted(placements['chromosome'])]
+        return pa.Table.from_pandas(placements, preserve_index=False)
+
+    def update(self, force=False):
+        # builds the index when the dataset has changed since the last build, nothing otherwise. One process
+        # builds it, another finding the same dataset version unbuilt waits for that build rather than repeating it.
+        source = self._source_version()
+        if (not force) and (self._built_version() == source):
+            return
+        with file_lock(self._path('index.json')):
+            if (not force) and (self._built_version() == source):
+                return
+            self._build(source)
+
+    def _build(self, source):
+        with self._instrumentation.span('variant_index.build') as span:
+            table = self._ncbi_dataset.read_public_table() if self._uses_public_data() else self._ncbi_dataset.read_table()
+            if table is None:
+                table = table_with_rsid_key(pa.Table.from_pandas(self._refsnp_parser.parse_many([]), preserve_index=False))
+            placements = self._placements(np.unique(table['rsid_key'].to_numpy()))
+            self._write('genes.parquet', self._postings(table, 'gene_locus', upper=True))
+            self._write('diseases.parquet', self._postings(table, 'diseases'))
+            self._write('placements.parquet', self._regions(placements))
+            # the rows themselves, memory mapped by queries so a lookup is a binary search and a take
+            table = self._placed(table, placements)
+            with atomic_write(self._path('reference.arrow')) as temp_path:
+                with pa.OSFile(temp_path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+            span.add_rows(table.num_rows)
+        # written last, a build that didn't finish is rebuilt next time
+        write_json(self._path('index.json'), {'source': source})
+
+    def _load_postings(self, name):
+        postings = pq.read_table(self._path(name))
+        terms = postings['term'].to_numpy(zero_copy_only=False)
+        unique, starts = np.unique(terms, return_index=True)
+        ends = np.append(starts[1:], len(terms))
+        keys = postings['rsid_key'].to_numpy()
+        return {x: (start, end) for x, start, end in zip(unique, starts, ends)}, keys
+
+    def _load_regions(self):
+        placements = pq.read_table(self._path('placements.parquet')).to_pandas()
+        regions = {}
+        for chromosome, frame in placements.groupby('chromosome', sort=False):
+            starts, stops = frame['start'].to_numpy(), frame['stop'].to_numpy()
+            # the longest placement bounds how far before a region a placement overlapping it can start
+            regions[chromosome] = (starts, stops, frame['rsid_key'].to_numpy(), int((stops - starts).max()))
+        return regions
+
+    def _index(self):
+        self.update()
+        if (self._loaded is not None) and (self._loaded['source'] == self._built_version()):
+            return self._loaded
+        # under the build's lock, so a build in another process can't replace some of the files halfway through the load
+        with file_lock(self._path('index.json')), self._instrumentation.span('variant_index.load'):
+            source = self._built_version()
+            if (self._loaded is None) or (self._loaded['source'] != source):
+                self._loaded = {
+                    'source': source,
+                    'genes': self._load_postings('genes.parquet'),
+                    'diseases': self._load_postings('diseases.parquet'),
+                    'regions': self._load_regions(),
+                    'reference': pa.ipc.open_file(pa.memory_map(self._path('reference.arrow'), 'r')).read_all(),
+                }
+        return self._loaded
+
+    def _gene_keys(self, index, genes):
+        postings, keys = index['genes']
+        found = [keys[slice(*postings[x.upper()])] for x in genes if x.upper() in postings]
+        return np.unique(np.concatenate(found)) if len(found) > 0 else np.zeros(0, dtype=np.int64)
+
+    def _disease_keys(self, index, keyword):
+        postings, keys = index['diseases']
+        names = [x for x in postings if keyword.lower() in x.lower()]
+        found = [keys[slice(*postings[x])] for x in names]
+        return np.unique(np.concatenate(found)) if len(found) > 0 else np.zeros(0, dtype=np.int64)
+
+    def _region_keys(self, index, region):
+        chromosome, start, end = parse_region(region)
+        if chromosome not in index['regions']:
+            return np.zeros(0, dtype=np.int64)
+        starts, stops, keys, longest = index['regions'][chromosome]
+        low = np.searchsorted(starts, max(start - longest, 0), side='left')
+        high = np.searchsorted(starts, end, side='right')
+        overlapping = stops[low:high] >= start
+        return np.unique(keys[low:high][overlapping])
+
+    def _matching_keys(self, index, genes=None, disease=None, region=None):
+        matches = []
+        if genes is not None:
+            matches.append(self._gene_keys(index, [genes] if isinstance(genes, str) else genes))
+        if disease is not None:
+            matches.append(self._disease_keys(index, disease))
+        if region is not None:
+            matches.append(self._region_keys(index, region))
+        if len(matches) == 0:
+            raise Exception('Pass genes, a disease keyword or a region to query by.')
+        result = matches[0]
+        for keys in matches[1:]:
+            result = np.intersect1d(result, keys)
+        return result
+
+    def rsid_keys(self, genes=None, disease=None, region=None) -> np.ndarray:
+        # sorted rsid keys annotated with any of the genes, with a disease containing the keyword, and placed in
+        # the region, for whichever of them are given
+        return self._matching_keys(self._index(), genes, disease, region)
+
+    def query_reference(self, genes=None, disease=None, region=None) -> pa.Table:
+        # the NCBI rows of the matching rsids with where they're placed, in chromosome and position order, and
+        # the rows of rsids without a placement last
+        index = self._index()
+        keys = self._matching_keys(index, genes, disease, region)
+        reference = index['reference']
+        table = merge_tables_on_rsid_key(pa.table({'rsid_key': pa.array(keys, pa.int64())}), reference).select(reference.column_names)
+        # chromosomes ranked once each rather than natsorting every row, unplaced rows rank past every chromosome
+        chromosomes = pc.unique(table['chromosome'].drop_null()).to_pylist()
+        ranks = np.empty(len(chromosomes) + 1, dtype=np.int64)
+        ranks[natsort.index_humansorted(chromosomes)] = np.arange(len(chromosomes))
+        ranks[-1] = len(chromosomes)
+        chromosome_rank = ranks[pc.fill_null(pc.index_in(table['chromosome'], value_set=pa.array(chromosomes, pa.string())), -1).to_numpy()]
+        return table.take(np.lexsort((pc.fill_null(table['position'], 0).to_numpy(), chromosome_rank)))
+
+    def _terms_matching(self, column, matches):
+        # the rows where any of the comma joined terms of column matches
+        split = pc.split_pattern(pc.fill_null(pc.cast(column, pa.string()), ''), ', ')
+        hits = pc.fill_null(matches(pc.list_flatten(split)), False).to_numpy(zero_copy_only=False)
+        keep = np.zeros(len(column), dtype=bool)
+        keep[pc.list_parent_indices(split).to_numpy()[hits]] = True
+        return pa.array(keep)
+
+    def query_table(self, table:pa.Table, genes=None, disease=None, region=None) -> pa.Table:
+        # the rows of a report (anything with rsid, chromosome and position columns) that match. Genes and
+        # diseases are matched against the report's own gene_locus and diseases columns, or through the postings
+        # for a report without them, and a region against the report's own positions.
+        keep = pa.array(np.ones(table.num_rows, dtype=bool))
+        if genes is not None:
+            genes = pa.array([x.upper() for x in ([genes] if isinstance(genes, str) else genes)], pa.string())
+            if 'gene_locus' in table.column_names:
+                keep = pc.and_(keep, self._terms_matching(table['gene_locus'], lambda terms: pc.is_in(pc.utf8_upper(terms), value_set=genes)))
+            else:
+                keys = self._matching_keys(self._index(), genes=genes.to_pylist())
+                keep = pc.and_(keep, pc.is_in(pa.array(rsid_to_key(table['rsid'])), value_set=pa.array(keys, pa.int64())))
+        if disease is not None:
+            if 'diseases' in table.column_names:
+                keep = pc.and_(keep, self._terms_matching(table['diseases'], lambda terms: pc.match_substring(pc.utf8_lower(terms), disease.lower())))
+            else:
+                keys = self._matching_keys(self._index(), disease=disease)
+                keep = pc.and_(keep, pc.is_in(pa.array(rsid_to_key(table['rsid'])), value_set=pa.array(keys, pa.int64())))
+        if region is not None:
+            chromosome, start, end = parse_region(region)
+            chromosomes = pc.utf8_upper(pc.cast(table['chromosome'], pa.string()))
+            positions = pc.cast(table['position'], pa.int64())
+            in_region = pc.and_(pc.equal(chromosomes, chromosome), pc.and_(pc.greater_equal(positions, start), pc.less_equal(positions, end)))
+            keep = pc.and_(keep, in_region)
+        return table.filter(keep)
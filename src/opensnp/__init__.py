@@ -0,0 +1 @@
+from .opensnp_frequency_pipeline import *
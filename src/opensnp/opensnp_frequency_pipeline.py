@@ -0,0 +1,248 @@
+from ..common import Options, Instrumentation, rsid_to_key, key_to_rsid, atomic_write, is_intact
+from ..file_readers import GeneticDataToDataFrameConverter, AncestryReader, TwentyThreeReader
+from ..analysis import GenotypeMatrix
+import os, re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from dependency_injector.wiring import Provide
+
+_worker_reader = None
+
+def _read_user_file(filename):
+    # runs in the pool's processes, which build their own reader rather than unpickling the container's
+    global _worker_reader
+    if _worker_reader is None:
+        _worker_reader = GeneticDataToDataFrameConverter(ancestry_reader=AncestryReader(), twenty_three_reader=TwentyThreeReader(),
+                                                         instrumentation=Instrumentation(options=Options()))
+    try:
+        dna = _worker_reader.read_data_streaming(filename, throw_on_error=True)
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+    if dna is None:
+        return None, 'no reader for this file'
+    # only what the matrix keeps goes back through the pipe, not the rsid strings
+    genome = pd.DataFrame({'rsid_key': rsid_to_key(dna['rsid']), 'chromosome': dna['chromosome'], 'position': dna['position'], 'alleles': dna['alleles']})
+    genome.attrs.update(dna.attrs)
+    return genome, None
+
+class OpenSnpFrequencyPipeline:
+    progress_columns = {'filename': str, 'user': 'int64', 'source': str, 'rows': 'int64', 'batch': 'int64', 'status': str, 'error': str}
+    # no-calls are spelled '--' by 23andMe and '00' by Ancestry, neither says anything about frequency
+    no_call_pattern = re.compile(r'^$|[-0]')
+    # counts are keyed rsid_key * genotype_slots + genotype id, so one sorted int64 array holds them
+    genotype_slots = 1 << 8
+
+    def __init__(self,
+                 options:Options = Provide['Options'],
+                 instrumentation:Instrumentation = Provide['Instrumentation'],
+                 genetic_data_reader:GeneticDataToDataFrameConverter = Provide['GeneticDataToDataFrameConverter']):
+        self._options = options
+        self._instrumentation = instrumentation
+        self._genetic_data_reader = genetic_data_reader
+
+    def list_user_files(self):
+        folder = self._options.opensnp_raw_data
+        if not os.path.exists(folder):
+            return []
+        result = []
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if self._genetic_data_reader.get_reader_version(path) is not None:
+                    result.append(os.path.relpath(path, folder))
+        return result
+
+    def load_progress(self):
+        path = self._options.opensnp_progress_dataframe_path
+        if not is_intact(path):
+            return pd.DataFrame({k: pd.Series([], dtype=v if v is not str else object) for k, v in self.progress_columns.items()})
+        return pd.read_parquet(path)
+
+    def _save_progress(self, progress:pd.DataFrame):
+        path = self._options.opensnp_progress_dataframe_path
+        with atomic_write(path) as temp_path:
+            progress.reset_index(drop=True).to_parquet(temp_path)
+
+    def batch_path(self, batch):
+        return os.path.join(self._options.combined_user_data_subset_directory, f'batch_{batch:05d}.gtm')
+
+    def _read_batch(self, executor, filenames):
+        folder = self._options.opensnp_raw_data
+        genomes, records = {}, []
+        with self._instrumentation.span('opensnp.read_batch') as span:
+            for filename, (genome, error) in zip(filenames, executor.map(_read_user_file, [os.path.join(folder, x) for x in filenames])):
+                if genome is None or len(genome) == 0:
+                    records.append({'filename': filename, 'user': self._genetic_data_reader.get_user_id(filename), 'source': None, 'rows': 0, 'batch': -1,
+                                    'status': 'failed', 'error': error or 'no rows'})
+                    self._instrumentation.count('opensnp.files_failed')
+                    continue
+                genomes[filename] = genome
+                records.append({'filename': filename, 'user': genome.attrs.get('user', 0), 'source': genome.attrs.get('source'),
+                                'rows': len(genome), 'batch': -1, 'status': 'done', 'error': None})
+                self._instrumentation.count('opensnp.files_read')
+                span.add_rows(len(genome))
+        return genomes, records
+
+    def build_subsets(self, filenames=None):
+        # Reads the files progress hasn't seen yet, batch_size genomes at a time, so memory is bounded by the batch
+        # and not the number of files. Each batch becomes one genotype matrix in the subsets folder, and is only
+        # marked done in the progress file once that matrix is on disk, so an interrupted run picks up where it left off.
+        filenames = self.list_user_files() if filenames is None else filenames
+        progress = self.load_progress()
+        seen = set(progress['filename'])
+        pending = [x for x in filenames if x not in seen]
+        if len(pending) == 0:
+            return []
+
+        batch_size = self._options.opensnp_batch_size
+        next_batch = int(progress['batch'].max()) + 1 if (progress['batch'] >= 0).any() else 0
+        print(f'Reading {len(pending)} openSNP files in batches of {batch_size}.')
+        written = []
+        with ProcessPoolExecutor(max_workers=self._options.opensnp_workers) as executor:
+            for start in range(0, len(pending), batch_size):
+                genomes, records = self._read_batch(executor, pending[start:start + batch_size])
+                if len(genomes) > 0:
+                    with self._instrumentation.span('opensnp.write_subset', rows=len(genomes)):
+                        GenotypeMatrix.from_dataframes(genomes).save(self.batch_path(next_batch))
+                    for record in records:
+                        if record['status'] == 'done':
+                            record['batch'] = next_batch
+                    written.append(next_batch)
+                    next_batch += 1
+                del genomes
+                progress = pd.concat([progress, pd.DataFrame(records).astype({'user': 'int64', 'rows': 'int64', 'batch': 'int64'})], ignore_index=True)
+                self._save_progress(progress)
+                print(f'{min(start + batch_size, len(pending))}/{len(pending)} files read.')
+        return written
+
+    def _canonical_genotypes(self, genotypes):
+        # arrays are unphased, so AG and GA are the same genotype
+        return [None if (x is None or self.no_call_pattern.search(x)) else ''.join(sorted(x)) for x in genotypes]
+
+    def _genotype_ids(self, genotypes, vocabulary:dict):
+        ids = []
+        for genotype in self._canonical_genotypes(genotypes):
+            if genotype is not None and genotype not in vocabulary:
+                if len(vocabulary) >= self.genotype_slots:
+                    raise Exception(f'More than {self.genotype_slots} distinct genotypes in the openSNP files.')
+                vocabulary[genotype] = len(vocabulary)
+            ids.append(-1 if genotype is None else vocabulary[genotype])
+        return np.array(ids, dtype=np.int64)
+
+    def _sum_sorted(self, keys:np.ndarray, counts:np.ndarray):
+        # keys come in as a few already sorted runs, which the stable sort merges in close to linear time
+        order = np.argsort(keys, kind='stable')
+        keys, counts = keys[order], counts[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=keys[:1] - 1)) if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+        return keys[starts], np.add.reduceat(counts, starts) if len(starts) > 0 else counts[:0]
+
+    def _batch_genotype_counts(self, matrix:GenotypeMatrix, vocabulary:dict):
+        # counts come back keyed rsid_key * genotype_slots + genotype id, sorted
+        chunk = self._options.opensnp_reduce_chunk
+        code_ids = self._genotype_ids(matrix.codebook[1:GenotypeMatrix.exception_code], vocabulary)
+        variant_keys = np.asarray(matrix.variant_keys)
+        keys, counts = [], []
+        for start in range(0, matrix.shape[1], chunk):
+            codes = matrix.codes(variants=slice(start, start + chunk))
+            for code, genotype_id in enumerate(code_ids, start=1):
+                if genotype_id < 0:
+                    continue
+                code_counts = (codes == code).sum(axis=0)
+                present = np.flatnonzero(code_counts)
+                keys.append(variant_keys[present + start] * self.genotype_slots + genotype_id)
+                counts.append(code_counts[present].astype(np.int64))
+
+        exception_ids = self._genotype_ids(matrix.exception_codebook, vocabulary)[np.asarray(matrix.exceptions['code'])]
+        called = exception_ids >= 0
+        keys.append(variant_keys[np.asarray(matrix.exceptions['variant'])[called]] * self.genotype_slots + exception_ids[called])
+        counts.append(np.ones(called.sum(), dtype=np.int64))
+        return self._sum_sorted(np.concatenate(keys), np.concatenate(counts))
+
+    def _reduced_batches(self, path):
+        # a torn output counts as never reduced, so it's reduced again
+        if not is_intact(path):
+            return None
+        metadata = pq.read_schema(path).metadata or {}
+        return metadata.get(b'opensnp_batches', b'').decode()
+
+    def _write_with_batches(self, dataframe:pd.DataFrame, path, batches):
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'opensnp_batches': batches.encode()})
+        with atomic_write(path) as temp_path:
+            pq.write_table(table, temp_path)
+
+    def reduce(self, force=False):
+        # Folds every finished batch into per-rsid genotype counts (frequency_raw_combined_parquet) and allele
+        # frequencies (frequency_combined_refined). Only the running totals are held, one batch is read at a time.
+        progress = self.load_progress()
+        batches = sorted(progress.loc[progress['status'] == 'done', 'batch'].unique().tolist())
+        batches_key = ','.join(str(x) for x in batches)
+        raw_path, refined_path = self._options.frequency_raw_combined_parquet, self._options.frequency_combined_refined
+        if not force and self._reduced_batches(raw_path) == batches_key and self._reduced_batches(refined_path) == batches_key:
+            return False
+
+        vocabulary = {}
+        keys, counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        with self._instrumentation.span('opensnp.reduce') as span:
+            for batch in batches:
+                matrix = GenotypeMatrix.load(self.batch_path(batch))
+                span.add_rows(matrix.shape[0])
+                batch_keys, batch_counts = self._batch_genotype_counts(matrix, vocabulary)
+                keys, counts = self._sum_sorted(np.concatenate([keys, batch_keys]), np.concatenate([counts, batch_counts]))
+                del matrix
+
+        with self._instrumentation.span('opensnp.write_frequencies', rows=len(keys)):
+            # genotype ids were handed out as they turned up, renumbering them alphabetically sorts the output by rsid then genotype
+            genotypes = np.array(sorted(vocabulary), dtype=object)
+            renumber = np.array([int(np.searchsorted(genotypes, x)) for x in vocabulary] + [0], dtype=np.int64)
+            keys = keys // self.genotype_slots * self.genotype_slots + renumber[keys % self.genotype_slots]
+            order = np.argsort(keys, kind='stable')
+            keys, counts = keys[order], counts[order]
+            rsid_keys, genotype_ids = keys // self.genotype_slots, keys % self.genotype_slots
+            self._write_with_batches(self._genotype_frequencies(rsid_keys, genotype_ids, genotypes, counts), raw_path, batches_key)
+            self._write_with_batches(self._allele_frequencies(rsid_keys, genotype_ids, genotypes, counts), refined_path, batches_key)
+        return True
+
+    def _per_rsid_totals(self, rsid_keys:np.ndarray, counts:np.ndarray):
+        starts = np.flatnonzero(np.diff(rsid_keys, prepend=rsid_keys[:1] - 1)) if len(rsid_keys) > 0 else np.zeros(0, dtype=np.int64)
+        totals = np.add.reduceat(counts, starts) if len(starts) > 0 else counts[:0]
+        return np.repeat(totals, np.diff(np.append(starts, len(rsid_keys))))
+
+    def _genotype_frequencies(self, rsid_keys:np.ndarray, genotype_ids:np.ndarray, genotypes:np.ndarray, counts:np.ndarray):
+        samples = self._per_rsid_totals(rsid_keys, counts)
+        return pd.DataFrame({
+            'rsid': key_to_rsid(rsid_keys),
+            'genotype': pd.Categorical.from_codes(genotype_ids, genotypes) if len(genotypes) > 0 else pd.Categorical([]),
+            'count': counts,
+            'samples': samples,
+            'frequency': counts / np.maximum(samples, 1),
+        })
+
+    def _allele_frequencies(self, rsid_keys:np.ndarray, genotype_ids:np.ndarray, genotypes:np.ndarray, counts:np.ndarray):
+        # each genotype contributes one allele per character, so haploid calls (X and Y in men, MT) count once
+        alleles = sorted({a for g in genotypes for a in g})
+        allele_lookup = {x: i for i, x in enumerate(alleles)}
+        keys, allele_counts = [], []
+        for allele in alleles:
+            copies = np.array([g.count(allele) for g in genotypes] + [0], dtype=np.int64)[genotype_ids]
+            carried = copies > 0
+            keys.append(rsid_keys[carried] * self.genotype_slots + allele_lookup[allele])
+            allele_counts.append(counts[carried] * copies[carried])
+        keys, allele_counts = self._sum_sorted(np.concatenate(keys + [np.zeros(0, dtype=np.int64)]), np.concatenate(allele_counts + [np.zeros(0, dtype=np.int64)]))
+        rsid_keys = keys // self.genotype_slots
+        allele_number = self._per_rsid_totals(rsid_keys, allele_counts)
+        return pd.DataFrame({
+            'rsid': key_to_rsid(rsid_keys),
+            'allele': pd.Categorical.from_codes(keys % self.genotype_slots, alleles) if len(alleles) > 0 else pd.Categorical([]),
+            'allele_count': allele_counts,
+            'allele_number': allele_number,
+            'frequency': allele_counts / np.maximum(allele_number, 1),
+        })
+
+    def run(self, force_reduce=False):
+        self.build_subsets()
+        return self.reduce(force_reduce)